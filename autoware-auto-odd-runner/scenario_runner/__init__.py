@@ -1,3 +1,9 @@
-from .__main__ import main
+def main():
+    # Imported when called rather than with the package: the processes the
+    # scenario localizer spawns import the package, and must not import the
+    # bridge (and the PythonAPI) along
+    from .__main__ import main
+    return main()
+
 
 __all__ = [main]
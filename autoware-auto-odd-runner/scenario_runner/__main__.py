@@ -2,13 +2,18 @@
 """Scenario supervisor controller"""
 
 import argparse
+import concurrent.futures
 import os
 import sys
+import hashlib
 import subprocess
 import logging
 import threading
-from time import sleep
 
+from .download_cache import DEFAULT_CACHE_DIR, DEFAULT_MAX_SIZE_MB, DownloadCache, url_filename
+from .scenario_localizer import ScenarioLocalizer
+from . import scenario_suite
+from .startup_timeline import StartupTimeline
 from .tier4_lgsvl_bridge import Tier4LgSvlBridgeServerThread
 
 
@@ -16,6 +21,12 @@ FORMAT = "[%(levelname)6s] [%(name)s] %(message)s"
 
 SIMULATION_STARTUP_TIMEOUT_SEC = 120
 
+DOWNLOAD_DIR = "/tmp"
+SUITE_DOWNLOAD_DIR = os.path.join(DOWNLOAD_DIR, "scenario_suite")
+
+SUITE_DOWNLOAD_WORKERS = 4
+DEFAULT_SUITE_RESULTS_FILE = "scenario_suite_results.json"
+
 logging.basicConfig(level=logging.DEBUG, format=FORMAT)
 log = logging.getLogger("scenario_runner")
 
@@ -32,113 +43,197 @@ def setup_log_levels(log_level):
 
 def parse_args():
     description = 'Run the TierIV ODD scenarios in SVL Simulator'
-    scenario_file_description = 'TierIV (*.yaml) or OpenDrive (*.xosc) scenario file URL'
-    lanelet_file_description = 'Lanelet2 (*.osm) HD map file URL'
+    scenario_file_description = 'TierIV (*.yaml) or OpenDrive (*.xosc) scenario file URL or path'
+    lanelet_file_description = 'Lanelet2 (*.osm) HD map file URL or path'
 
     parser = argparse.ArgumentParser(os.path.basename(sys.argv[0]),
                                      description=description)
 
-    parser.add_argument('scenario_file_url', metavar='SCENARIO_FILE_URL', type=str,
+    parser.add_argument('scenario_file_url', metavar='SCENARIO_FILE_URL', type=str, nargs='?',
                         help=scenario_file_description)
 
-    parser.add_argument('hd_map_file_url', metavar='HD_MAP_FILE_URL', type=str,
+    parser.add_argument('hd_map_file_url', metavar='HD_MAP_FILE_URL', type=str, nargs='?',
                         help=lanelet_file_description)
 
+    parser.add_argument('--suite', metavar='MANIFEST', type=str,
+                        help="Run the scenarios of this manifest with one bridge instead, see README.md")
+
+    parser.add_argument('--results', metavar='FILE', type=str, default=DEFAULT_SUITE_RESULTS_FILE,
+                        help="File to write the suite results to")
+
     parser.add_argument('--log-level', '-L', metavar='LEVEL', type=str,
                         default='INFO', help="Logging level")
 
     return parser.parse_args()
 
 
-def localize_yaml_scenario(scenario_filename,
-                           abs_map_filepath,
-                           localized_scenario_filename):
-    '''
-    Replaces the 'isEgo' parameter "true" value with the "false"
-    Replaces the map path with the local absolute one
-    '''
-    fin = open(scenario_filename, "rt")
-    fout = open(localized_scenario_filename, "wt")
-    for line in fin:
-        if not ".osm" in line:
-            # We rely on there is only 1 'true' value in a scenario and
-            # it is the 'isEgo' parameter. TBD.
-            fout.write(line.replace("value: 'true'", "value: 'false'"))
-        else:
-            # We presume there is only 1 line containing the .osm map path
-            # in a scenario and it looks like:
-            # '      filepath: lanelet2_map.osm'
-            # so we just replace it with the known absolute path to the
-            # downloaded map
-            fout.write(f"      filepath: {abs_map_filepath}\n")
-    fin.close()
-    fout.close()
+def download_cache():
+    return DownloadCache(os.environ.get("LGSVL__RUNNER_CACHE_DIR", DEFAULT_CACHE_DIR),
+                         int(os.environ.get("LGSVL__RUNNER_CACHE_SIZE_MB", DEFAULT_MAX_SIZE_MB)) << 20)
 
 
-def main():
-    args = parse_args()
+def scenario_localizer():
+    return ScenarioLocalizer(os.environ.get("LGSVL__RUNNER_CACHE_DIR", DEFAULT_CACHE_DIR))
 
-    setup_log_levels(args.log_level.upper())
 
-    scenario_filename = os.path.basename(args.scenario_file_url)
-    hd_map_filename = os.path.basename(args.hd_map_file_url)
+def download(cache, url, directory=DOWNLOAD_DIR):
+    try:
+        return cache.fetch(url, directory)
+    except (OSError, RuntimeError) as e:
+        raise RuntimeError(f"Failed to download URL '{url}': {e}")
 
-    if scenario_filename[-5:] not in [".yaml", ".xosc"]:
-        log.error("Impossible to process scenario file of unknown type "
-                  f"'{scenario_filename}', expected *.yaml or *.xosc")
-        sys.exit(1)
 
-    if hd_map_filename[-4:] != ".osm":
-        log.error("Impossible to process HD map file of unknown type "
-                  f"'{hd_map_filename}', expected *.osm")
-        sys.exit(1)
+def start_bridge(timeline, scene=None):
+    bridge_started_up = threading.Event()
+    bridge_server_thread = Tier4LgSvlBridgeServerThread(bridge_started_up, startup_timeline=timeline, scene=scene)
+    bridge_server_thread.daemon = True
+    bridge_server_thread.start()
+    return bridge_server_thread
 
-    for url in [args.scenario_file_url, args.hd_map_file_url]:
-        command = ["wget", "-nc",
-                   "--tries", "0",
-                   "-P", "/tmp",
-                   "--read-timeout", "5",
-                   url,
-                   "--no-check-certificate"]
-        download_status = subprocess.call(command)
-        print(download_status)
-        if download_status != 0:
-            log.error(f"Failed to download URL '{url}'")
-            sys.exit(1)
 
-    abs_scenario_filename = f"/tmp/{scenario_filename}"
-    abs_hd_map_filename = f"/tmp/{hd_map_filename}"
-    abs_localized_scenario_filename = f"/tmp/localized_{scenario_filename}"
+def wait_for_bridge(bridge_server_thread, timeline):
+    # Set by the bridge thread once it has started up or failed to
+    with timeline.phase("wait for the bridge"):
+        bridge_server_thread.startup_completed.wait(max(0.0, SIMULATION_STARTUP_TIMEOUT_SEC - timeline.elapsed()))
+    if not bridge_server_thread.startup_completed.is_set():
+        raise RuntimeError(f"The bridge and LG SVL Simulator have not initialized in "
+                           f"{SIMULATION_STARTUP_TIMEOUT_SEC} seconds")
+    if bridge_server_thread.startup_error is not None:
+        raise RuntimeError(f"Failed to complete the bridge startup ({bridge_server_thread.startup_error!r}), "
+                           "can not proceed.")
 
-    localize_yaml_scenario(abs_scenario_filename,
-                           abs_hd_map_filename,
-                           abs_localized_scenario_filename)
 
-    bridge_started_up = threading.Event()
+def start_up(scenario_file_url, hd_map_file_url):
+    '''
+    Downloads the scenario and the HD map (or takes them from the download
+    cache) while the bridge connects to the simulator, loads the scene and
+    binds its ports; returns the localized scenario file and the bridge thread
+    once all of them are done. Raises RuntimeError on a failed download or
+    bridge startup.
+    '''
+    timeline = StartupTimeline()
+    cache = download_cache()
+    try:
+        with concurrent.futures.ThreadPoolExecutor(thread_name_prefix="download") as downloads:
+            scenario_download, hd_map_download = [
+                downloads.submit(timeline.timed, f"download {url_filename(url)}", download, cache, url)
+                for url in [scenario_file_url, hd_map_file_url]]
+            bridge_server_thread = start_bridge(timeline)
+            abs_scenario_filename = scenario_download.result()
+            abs_hd_map_filename = hd_map_download.result()
+
+        with timeline.phase("localize the scenario"):
+            try:
+                abs_localized_scenario_filename = scenario_localizer().localize(abs_scenario_filename,
+                                                                                abs_hd_map_filename)
+            except (OSError, ValueError) as e:
+                raise RuntimeError(str(e))
+
+        wait_for_bridge(bridge_server_thread, timeline)
+    finally:
+        log.info(timeline.summary())
+    return abs_localized_scenario_filename, bridge_server_thread
+
+
+def run_scenario(abs_localized_scenario_filename):
+    ros_command = ["ros2", "launch", "scenario_test_runner", "scenario_test_runner.launch.py",
+                   f'scenario:={abs_localized_scenario_filename}',
+                   "launch_rviz:=false"]
+    return subprocess.call(ros_command)
 
-    bridge_server_thread = Tier4LgSvlBridgeServerThread(bridge_started_up)
-    bridge_server_thread.setDaemon(True)
-    bridge_server_thread.start()
 
-    for i in range(0, SIMULATION_STARTUP_TIMEOUT_SEC):
-        if not bridge_server_thread.isAlive():
-            logging.error("Failed to complete the bridge startup, can not proceed.")
+def run_suite(manifest_filename, results_filename):
+    '''
+    Runs the scenarios of the manifest with one bridge, the scenarios of a
+    scene one after another. All the downloads start with the bridge, and
+    the scenarios are localized in a batch meanwhile. Returns whether
+    all the scenarios passed, raises RuntimeError on a failed bridge startup.
+    '''
+    scenarios = scenario_suite.group_by_scene(scenario_suite.load_manifest(manifest_filename))
+    timeline = StartupTimeline()
+    cache = download_cache()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=SUITE_DOWNLOAD_WORKERS,
+                                               thread_name_prefix="download") as downloads:
+        # The scenarios sharing a map share its download. Every URL gets a
+        # directory of its own, as the maps tend to have the same file name,
+        # the same one every run, so that the localized scenarios are cached
+        fetched = {}
+        for scenario in scenarios:
+            for url in [scenario.scenario_url, scenario.hd_map_url]:
+                if url not in fetched:
+                    directory = os.path.join(SUITE_DOWNLOAD_DIR, hashlib.sha256(url.encode()).hexdigest()[:16])
+                    os.makedirs(directory, exist_ok=True)
+                    fetched[url] = downloads.submit(download, cache, url, directory)
+        bridge_server_thread = start_bridge(timeline, scenarios[0].scene)
+        try:
+            # Scenario index -> the localized scenario file future, or the download error
+            localized = {}
+            with timeline.phase("localize the scenarios"):
+                downloaded = []
+                for scenario in scenarios:
+                    try:
+                        downloaded.append((scenario, fetched[scenario.scenario_url].result(),
+                                           fetched[scenario.hd_map_url].result()))
+                    except RuntimeError as e:
+                        localized[scenario.index] = e
+                localizations = scenario_localizer().localize_all(
+                    [(scenario_filename, hd_map_filename) for _, scenario_filename, hd_map_filename in downloaded])
+                for (scenario, _, _), localization in zip(downloaded, localizations):
+                    localized[scenario.index] = localization
+            wait_for_bridge(bridge_server_thread, timeline)
+        finally:
+            log.info(timeline.summary())
+
+    def prepare(scenario):
+        if isinstance(localized[scenario.index], Exception):
+            raise localized[scenario.index]
+        abs_localized_scenario_filename = localized[scenario.index].result()
+        # Loaded (or reset, if it is loaded already) by the scenario's initialize request
+        bridge_server_thread.set_scene(scenario.scene)
+        return abs_localized_scenario_filename
+
+    suite = scenario_suite.ScenarioSuite(prepare, run_scenario, bridge_server_thread.is_alive, results_filename)
+    try:
+        return suite.run(scenarios)
+    finally:
+        bridge_server_thread.stop()
+
+
+def main():
+    args = parse_args()
+
+    setup_log_levels(args.log_level.upper())
+
+    if args.suite:
+        try:
+            return 0 if run_suite(args.suite, args.results) else 1
+        except (OSError, ValueError, RuntimeError) as e:
+            log.error(str(e))
             sys.exit(1)
-        logging.info("Waiting for the bridge and LG SVL Simulator to initialize, "
-                     f"{i+1} of {SIMULATION_STARTUP_TIMEOUT_SEC} seconds ...")
-        sleep(1)
-        if bridge_started_up.is_set():
-            break
 
-    if not bridge_started_up.is_set():
-        logging.error("Failed to run ROS scenario")
-        return -1
+    if args.scenario_file_url is None or args.hd_map_file_url is None:
+        log.error("Expected the SCENARIO_FILE_URL and HD_MAP_FILE_URL, or a --suite manifest")
+        sys.exit(1)
+
+    scenario_filename = url_filename(args.scenario_file_url)
+    try:
+        scenario_suite.check_file_types(scenario_filename, url_filename(args.hd_map_file_url))
+    except ValueError as e:
+        log.error(str(e))
+        sys.exit(1)
+
+    try:
+        abs_localized_scenario_filename, bridge_server_thread = start_up(args.scenario_file_url,
+                                                                         args.hd_map_file_url)
+    except RuntimeError as e:
+        log.error(str(e))
+        sys.exit(1)
 
     logging.info(f"Running the ODD scenario '{scenario_filename}'...")
-    ros_command = ["ros2", "launch", "scenario_test_runner", "scenario_test_runner.launch.py",
-                   f'scenario:={abs_localized_scenario_filename}',
-                   "launch_rviz:=false"]
-    return subprocess.call(ros_command)
+    try:
+        return run_scenario(abs_localized_scenario_filename)
+    finally:
+        bridge_server_thread.stop()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,152 @@
+#
+# Copyright (c) 2021 LG Electronics, Inc.
+#
+# This software contains code licensed as described in LICENSE.
+#
+
+"""
+Pre-spawned NPC and pedestrian agents of the TierIV bridge, so that spawning
+and despawning an entity during a scenario is a teleport of a pooled agent
+instead of the slow lgsvl.Simulator.add_agent() and remove_agent() calls.
+"""
+
+import itertools
+import logging
+import threading
+import time
+
+import lgsvl
+
+
+log = logging.getLogger(__name__)
+
+# The PythonAPI can not hide an agent, so the parked agents are moved far below
+# the scene, in a row spaced by PARKING_SPACING_M
+PARKING_POSITION = lgsvl.Vector(0, -1000, 0)
+PARKING_SPACING_M = 10
+
+# Nor can it turn an agent's physics off, so the parked agents fall under the
+# scene; every this many simulation seconds they are put back in their parking
+# slots at rest, which bounds the fall to about half a kilometer
+PARKING_PIN_INTERVAL_SEC = 10
+
+
+class AgentPool():
+    """
+    Keeps up to 'size' parked agents per configuration. Warmed with
+    warm(), which is to be called after every scene (re)load as the simulator
+    removes all the agents on a load or reset. acquire() and release() replace
+    add_agent() and remove_agent(); hits and misses are counted in 'metrics'
+    (a BridgeMetrics) as agent_pool_hits and agent_pool_misses.
+
+    With a zero size the pool is disabled and the agents are added and removed
+    as they are requested.
+    """
+    def __init__(self, size=0, metrics=None):
+        self.size = size
+        self.metrics = metrics
+        # acquire() and release() may run on the polling thread and the simulator
+        # worker concurrently in the pipelined mode; the simulator calls are made
+        # outside of the lock
+        self.lock = threading.Lock()
+        self.parked = {}
+        self.configurations = {}
+        # Every pooled agent has a parking slot of its own
+        self.parking_slots = {}
+        self.slots = itertools.count()
+        self.last_pin_time = None
+
+    def clear(self):
+        with self.lock:
+            self.parked.clear()
+            self.configurations.clear()
+            self.parking_slots.clear()
+            self.slots = itertools.count()
+            self.last_pin_time = None
+
+    def parking_state(self, slot):
+        # At rest, whatever the agent's velocity when it is parked
+        return lgsvl.AgentState(
+            transform=lgsvl.Transform(
+                lgsvl.Vector(PARKING_POSITION.x + slot * PARKING_SPACING_M, PARKING_POSITION.y, PARKING_POSITION.z),
+                lgsvl.Vector(0, 0, 0)),
+            velocity=lgsvl.Vector(0, 0, 0),
+            angular_velocity=lgsvl.Vector(0, 0, 0))
+
+    def add_agent(self, sim, configuration, agent_type, agent_state=None):
+        slot = next(self.slots)
+        agent = sim.add_agent(configuration, agent_type, agent_state or self.parking_state(slot))
+        with self.lock:
+            self.parking_slots[agent.uid] = slot
+            self.configurations[agent.uid] = configuration
+        return agent
+
+    def warm(self, sim, configurations):
+        """'configurations' maps an lgsvl.AgentType to the configuration names"""
+        self.clear()
+        if not self.size:
+            return
+        started = time.perf_counter()
+        for agent_type, names in configurations.items():
+            for configuration in names:
+                agents = [self.add_agent(sim, configuration, agent_type) for _ in range(self.size)]
+                with self.lock:
+                    self.parked[configuration] = agents
+        log.info(f"Agent pool warmed with {self.size} agent(s) of each of "
+                 f"{sum(len(names) for names in configurations.values())} configurations in "
+                 f"{time.perf_counter() - started:.2f} s")
+
+    def acquire(self, sim, configuration, agent_type, agent_state):
+        if not self.size:
+            return sim.add_agent(configuration, agent_type, agent_state)
+        with self.lock:
+            parked = self.parked.get(configuration)
+            agent = parked.pop() if parked else None
+        if agent is None:
+            self.count("agent_pool_misses")
+            return self.add_agent(sim, configuration, agent_type, agent_state)
+        self.count("agent_pool_hits")
+        # The whole state is set, so the velocity the agent has picked up falling
+        # while parked is replaced by the spawn one
+        agent.state = agent_state
+        return agent
+
+    def release(self, sim, agent):
+        if not self.size:
+            return sim.remove_agent(agent)
+        with self.lock:
+            configuration = self.configurations.get(agent.uid)
+            parked = self.parked.setdefault(configuration, []) if configuration else None
+            slot = self.parking_slots.get(agent.uid)
+            if parked is None or len(parked) >= self.size:
+                self.configurations.pop(agent.uid, None)
+                self.parking_slots.pop(agent.uid, None)
+                parked = None
+        if parked is None:
+            return sim.remove_agent(agent)
+        agent.state = self.parking_state(slot)
+        with self.lock:
+            parked.append(agent)
+
+    def pin_parked(self, current_time):
+        """
+        Puts the parked agents back in their slots at rest every
+        PARKING_PIN_INTERVAL_SEC of simulation time; to be called after the
+        simulation steps. Returns the number of simulator calls made.
+        """
+        if not self.size:
+            return 0
+        with self.lock:
+            if self.last_pin_time is not None and \
+                    self.last_pin_time <= current_time < self.last_pin_time + PARKING_PIN_INTERVAL_SEC:
+                return 0
+            self.last_pin_time = current_time
+            parked = [(agent, self.parking_slots[agent.uid])
+                      for agents in self.parked.values() for agent in agents]
+        for agent, slot in parked:
+            agent.state = self.parking_state(slot)
+        return len(parked)
+
+    def count(self, counter):
+        if self.metrics:
+            self.metrics.count(counter)
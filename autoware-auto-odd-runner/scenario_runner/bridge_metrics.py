@@ -0,0 +1,244 @@
+#
+# Copyright (c) 2021 LG Electronics, Inc.
+#
+# This software contains code licensed as described in LICENSE.
+#
+
+"""
+Latency histograms and frame-time telemetry of the TierIV bridge, exported as
+a JSON file and a Prometheus textfile (for the node_exporter textfile
+collector).
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+
+
+log = logging.getLogger(__name__)
+
+REQUEST_PHASES = ["parse", "handle", "serialize", "send"]
+
+FRAME_SERIES = {
+    "interval": "time between consecutive UpdateFrame requests",
+    "step": "simulation step duration, state flush and snapshot included",
+    "pacing_sleep": "time slept to keep to the requested realtime factor",
+    "pacing_lateness": "how late a frame came on the realtime factor schedule",
+}
+
+REPORTED_PERCENTILES = [50, 95, 99]
+
+METRICS_JSON_FILENAME = "tier4_bridge_metrics.json"
+METRICS_PROMETHEUS_FILENAME = "tier4_bridge_metrics.prom"
+
+
+class LatencyHistogram():
+    """
+    HDR-style histogram of durations recorded with a microsecond resolution.
+    Values below 2^sub_bucket_bits microseconds are counted exactly; every
+    next power-of-two range is split into 2^(sub_bucket_bits - 1) linear
+    sub-buckets, so the relative error is bounded by 2^-(sub_bucket_bits - 1)
+    regardless of the value magnitude.
+    """
+    def __init__(self, sub_bucket_bits=8):
+        self.sub_bucket_bits = sub_bucket_bits
+        self.sub_bucket_count = 1 << sub_bucket_bits
+        self.half_sub_bucket_count = self.sub_bucket_count >> 1
+        self.counts = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def bucket_index(self, value_us):
+        if value_us < self.sub_bucket_count:
+            return value_us
+        shift = value_us.bit_length() - self.sub_bucket_bits
+        sub_bucket = value_us >> shift
+        return self.sub_bucket_count + (shift - 1) * self.half_sub_bucket_count \
+            + sub_bucket - self.half_sub_bucket_count
+
+    def bucket_value(self, index):
+        # The middle of the bucket range, in microseconds
+        if index < self.sub_bucket_count:
+            return index
+        shift = (index - self.sub_bucket_count) // self.half_sub_bucket_count + 1
+        sub_bucket = (index - self.sub_bucket_count) % self.half_sub_bucket_count \
+            + self.half_sub_bucket_count
+        return ((sub_bucket << shift) + ((sub_bucket + 1) << shift) - 1) / 2
+
+    def record(self, seconds):
+        index = self.bucket_index(max(0, int(seconds * 1e6)))
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, percent):
+        if not self.count:
+            return 0.0
+        threshold = self.count * percent / 100
+        accumulated = 0
+        for index in sorted(self.counts):
+            accumulated += self.counts[index]
+            if accumulated >= threshold:
+                return min(self.bucket_value(index) / 1e6, self.max)
+        return self.max
+
+    def summary(self):
+        result = {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else 0.0,
+            "max": self.max,
+            "sum": self.total,
+        }
+        for percent in REPORTED_PERCENTILES:
+            result[f"p{percent}"] = self.percentile(percent)
+        return result
+
+
+class BridgeMetrics():
+    """
+    Per-port histograms of the request phases (parse, handle, serialize, send),
+    frame-time histograms, see FRAME_SERIES, per-sensor histograms of the
+    scheduling lag (in simulation time), named event counters and gauges. The
+    metrics are recorded from the polling thread, the event loop and the
+    simulator worker, hence the lock.
+    """
+    def __init__(self, port_names, output_dir=None, write_interval=10):
+        self.port_names = port_names
+        self.output_dir = output_dir
+        self.write_interval = write_interval
+        self.lock = threading.Lock()
+        self.requests = {port: {phase: LatencyHistogram() for phase in REQUEST_PHASES}
+                         for port in port_names}
+        self.frames = {series: LatencyHistogram() for series in FRAME_SERIES}
+        self.sensor_lags = {}
+        self.counters = {}
+        self.gauges = {}
+        self.last_frame_time = None
+        self.last_write_time = time.monotonic()
+
+    def record(self, port, phase, seconds):
+        with self.lock:
+            self.requests[port][phase].record(seconds)
+
+    def record_frame_request(self):
+        now = time.perf_counter()
+        with self.lock:
+            if self.last_frame_time is not None:
+                self.frames["interval"].record(now - self.last_frame_time)
+            self.last_frame_time = now
+
+    def record_frame_step(self, seconds):
+        self.record_frame_series("step", seconds)
+
+    def record_frame_series(self, series, seconds):
+        with self.lock:
+            self.frames[series].record(seconds)
+
+    def record_sensor_lag(self, sensor, seconds):
+        with self.lock:
+            histogram = self.sensor_lags.get(sensor)
+            if histogram is None:
+                histogram = self.sensor_lags[sensor] = LatencyHistogram()
+            histogram.record(seconds)
+
+    def count(self, counter, increment=1):
+        with self.lock:
+            self.counters[counter] = self.counters.get(counter, 0) + increment
+
+    def set_gauge(self, gauge, value):
+        with self.lock:
+            self.gauges[gauge] = value
+
+    def summary(self):
+        with self.lock:
+            return {
+                "timestamp": time.time(),
+                "requests": {
+                    str(port): {
+                        "api": self.port_names[port],
+                        "phases": {phase: histogram.summary()
+                                   for phase, histogram in phases.items()},
+                    }
+                    for port, phases in self.requests.items()
+                    if phases["handle"].count
+                },
+                "frames": {series: histogram.summary()
+                           for series, histogram in self.frames.items()},
+                "sensor_lags": {sensor: histogram.summary()
+                                for sensor, histogram in self.sensor_lags.items()},
+                "counters": dict(self.counters),
+                "gauges": dict(self.gauges),
+            }
+
+    def to_prometheus(self, summary):
+        lines = [
+            "# HELP tier4_bridge_request_phase_seconds TierIV bridge request handling phase duration",
+            "# TYPE tier4_bridge_request_phase_seconds summary",
+        ]
+        for port, port_summary in summary["requests"].items():
+            for phase, stats in port_summary["phases"].items():
+                labels = f'port="{port}",api="{port_summary["api"]}",phase="{phase}"'
+                for percent in REPORTED_PERCENTILES:
+                    lines.append(f'tier4_bridge_request_phase_seconds{{{labels},quantile="{percent / 100}"}}'
+                                 f' {stats[f"p{percent}"]:.9f}')
+                lines.append(f"tier4_bridge_request_phase_seconds_sum{{{labels}}} {stats['sum']:.9f}")
+                lines.append(f"tier4_bridge_request_phase_seconds_count{{{labels}}} {stats['count']}")
+
+        lines.append("# HELP tier4_bridge_frame_seconds TierIV bridge frame timing")
+        lines.append("# TYPE tier4_bridge_frame_seconds summary")
+        for series, stats in summary["frames"].items():
+            labels = f'series="{series}"'
+            for percent in REPORTED_PERCENTILES:
+                lines.append(f'tier4_bridge_frame_seconds{{{labels},quantile="{percent / 100}"}}'
+                             f' {stats[f"p{percent}"]:.9f}')
+            lines.append(f"tier4_bridge_frame_seconds_sum{{{labels}}} {stats['sum']:.9f}")
+            lines.append(f"tier4_bridge_frame_seconds_count{{{labels}}} {stats['count']}")
+
+        if summary["sensor_lags"]:
+            lines.append("# HELP tier4_bridge_sensor_lag_seconds Simulation time a sensor update was late by")
+            lines.append("# TYPE tier4_bridge_sensor_lag_seconds summary")
+        for sensor, stats in summary["sensor_lags"].items():
+            labels = f'sensor="{sensor}"'
+            for percent in REPORTED_PERCENTILES:
+                lines.append(f'tier4_bridge_sensor_lag_seconds{{{labels},quantile="{percent / 100}"}}'
+                             f' {stats[f"p{percent}"]:.9f}')
+            lines.append(f"tier4_bridge_sensor_lag_seconds_sum{{{labels}}} {stats['sum']:.9f}")
+            lines.append(f"tier4_bridge_sensor_lag_seconds_count{{{labels}}} {stats['count']}")
+
+        for counter, value in sorted(summary["counters"].items()):
+            lines.append(f"# TYPE tier4_bridge_{counter}_total counter")
+            lines.append(f"tier4_bridge_{counter}_total {value}")
+        for gauge, value in sorted(summary["gauges"].items()):
+            lines.append(f"# TYPE tier4_bridge_{gauge} gauge")
+            lines.append(f"tier4_bridge_{gauge} {value:.9g}")
+        return "\n".join(lines) + "\n"
+
+    def write(self):
+        if not self.output_dir:
+            return
+        self.last_write_time = time.monotonic()
+        summary = self.summary()
+        try:
+            os.makedirs(self.output_dir, exist_ok=True)
+            write_atomically(os.path.join(self.output_dir, METRICS_JSON_FILENAME),
+                             json.dumps(summary, indent=2))
+            write_atomically(os.path.join(self.output_dir, METRICS_PROMETHEUS_FILENAME),
+                             self.to_prometheus(summary))
+        except OSError as e:
+            log.error(f"Failed to write the bridge metrics to '{self.output_dir}': {e}")
+
+    def write_if_due(self):
+        if time.monotonic() - self.last_write_time >= self.write_interval:
+            self.write()
+
+
+def write_atomically(filename, content):
+    # The textfile collector may read a file at any moment, never give it a partial one
+    temporary_filename = f"{filename}.{os.getpid()}.tmp"
+    with open(temporary_filename, "wt") as f:
+        f.write(content)
+    os.replace(temporary_filename, filename)
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2021 LG Electronics, Inc.
+#
+# This software contains code licensed as described in LICENSE.
+#
+
+"""
+Several TierIV bridges in one process, each binding a port block of its own
+and driving a simulator instance of its own, so that a node runs as many ODD
+scenarios at once as it runs simulators:
+
+    python -m scenario_runner.bridge_supervisor --simulator 127.0.0.1:8181 --simulator 127.0.0.1:8182
+
+The bridge of the simulator i binds the API ports 5555-5565 shifted by
+i * port_stride from the port base, and its sensor streaming port at the same
+offset from its block. The health and frame rate of every bridge are logged
+and, with LGSVL__BRIDGE_METRICS_DIR, written along with the totals to
+tier4_bridge_supervisor.json.
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+try:
+    from . import tier4_lgsvl_bridge
+    from .bridge_metrics import write_atomically
+except ImportError:
+    import tier4_lgsvl_bridge
+    from bridge_metrics import write_atomically
+
+
+log = logging.getLogger(__name__)
+
+DEFAULT_PORT_STRIDE = 100
+
+STARTUP_TIMEOUT_SEC = 120
+
+HEALTH_REPORT_INTERVAL_SEC = 10
+
+# An initialized bridge with no frame for this long is reported as stalled
+STALLED_AFTER_SEC = 30
+
+SUPERVISOR_STATS_FILENAME = "tier4_bridge_supervisor.json"
+
+
+def parse_endpoint(endpoint):
+    """'host:port' -> (host, port)"""
+    host, _, port = endpoint.rpartition(":")
+    if not host or not port.isdigit():
+        raise ValueError(f"'{endpoint}' is not a HOST:PORT simulator endpoint")
+    return host, int(port)
+
+
+class BridgeInstance():
+    """A bridge of the supervisor and the frame count of its last report"""
+    def __init__(self, index, thread, startup_completed):
+        self.index = index
+        self.thread = thread
+        self.startup_completed = startup_completed
+        self.reported_frames = 0
+        self.reported_time = time.perf_counter()
+
+    def stats(self, now):
+        thread = self.thread
+        server = thread.server
+        frames = server.metrics.frames["step"].count if server else 0
+        elapsed = now - self.reported_time
+        last_frame_time = server.metrics.last_frame_time if server else None
+        last_frame_age = now - last_frame_time if last_frame_time is not None else None
+        if not thread.is_alive() or thread.startup_error is not None:
+            status = "dead"
+        elif not self.startup_completed.is_set():
+            status = "starting"
+        elif not server.is_api_initialized:
+            status = "ready"
+        elif last_frame_age is not None and last_frame_age > STALLED_AFTER_SEC:
+            status = "stalled"
+        else:
+            status = "running"
+        stats = {
+            "instance": self.index,
+            "status": status,
+            "simulator": f"{thread.simulator_host}:{thread.simulator_port}",
+            "port_base": thread.port_base,
+            "frames": frames,
+            "frames_per_sec": (frames - self.reported_frames) / elapsed if elapsed > 0 else 0.0,
+            "last_frame_age_sec": last_frame_age,
+        }
+        self.reported_frames = frames
+        self.reported_time = now
+        return stats
+
+
+class Tier4BridgeSupervisor():
+    """
+    Starts a Tier4LgSvlBridgeServerThread per (host, port) of 'simulators'.
+    The metrics, LiDAR scans and traffic recordings of every bridge go to a
+    directory (or file) of its own. The other bridge options are the
+    'bridge_options' keyword arguments of Tier4LgSvlBridgeServerThread, or
+    taken from the environment as for a single bridge.
+    """
+    def __init__(self, simulators, port_base=tier4_lgsvl_bridge.DEFAULT_PORT_BASE,
+                 port_stride=DEFAULT_PORT_STRIDE, metrics_dir=None, lidar_dir=None, record_file=None,
+                 **bridge_options):
+        if port_stride <= tier4_lgsvl_bridge.SENSOR_PUB_PORT_OFFSET:
+            raise ValueError(f"The port stride must be above {tier4_lgsvl_bridge.SENSOR_PUB_PORT_OFFSET}, "
+                             "for the port blocks not to overlap")
+        self.metrics_dir = metrics_dir
+        self.instances = []
+        for index, (simulator_host, simulator_port) in enumerate(simulators):
+            instance_port_base = port_base + index * port_stride
+            instance_lidar_dir = None
+            if lidar_dir:
+                instance_lidar_dir = os.path.join(lidar_dir, f"instance-{index}")
+                os.makedirs(instance_lidar_dir, exist_ok=True)
+            instance_record_file = None
+            if record_file:
+                root, extension = os.path.splitext(record_file)
+                instance_record_file = f"{root}-{index}{extension}"
+            startup_completed = threading.Event()
+            thread = tier4_lgsvl_bridge.Tier4LgSvlBridgeServerThread(
+                startup_completed,
+                metrics_dir=os.path.join(metrics_dir, f"instance-{index}") if metrics_dir else None,
+                record_file=instance_record_file,
+                sensor_pub_address=f"tcp://*:{instance_port_base + tier4_lgsvl_bridge.SENSOR_PUB_PORT_OFFSET}",
+                lidar_dir=instance_lidar_dir,
+                port_base=instance_port_base,
+                simulator_host=simulator_host,
+                simulator_port=simulator_port,
+                name=f"tier4-bridge-{index}",
+                **bridge_options)
+            thread.daemon = True
+            self.instances.append(BridgeInstance(index, thread, startup_completed))
+
+    def start(self, timeout=STARTUP_TIMEOUT_SEC):
+        """Starts all the bridges; raises if any of them has not started up in 'timeout'"""
+        for instance in self.instances:
+            instance.thread.start()
+        deadline = time.monotonic() + timeout
+        failed = []
+        for instance in self.instances:
+            # Also set by a bridge failing to start up, e.g. not finding its simulator
+            completed = instance.startup_completed.wait(max(0.0, deadline - time.monotonic()))
+            if not completed or instance.thread.startup_error is not None:
+                failed.append(instance.index)
+        if failed:
+            raise RuntimeError(f"The bridge instance(s) {failed} have not started up")
+        log.info(f"{len(self.instances)} bridge instance(s) started")
+
+    def stop(self):
+        """Stops all the bridges, each writing its final metrics"""
+        for instance in self.instances:
+            instance.thread.stop()
+
+    def stats(self):
+        now = time.perf_counter()
+        instances = [instance.stats(now) for instance in self.instances]
+        return {
+            "timestamp": time.time(),
+            "instances": instances,
+            "total": {
+                "instances": len(instances),
+                "running": sum(1 for stats in instances if stats["status"] == "running"),
+                "dead": sum(1 for stats in instances if stats["status"] == "dead"),
+                "frames": sum(stats["frames"] for stats in instances),
+                "frames_per_sec": sum(stats["frames_per_sec"] for stats in instances),
+            },
+        }
+
+    def report(self):
+        stats = self.stats()
+        for instance in stats["instances"]:
+            log.info(f"Bridge {instance['instance']} ({instance['simulator']}, ports from "
+                     f"{instance['port_base']}): {instance['status']}, "
+                     f"{instance['frames_per_sec']:.1f} frames/s")
+        total = stats["total"]
+        log.info(f"{total['running']}/{total['instances']} bridge(s) running, "
+                 f"{total['frames_per_sec']:.1f} frames/s in total")
+        if self.metrics_dir:
+            try:
+                os.makedirs(self.metrics_dir, exist_ok=True)
+                write_atomically(os.path.join(self.metrics_dir, SUPERVISOR_STATS_FILENAME),
+                                 json.dumps(stats, indent=2))
+            except OSError as e:
+                log.error(f"Failed to write the supervisor stats to '{self.metrics_dir}': {e}")
+        return stats
+
+    def run(self, report_interval=HEALTH_REPORT_INTERVAL_SEC):
+        self.start()
+        try:
+            while True:
+                time.sleep(report_interval)
+                self.report()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(os.path.basename(sys.argv[0]),
+                                     description='Run a TierIV bridge per SVL Simulator instance')
+    parser.add_argument('--simulator', metavar='HOST:PORT', action='append', type=parse_endpoint,
+                        help='Simulator instance endpoint, repeated for every instance '
+                        '(default: LGSVL__SIMULATOR_HOST:LGSVL__SIMULATOR_PORT)')
+    parser.add_argument('--port-base', type=int,
+                        default=int(os.environ.get("LGSVL__BRIDGE_PORT_BASE", tier4_lgsvl_bridge.DEFAULT_PORT_BASE)),
+                        help='First API port of the first bridge (default: %(default)s)')
+    parser.add_argument('--port-stride', type=int, default=DEFAULT_PORT_STRIDE,
+                        help='Distance between the port blocks of the bridges (default: %(default)s)')
+    parser.add_argument('--report-interval', type=float, default=HEALTH_REPORT_INTERVAL_SEC,
+                        help='Seconds between the health reports (default: %(default)s)')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    simulators = args.simulator
+    if not simulators:
+        simulators = [(os.environ.get("LGSVL__SIMULATOR_HOST", "127.0.0.1"),
+                       int(os.environ.get("LGSVL__SIMULATOR_PORT", 8181)))]
+    supervisor = Tier4BridgeSupervisor(simulators,
+                                       port_base=args.port_base,
+                                       port_stride=args.port_stride,
+                                       metrics_dir=os.environ.get("LGSVL__BRIDGE_METRICS_DIR"),
+                                       lidar_dir=os.environ.get("LGSVL__BRIDGE_LIDAR_DIR"),
+                                       record_file=os.environ.get("LGSVL__BRIDGE_RECORD_FILE"))
+    supervisor.run(args.report_interval)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+#
+# Copyright (c) 2021 LG Electronics, Inc.
+#
+# This software contains code licensed as described in LICENSE.
+#
+
+"""
+A persistent cache of the scenario and HD map downloads, so that the runs of
+the same ODD suite download a file once and keep working offline.
+
+The files are stored by their SHA-256 under 'objects/', and 'index.json' maps
+every URL to the hash and the ETag / Last-Modified of its last download. A
+cached URL is revalidated with a conditional request and downloaded again only
+when changed; a URL ending with '#sha256=<hash>' is not requested at all once
+a file of that hash is cached. The least recently used files are evicted
+beyond the cache size limit. The cache may be shared by concurrent runs.
+"""
+
+import email.utils
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import shutil
+import ssl
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+
+log = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "scenario_runner")
+DEFAULT_MAX_SIZE_MB = 2048
+
+INDEX_FILENAME = "index.json"
+LOCK_FILENAME = "index.lock"
+OBJECTS_DIRNAME = "objects"
+
+READ_TIMEOUT_SEC = 5
+DOWNLOAD_TRIES = 5
+RETRY_DELAY_SEC = 1.0
+CHUNK_SIZE = 1 << 20
+
+EXPECTED_HASH_PREFIX = "sha256="
+
+
+def is_remote(url):
+    return urllib.parse.urlsplit(url).scheme in ("http", "https")
+
+
+def local_path(url):
+    """The path of a 'file://' URL or a local path"""
+    parts = urllib.parse.urlsplit(url)
+    if parts.scheme == "file":
+        return urllib.request.url2pathname(parts.path)
+    return url
+
+
+def url_filename(url):
+    return os.path.basename(urllib.parse.urlsplit(url).path)
+
+
+def split_expected_hash(url):
+    """'<url>#sha256=<hash>' -> ('<url>', '<hash>'); the hash is None with no such fragment"""
+    parts = urllib.parse.urlsplit(url)
+    if parts.fragment.startswith(EXPECTED_HASH_PREFIX):
+        return parts._replace(fragment="").geturl(), parts.fragment[len(EXPECTED_HASH_PREFIX):].lower()
+    return url, None
+
+
+class DownloadCache():
+    """
+    fetch() returns a local file with the content of a URL, from the cache
+    'cache_dir' of up to 'max_size' bytes if possible. The URLs are fetched
+    with the certificates unchecked, as the runner did with wget.
+    """
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_size=DEFAULT_MAX_SIZE_MB << 20,
+                 tries=DOWNLOAD_TRIES, timeout=READ_TIMEOUT_SEC):
+        self.cache_dir = cache_dir
+        self.objects_dir = os.path.join(cache_dir, OBJECTS_DIRNAME)
+        self.max_size = max_size
+        self.tries = tries
+        self.timeout = timeout
+        self.ssl_context = ssl._create_unverified_context()
+        # The file lock serializes the index updates of concurrent runs, this
+        # one those of the threads of a run
+        self.lock = threading.Lock()
+        os.makedirs(self.objects_dir, exist_ok=True)
+
+    def fetch(self, url, output_dir):
+        """
+        Returns the path of a file with the content of 'url': the file itself
+        for a local path or a 'file://' URL, otherwise a link to (or a copy of)
+        the cached file named after the URL in 'output_dir'
+        """
+        if not is_remote(url):
+            path = local_path(url)
+            if not os.path.isfile(path):
+                raise FileNotFoundError(f"No file '{path}'")
+            return path
+        url, expected_hash = split_expected_hash(url)
+        sha256 = self.cached_object(url, expected_hash)
+        if sha256 is None:
+            sha256 = self.download(url, expected_hash)
+        return self.materialize(sha256, os.path.join(output_dir, url_filename(url)))
+
+    def cached_object(self, url, expected_hash):
+        """The hash of the valid cached content of 'url', None if it is to be downloaded"""
+        if expected_hash and os.path.isfile(self.object_path(expected_hash)):
+            log.info(f"'{url}' is cached, sha256 {expected_hash}")
+            self.touch(url, expected_hash)
+            return expected_hash
+        entry = self.update_index(lambda index: index.get(url))
+        if not entry or not self.is_valid_object(entry["sha256"], entry["size"]):
+            return None
+        if expected_hash and entry["sha256"] != expected_hash:
+            return None
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        try:
+            with urllib.request.urlopen(urllib.request.Request(url, headers=headers, method="HEAD"),
+                                        timeout=self.timeout, context=self.ssl_context) as response:
+                changed = not self.matches(entry, response.headers)
+        except urllib.error.HTTPError as e:
+            if e.code != 304:
+                log.warning(f"Failed to revalidate the cached '{url}' ({e}), downloading it again")
+                return None
+            changed = False
+        except (urllib.error.URLError, OSError) as e:
+            log.warning(f"Failed to revalidate the cached '{url}' ({e}), using the cached file")
+            changed = False
+        if changed:
+            return None
+        log.info(f"'{url}' is cached, sha256 {entry['sha256']}")
+        self.touch(url, entry["sha256"])
+        return entry["sha256"]
+
+    @staticmethod
+    def matches(entry, headers):
+        if entry.get("etag") and headers.get("ETag"):
+            return headers["ETag"] == entry["etag"]
+        if entry.get("last_modified") and headers.get("Last-Modified"):
+            modified = email.utils.parsedate_to_datetime(headers["Last-Modified"])
+            return modified <= email.utils.parsedate_to_datetime(entry["last_modified"])
+        # No validators: a change of size is the only change to tell by, the
+        # content is trusted otherwise, until its entry is evicted
+        if headers.get("Content-Length"):
+            return int(headers["Content-Length"]) == entry["size"]
+        return True
+
+    def download(self, url, expected_hash):
+        for attempt in range(1, self.tries + 1):
+            try:
+                return self.download_once(url, expected_hash)
+            except (urllib.error.URLError, OSError) as e:
+                if isinstance(e, urllib.error.HTTPError) and e.code < 500:
+                    raise RuntimeError(f"Failed to download URL '{url}': {e}")
+                if attempt == self.tries:
+                    raise RuntimeError(f"Failed to download URL '{url}' in {self.tries} tries: {e}")
+                log.warning(f"Failed to download URL '{url}' ({e}), retrying")
+                time.sleep(RETRY_DELAY_SEC * attempt)
+
+    def download_once(self, url, expected_hash):
+        started = time.perf_counter()
+        hasher = hashlib.sha256()
+        size = 0
+        with urllib.request.urlopen(url, timeout=self.timeout, context=self.ssl_context) as response, \
+                tempfile.NamedTemporaryFile(dir=self.objects_dir, prefix=".download-", delete=False) as f:
+            try:
+                while True:
+                    chunk = response.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    hasher.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+                etag = response.headers.get("ETag")
+                last_modified = response.headers.get("Last-Modified")
+            except BaseException:
+                os.unlink(f.name)
+                raise
+        sha256 = hasher.hexdigest()
+        if expected_hash and sha256 != expected_hash:
+            os.unlink(f.name)
+            raise RuntimeError(f"The content of '{url}' has the sha256 {sha256}, not {expected_hash}")
+        os.replace(f.name, self.object_path(sha256))
+        log.info(f"Downloaded '{url}', {size} bytes in {time.perf_counter() - started:.1f} s, sha256 {sha256}")
+
+        def add_entry(index):
+            index[url] = {"sha256": sha256, "size": size, "etag": etag, "last_modified": last_modified,
+                          "last_used": time.time()}
+            self.evict(index, keep=sha256)
+        self.update_index(add_entry)
+        return sha256
+
+    def touch(self, url, sha256):
+        def set_last_used(index):
+            entry = index.get(url)
+            if entry and entry["sha256"] == sha256:
+                entry["last_used"] = time.time()
+        self.update_index(set_last_used)
+
+    def evict(self, index, keep):
+        """Drops the least recently used objects beyond 'max_size', but 'keep'"""
+        objects = {}
+        for url, entry in index.items():
+            last_used, urls = objects.get(entry["sha256"], (0.0, []))
+            objects[entry["sha256"]] = (max(last_used, entry["last_used"]), urls + [url])
+        sizes = {sha256: index[urls[0]]["size"] for sha256, (_, urls) in objects.items()}
+        total = sum(sizes.values())
+        for sha256, (_, urls) in sorted(objects.items(), key=lambda item: item[1][0]):
+            if total <= self.max_size:
+                break
+            if sha256 == keep:
+                continue
+            for url in urls:
+                del index[url]
+            try:
+                os.unlink(self.object_path(sha256))
+            except FileNotFoundError:
+                pass
+            total -= sizes[sha256]
+            log.info(f"Evicted {', '.join(urls)} from the download cache")
+
+    def update_index(self, update):
+        """Calls update(index) with the index locked and saves the index; returns what update() returns"""
+        index_filename = os.path.join(self.cache_dir, INDEX_FILENAME)
+        with self.lock, open(os.path.join(self.cache_dir, LOCK_FILENAME), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                with open(index_filename) as f:
+                    index = json.load(f)
+            except (FileNotFoundError, ValueError):
+                index = {}
+            result = update(index)
+            with tempfile.NamedTemporaryFile("wt", dir=self.cache_dir, prefix=".index-", delete=False) as f:
+                json.dump(index, f, indent=2)
+            os.replace(f.name, index_filename)
+        return result
+
+    def object_path(self, sha256):
+        return os.path.join(self.objects_dir, sha256)
+
+    def is_valid_object(self, sha256, size):
+        try:
+            return os.path.getsize(self.object_path(sha256)) == size
+        except OSError:
+            return False
+
+    def materialize(self, sha256, path):
+        if os.path.lexists(path):
+            os.unlink(path)
+        try:
+            # The cached objects are never written to, so a hard link will do
+            os.link(self.object_path(sha256), path)
+        except OSError:
+            shutil.copyfile(self.object_path(sha256), path)
+        return path
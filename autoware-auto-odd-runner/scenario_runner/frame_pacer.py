@@ -0,0 +1,101 @@
+#
+# Copyright (c) 2021 LG Electronics, Inc.
+#
+# This software contains code licensed as described in LICENSE.
+#
+
+"""
+Pacing of the TierIV bridge frames to the realtime factor requested by the
+InitializeRequest: a frame of simulation time t is stepped no earlier than
+(t - t0) / realtime_factor after the first frame, so that the sleeps make up
+for the time the previous frames took and the errors do not accumulate.
+"""
+
+import logging
+import time
+
+
+log = logging.getLogger(__name__)
+
+# A pacer falling behind the schedule by more than this stops catching up
+# (running the frames back to back) and restarts the schedule from the late frame
+MAX_CATCH_UP_SEC = 1.0
+
+
+class FramePacer():
+    """
+    Paces the frames to 'realtime_factor' simulation seconds per wall clock
+    second, a zero or negative one for no pacing. pace() returns the frame
+    slack: how early (positive, slept) or late (negative) the frame came on
+    the schedule. The slept time and the lateness are recorded in 'metrics'
+    (a BridgeMetrics) as the "pacing_sleep" and "pacing_lateness" frame
+    series, the realtime factors as the "target_realtime_factor" and
+    "achieved_realtime_factor" gauges, the schedule restarts as the
+    pacing_resyncs counter.
+    """
+    def __init__(self, metrics=None, max_catch_up=MAX_CATCH_UP_SEC, clock=time.perf_counter, sleep=time.sleep):
+        self.metrics = metrics
+        self.max_catch_up = max_catch_up
+        self.clock = clock
+        self.sleep = sleep
+        self.reset(0.0)
+
+    def reset(self, realtime_factor):
+        self.realtime_factor = realtime_factor
+        # The schedule: the simulation time of a frame and when it was stepped
+        self.anchor_sim_time = None
+        self.anchor_wall_time = None
+        # Of the first frame, for the achieved realtime factor
+        self.first_sim_time = None
+        self.first_wall_time = None
+        self.last_sim_time = None
+        self.last_wall_time = None
+        self.late_frames = 0
+        self.frames = 0
+        if self.metrics:
+            self.metrics.set_gauge("target_realtime_factor", realtime_factor)
+
+    @property
+    def achieved_realtime_factor(self):
+        if self.frames < 2:
+            return 0.0
+        wall_elapsed = self.last_wall_time - self.first_wall_time
+        if wall_elapsed <= 0:
+            return 0.0
+        return (self.last_sim_time - self.first_sim_time) / wall_elapsed
+
+    def pace(self, sim_time):
+        now = self.clock()
+        slack = 0.0
+        if self.anchor_sim_time is None or sim_time < self.anchor_sim_time:
+            # The first frame, or the simulation time went back (a new scenario)
+            self.anchor_sim_time, self.anchor_wall_time = sim_time, now
+            self.first_sim_time, self.first_wall_time = sim_time, now
+            self.frames = 0
+        elif self.realtime_factor > 0:
+            target = self.anchor_wall_time + (sim_time - self.anchor_sim_time) / self.realtime_factor
+            slack = target - now
+            if slack > 0:
+                self.sleep(slack)
+                now = self.clock()
+                self.record("pacing_sleep", slack)
+            elif slack < 0:
+                self.late_frames += 1
+                self.record("pacing_lateness", -slack)
+                if -slack > self.max_catch_up:
+                    self.anchor_sim_time, self.anchor_wall_time = sim_time, now
+                    if self.metrics:
+                        self.metrics.count("pacing_resyncs")
+        self.frames += 1
+        self.last_sim_time, self.last_wall_time = sim_time, now
+        if self.metrics:
+            self.metrics.set_gauge("achieved_realtime_factor", self.achieved_realtime_factor)
+        return slack
+
+    def record(self, series, seconds):
+        if self.metrics:
+            self.metrics.record_frame_series(series, seconds)
+
+    def summary(self):
+        return (f"{self.frames} frame(s) at the realtime factor {self.achieved_realtime_factor:.2f}"
+                f" (target {self.realtime_factor:g}), {self.late_frames} late")
@@ -0,0 +1,190 @@
+#
+# Copyright (c) 2021 LG Electronics, Inc.
+#
+# This software contains code licensed as described in LICENSE.
+#
+
+"""
+Deadlines of the TierIV bridge frame steps. A simulator hanging in
+lgsvl.Simulator.run() blocks the bridge with no word of it; the watchdog
+thread here notices a frame step running past its deadline and reports the
+stacks of all the threads and the requests handled last, so that a stall
+shows up in the logs and the metrics rather than as a TierIV runner timeout.
+"""
+
+import collections
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+
+try:
+    from .bridge_metrics import write_atomically
+except ImportError:
+    from bridge_metrics import write_atomically
+
+
+log = logging.getLogger(__name__)
+
+# A frame step is expected to take step_time / realtime_factor (step_time
+# with no realtime factor) and is stalled after DEFAULT_DEADLINE_FACTOR times
+# that, but no sooner than DEFAULT_MIN_DEADLINE_SEC
+DEFAULT_DEADLINE_FACTOR = 20.0
+DEFAULT_MIN_DEADLINE_SEC = 5.0
+
+RECENT_REQUESTS = 20
+
+STALL_REPORT_FILENAME = "tier4_bridge_stall.txt"
+
+
+class FrameStalledError(RuntimeError):
+    """A request given up on as the frame step it waits for is past its deadline"""
+
+
+class Frame():
+    def __init__(self, sim_time, started, deadline):
+        self.sim_time = sim_time
+        self.started = started
+        self.deadline = deadline
+        self.missed = False
+
+
+class FrameWatchdog(threading.Thread):
+    """
+    Tracks the frame steps between frame_started() and frame_finished(). A
+    step not finished by its deadline is logged with the thread stacks and
+    the RECENT_REQUESTS requests recorded with record_request(), the report
+    also written to 'report_dir' if given, and counted in 'metrics' (a
+    BridgeMetrics) as frame_deadline_misses, with the stalled_frame gauge
+    set while it runs. The metrics are written right away, the thread which
+    writes them may be the stalled one.
+
+    With 'fail_stalled' the waits for a stalled step are cut short by
+    FrameStalledError, see wait_timeout(), and a step finishing past its
+    deadline is reported as failed by frame_finished().
+    """
+    def __init__(self, metrics=None, deadline_factor=DEFAULT_DEADLINE_FACTOR,
+                 min_deadline=DEFAULT_MIN_DEADLINE_SEC, fail_stalled=False, report_dir=None,
+                 api_names=None, clock=time.monotonic):
+        threading.Thread.__init__(self, name="tier4-bridge-watchdog", daemon=True)
+        self.metrics = metrics
+        self.deadline_factor = deadline_factor
+        self.min_deadline = min_deadline
+        self.fail_stalled = fail_stalled
+        self.report_dir = report_dir
+        self.api_names = api_names or {}
+        self.clock = clock
+        self.condition = threading.Condition()
+        self.stopped = False
+        self.frame = None
+        self.deadline_sec = min_deadline
+        self.deadline_misses = 0
+        self.recent_requests = collections.deque(maxlen=RECENT_REQUESTS)
+
+    def configure(self, step_time, realtime_factor):
+        expected = step_time / realtime_factor if realtime_factor > 0 else step_time
+        self.deadline_sec = max(self.min_deadline, self.deadline_factor * expected)
+
+    def record_request(self, port, seconds):
+        self.recent_requests.append((time.time(), port, seconds))
+
+    def frame_started(self, sim_time):
+        now = self.clock()
+        with self.condition:
+            self.frame = Frame(sim_time, now, now + self.deadline_sec)
+            self.condition.notify()
+
+    def frame_finished(self):
+        """
+        Returns the description of the frame overrun if the frame missed its
+        deadline and the stalled frames are to fail, None otherwise
+        """
+        with self.condition:
+            frame, self.frame = self.frame, None
+        if frame is None or not frame.missed:
+            return None
+        elapsed = self.clock() - frame.started
+        log.warning(f"The stalled frame step at {frame.sim_time:.3f} s completed after {elapsed:.1f} s")
+        if self.metrics:
+            self.metrics.set_gauge("stalled_frame", 0)
+        if not self.fail_stalled:
+            return None
+        return (f"frame step at {frame.sim_time:.3f} s took {elapsed:.1f} s, "
+                f"over its {self.deadline_sec:.1f} s deadline")
+
+    def wait_timeout(self):
+        """
+        How long to wait for the running frame step before giving up on it
+        with stall_description(): None (as long as it takes) unless the
+        stalled frames are to fail
+        """
+        if not self.fail_stalled:
+            return None
+        frame = self.frame
+        if frame is None:
+            return None
+        return max(0.0, frame.deadline - self.clock())
+
+    def stall_description(self):
+        """The description of the running stalled frame step, None if there is none"""
+        frame = self.frame
+        if frame is None or not frame.missed:
+            return None
+        return (f"frame step at {frame.sim_time:.3f} s stalled: running for "
+                f"{self.clock() - frame.started:.1f} s, over its {self.deadline_sec:.1f} s deadline")
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while True:
+                    if self.stopped:
+                        return
+                    frame = self.frame
+                    if frame is None or frame.missed:
+                        self.condition.wait()
+                        continue
+                    remaining = frame.deadline - self.clock()
+                    if remaining <= 0:
+                        frame.missed = True
+                        break
+                    self.condition.wait(remaining)
+            self.report(frame)
+
+    def report(self, frame):
+        report = self.stall_report(frame)
+        log.error(report)
+        if self.report_dir:
+            try:
+                os.makedirs(self.report_dir, exist_ok=True)
+                write_atomically(os.path.join(self.report_dir, STALL_REPORT_FILENAME), report)
+            except OSError as e:
+                log.error(f"Failed to write the stall report to '{self.report_dir}': {e}")
+        if self.metrics:
+            self.metrics.count("frame_deadline_misses")
+            self.metrics.set_gauge("stalled_frame", 1)
+            self.metrics.write()
+        self.deadline_misses += 1
+
+    def stall_report(self, frame):
+        lines = [f"The frame step at {frame.sim_time:.3f} s has been running for "
+                 f"{self.clock() - frame.started:.1f} s, over its {self.deadline_sec:.1f} s deadline",
+                 "", "Requests handled last:"]
+        now = time.time()
+        for handled_time, port, seconds in list(self.recent_requests):
+            lines.append(f"  {self.api_names.get(port, port)}: {seconds * 1000:.3f} ms, "
+                         f"{now - handled_time:.1f} s ago")
+        thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, stack in sys._current_frames().items():
+            if thread_id == threading.get_ident():
+                continue
+            lines.append("")
+            lines.append(f"Thread {thread_names.get(thread_id, thread_id)}:")
+            lines.extend(line.rstrip("\n") for line in traceback.format_stack(stack))
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2021 LG Electronics, Inc.
+#
+# This software contains code licensed as described in LICENSE.
+#
+
+"""
+Replays a TierIV bridge traffic recording (see LGSVL__BRIDGE_RECORD_FILE and
+traffic_recorder.py) against a bridge and reports its throughput and latency.
+
+With --in-process the bridge is started in this process with a stub
+simulator, so neither the ROS scenario runner nor LG SVL Simulator is needed.
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from types import SimpleNamespace
+
+import zmq
+
+from .bridge_metrics import LatencyHistogram
+from .tier4_lgsvl_bridge import Tier4LgSvlBridge, TIER4_API_NAMES, api_endpoint
+from .traffic_recorder import read_records
+
+
+log = logging.getLogger("replay_traffic")
+
+
+class StubAgent():
+    def __init__(self, name, agent_type, state):
+        self.name = name
+        self.agent_type = agent_type
+        self.state = state
+
+
+class StubSimulator():
+    """
+    Answers the lgsvl.Simulator calls made by the bridge without simulating
+    anything, so that a replay measures the bridge alone.
+    """
+    def __init__(self):
+        self.current_scene = None
+
+    def load(self, scene, seed=None):
+        self.current_scene = scene
+
+    def reset(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def run(self, time_limit=0.0, time_scale=None):
+        pass
+
+    def add_agent(self, name, agent_type, state=None, color=None):
+        return StubAgent(name, agent_type, state)
+
+    def remove_agent(self, agent):
+        pass
+
+    def map_to_gps(self, transform):
+        return SimpleNamespace(northing=0.0, easting=0.0)
+
+
+def start_in_process_bridge(api_address=None):
+    # The bridge requires these, but the stub simulator ignores their values
+    os.environ.setdefault("LGSVL__MAP", "replay")
+    os.environ.setdefault("LGSVL__VEHICLE_0", "replay")
+    bridge = Tier4LgSvlBridge(api_address=api_address) if api_address else Tier4LgSvlBridge()
+    bridge.sim = StubSimulator()
+    bridge.start()
+    threading.Thread(target=bridge.poll, daemon=True).start()
+    return bridge
+
+
+def replay(records, host, max_speed=False, api_address=None):
+    api_address = api_address or f"tcp://{host}:{{port}}"
+    context = zmq.Context.instance() if api_address.startswith("inproc://") else zmq.Context()
+    api_sockets = {}
+    latencies = {}
+    requests = 0
+    frames = 0
+    identical_responses = 0
+    first_timestamp = None
+    started = time.perf_counter()
+    for record in records:
+        if not max_speed:
+            if first_timestamp is None:
+                first_timestamp = record.timestamp
+            delay = (record.timestamp - first_timestamp) - (time.perf_counter() - started)
+            if delay > 0:
+                time.sleep(delay)
+
+        api_socket = api_sockets.get(record.port)
+        if api_socket is None:
+            api_socket = context.socket(zmq.REQ)
+            api_socket.connect(api_endpoint(api_address, record.port))
+            api_sockets[record.port] = api_socket
+
+        sending = time.perf_counter()
+        api_socket.send(record.request)
+        response = api_socket.recv()
+        latencies.setdefault(record.port, LatencyHistogram()).record(time.perf_counter() - sending)
+
+        requests += 1
+        frames += TIER4_API_NAMES.get(record.port) == "update_frame"
+        identical_responses += response == record.response
+    elapsed = time.perf_counter() - started
+
+    for api_socket in api_sockets.values():
+        api_socket.close(linger=0)
+
+    return {
+        "requests": requests,
+        "frames": frames,
+        "elapsed": elapsed,
+        "requests_per_sec": requests / elapsed if elapsed else 0.0,
+        "frames_per_sec": frames / elapsed if elapsed else 0.0,
+        "identical_responses": identical_responses,
+        "latency": {
+            str(port): dict(histogram.summary(), api=TIER4_API_NAMES.get(port))
+            for port, histogram in sorted(latencies.items())
+        },
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(os.path.basename(sys.argv[0]),
+                                     description='Replay a TierIV bridge traffic recording')
+    parser.add_argument('recording', metavar='RECORDING', type=str,
+                        help='Traffic recording file (LGSVL__BRIDGE_RECORD_FILE)')
+    parser.add_argument('--host', type=str, default='127.0.0.1',
+                        help='Host of the bridge to replay the traffic to')
+    parser.add_argument('--api-address', metavar='TEMPLATE', type=str,
+                        help="Endpoints of the bridge ports, '{port}' standing for the port, e.g. "
+                        "ipc:///tmp/tier4-bridge-{port} (default: TCP on --host)")
+    parser.add_argument('--in-process', action='store_true',
+                        help='Start a bridge with a stub simulator in this process, bound at --api-address if given')
+    parser.add_argument('--max-speed', action='store_true',
+                        help='Send the requests back to back instead of at the recorded pace')
+    parser.add_argument('--json-report', metavar='FILE', type=str,
+                        help='Write the report to a JSON file')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    if args.in_process:
+        start_in_process_bridge(args.api_address)
+
+    report = replay(read_records(args.recording), args.host, args.max_speed, args.api_address)
+
+    log.info(f"Replayed {report['requests']} requests ({report['frames']} frames) in {report['elapsed']:.2f} s: "
+             f"{report['requests_per_sec']:.1f} requests/s, {report['frames_per_sec']:.1f} frames/s, "
+             f"{report['identical_responses']} responses identical to the recorded ones")
+    for port, latency in report["latency"].items():
+        log.info(f"Port {port} ({latency['api']}): {latency['count']} requests, "
+                 f"p50 {latency['p50'] * 1000:.3f} ms, p95 {latency['p95'] * 1000:.3f} ms, "
+                 f"p99 {latency['p99'] * 1000:.3f} ms")
+
+    if args.json_report:
+        with open(args.json_report, "wt") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
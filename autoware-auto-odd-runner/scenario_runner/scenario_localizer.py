@@ -0,0 +1,150 @@
+#
+# Copyright (c) 2021 LG Electronics, Inc.
+#
+# This software contains code licensed as described in LICENSE.
+#
+
+"""
+The localization of the ODD scenarios for the runner: the ego entity is
+turned into an NPC of the TierIV simulator (the 'isEgo' properties set to
+false, the bridge spawns the ego vehicle) and the road network logic file
+points at the local HD map. The scenarios are parsed, as YAML (the TierIV
+format) or OpenSCENARIO XML, rather than patched line by line, and the
+localized ones are cached by the scenario content and the map path, so that
+a scenario run again is not localized again.
+"""
+
+import concurrent.futures
+import hashlib
+import logging
+import multiprocessing
+import os
+import xml.etree.ElementTree as ElementTree
+
+import yaml
+
+try:
+    from .bridge_metrics import write_atomically
+except ImportError:
+    from bridge_metrics import write_atomically
+
+
+log = logging.getLogger(__name__)
+
+# Part of the cache key, bumped along with any change of the localized output
+LOCALIZATION_VERSION = 1
+
+LOCALIZED_DIRNAME = "localized"
+
+
+def localize_yaml(content, map_filename):
+    scenario = yaml.safe_load(content)
+    if not isinstance(scenario, dict):
+        raise ValueError("The scenario is not a YAML mapping")
+    logic_files = 0
+    pending = [scenario]
+    while pending:
+        node = pending.pop()
+        if isinstance(node, list):
+            pending.extend(node)
+            continue
+        if not isinstance(node, dict):
+            continue
+        if node.get("name") == "isEgo" and "value" in node:
+            node["value"] = "false"
+        logic_file = node.get("LogicFile")
+        if isinstance(logic_file, dict) and "filepath" in logic_file:
+            logic_file["filepath"] = map_filename
+            logic_files += 1
+        pending.extend(node.values())
+    if not logic_files:
+        raise ValueError("The scenario has no RoadNetwork LogicFile filepath")
+    return yaml.safe_dump(scenario, sort_keys=False, allow_unicode=True)
+
+
+def localize_xosc(content, map_filename):
+    root = ElementTree.fromstring(content)
+    for element in root.iter():
+        if element.get("name") == "isEgo" and "value" in element.attrib:
+            element.set("value", "false")
+    logic_files = root.findall(".//RoadNetwork/LogicFile")
+    if not logic_files:
+        raise ValueError("The scenario has no RoadNetwork LogicFile filepath")
+    for logic_file in logic_files:
+        logic_file.set("filepath", map_filename)
+    return ElementTree.tostring(root, encoding="unicode", xml_declaration=True) + "\n"
+
+
+def localize_file(scenario_filename, map_filename, localized_filename):
+    """Writes the localized scenario to 'localized_filename'; also run in the worker processes"""
+    with open(scenario_filename, "rt") as f:
+        content = f.read()
+    if scenario_filename.endswith(".xosc"):
+        localized = localize_xosc(content, map_filename)
+    else:
+        localized = localize_yaml(content, map_filename)
+    write_atomically(localized_filename, localized)
+    return localized_filename
+
+
+class ScenarioLocalizer():
+    """
+    Localizes the scenarios to 'cache_dir'/localized, where the localized
+    scenario of the same content and map path is found by the next runs
+    """
+    def __init__(self, cache_dir, max_workers=None):
+        self.localized_dir = os.path.join(cache_dir, LOCALIZED_DIRNAME)
+        self.max_workers = max_workers or os.cpu_count()
+        os.makedirs(self.localized_dir, exist_ok=True)
+
+    def localized_filename(self, scenario_filename, map_filename):
+        key = hashlib.sha256(f"{LOCALIZATION_VERSION}\0{os.path.abspath(map_filename)}\0".encode())
+        with open(scenario_filename, "rb") as f:
+            key.update(f.read())
+        return os.path.join(self.localized_dir, f"{key.hexdigest()[:32]}-{os.path.basename(scenario_filename)}")
+
+    def localize(self, scenario_filename, map_filename):
+        """Returns the localized scenario file; raises OSError or ValueError if the scenario can not be read"""
+        return self.localize_all([(scenario_filename, map_filename)])[0].result()
+
+    def localize_all(self, scenarios):
+        """
+        Localizes the (scenario file, map file) pairs, the ones not cached in
+        a pool of processes if there are several; returns a future of the
+        localized scenario file for every pair
+        """
+        futures = []
+        missing = []
+        for scenario_filename, map_filename in scenarios:
+            future = concurrent.futures.Future()
+            futures.append(future)
+            try:
+                localized_filename = self.localized_filename(scenario_filename, map_filename)
+            except OSError as e:
+                future.set_exception(e)
+                continue
+            if os.path.isfile(localized_filename):
+                log.info(f"Using the cached localized scenario '{localized_filename}'")
+                future.set_result(localized_filename)
+            else:
+                missing.append((future, (scenario_filename, os.path.abspath(map_filename), localized_filename)))
+        if len(missing) == 1:
+            future, args = missing[0]
+            self.complete(future, args[0], lambda: localize_file(*args))
+        elif missing:
+            log.info(f"Localizing {len(missing)} scenarios")
+            # Spawned rather than forked: the runner has the bridge, ZMQ and
+            # download threads running by now, which a fork would copy mid-flight
+            with concurrent.futures.ProcessPoolExecutor(max_workers=min(self.max_workers, len(missing)),
+                                                        mp_context=multiprocessing.get_context("spawn")) as pool:
+                localizing = [(future, args[0], pool.submit(localize_file, *args)) for future, args in missing]
+                for future, scenario_filename, localized in localizing:
+                    self.complete(future, scenario_filename, localized.result)
+        return futures
+
+    @staticmethod
+    def complete(future, scenario_filename, localize):
+        try:
+            future.set_result(localize())
+        except (OSError, ValueError, yaml.YAMLError, ElementTree.ParseError) as e:
+            future.set_exception(ValueError(f"Failed to localize the scenario '{scenario_filename}': {e}"))
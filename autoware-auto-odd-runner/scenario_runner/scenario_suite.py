@@ -0,0 +1,183 @@
+#
+# Copyright (c) 2021 LG Electronics, Inc.
+#
+# This software contains code licensed as described in LICENSE.
+#
+
+"""
+The suite mode of the runner: the scenarios of a manifest are run back to back
+with one bridge, bound and connected to the simulator once, so that a scenario
+on the scene of the previous one costs a scene reset rather than a runner,
+simulator connection and scene load of its own. The results and timings of
+every scenario are written to a JSON file as the suite goes.
+"""
+
+import datetime
+import json
+import logging
+import os
+import time
+import traceback
+from collections import OrderedDict
+
+try:
+    from .bridge_metrics import write_atomically
+    from .download_cache import url_filename
+except ImportError:
+    from bridge_metrics import write_atomically
+    from download_cache import url_filename
+
+
+log = logging.getLogger(__name__)
+
+SCENARIO_FILE_TYPES = [".yaml", ".xosc"]
+HD_MAP_FILE_TYPES = [".osm"]
+
+
+def check_file_types(scenario_filename, hd_map_filename):
+    """Raises ValueError if the scenario or the HD map file is of a type the runner can not process"""
+    if os.path.splitext(scenario_filename)[1] not in SCENARIO_FILE_TYPES:
+        raise ValueError("Impossible to process scenario file of unknown type "
+                         f"'{scenario_filename}', expected *.yaml or *.xosc")
+    if os.path.splitext(hd_map_filename)[1] not in HD_MAP_FILE_TYPES:
+        raise ValueError("Impossible to process HD map file of unknown type "
+                         f"'{hd_map_filename}', expected *.osm")
+
+
+class SuiteScenario():
+    def __init__(self, index, scenario_url, hd_map_url, scene=None, name=None):
+        # The position in the manifest
+        self.index = index
+        self.scenario_url = scenario_url
+        self.hd_map_url = hd_map_url
+        # The simulator scene (LGSVL__MAP if None)
+        self.scene = scene
+        self.name = name or url_filename(scenario_url)
+
+
+def load_manifest(filename):
+    """
+    Reads the scenarios of a suite manifest: a JSON list of
+    {"scenario": url, "map": url, "scene": asset id, "name": name} objects
+    (the scene and the name are optional), or a text file of
+    'SCENARIO_URL HD_MAP_URL [SCENE]' lines, the empty and '#' ones skipped.
+    Raises ValueError on an invalid manifest.
+    """
+    with open(filename) as f:
+        content = f.read()
+    scenarios = []
+    if filename.endswith(".json"):
+        for index, entry in enumerate(json.loads(content)):
+            if "scenario" not in entry or "map" not in entry:
+                raise ValueError(f"The scenario {index} of '{filename}' has no 'scenario' or 'map' URL")
+            scenarios.append(SuiteScenario(index, entry["scenario"], entry["map"],
+                                           entry.get("scene"), entry.get("name")))
+    else:
+        for line in content.splitlines():
+            fields = line.split()
+            if not fields or fields[0].startswith("#"):
+                continue
+            if len(fields) not in (2, 3):
+                raise ValueError(f"Expected 'SCENARIO_URL HD_MAP_URL [SCENE]' in '{filename}', got '{line}'")
+            scenarios.append(SuiteScenario(len(scenarios), *fields))
+    if not scenarios:
+        raise ValueError(f"No scenarios in '{filename}'")
+    for scenario in scenarios:
+        check_file_types(url_filename(scenario.scenario_url), url_filename(scenario.hd_map_url))
+    return scenarios
+
+
+def group_by_scene(scenarios):
+    """The scenarios reordered so that those of a scene run one after another, in the manifest order otherwise"""
+    groups = OrderedDict()
+    for scenario in scenarios:
+        groups.setdefault(scenario.scene, []).append(scenario)
+    return [scenario for group in groups.values() for scenario in group]
+
+
+class ScenarioSuite():
+    """
+    Runs the scenarios with prepare(scenario), which returns the scenario file
+    to run, and run(scenario_file), which returns the exit status of the run,
+    0 if the scenario passed. is_bridge_alive() tells whether the remaining
+    scenarios can run at all. The results are rewritten to 'results_file'
+    after every scenario.
+    """
+    def __init__(self, prepare, run, is_bridge_alive, results_file=None, clock=time.perf_counter):
+        self.prepare = prepare
+        self.run_scenario = run
+        self.is_bridge_alive = is_bridge_alive
+        self.results_file = results_file
+        self.clock = clock
+        self.started_at = None
+        self.results = []
+
+    def run(self, scenarios):
+        """Runs the scenarios, returns whether they all passed"""
+        started = self.clock()
+        self.started_at = datetime.datetime.now().isoformat(timespec="seconds")
+        for scenario in scenarios:
+            result = {
+                "index": scenario.index,
+                "name": scenario.name,
+                "scenario": scenario.scenario_url,
+                "map": scenario.hd_map_url,
+                "scene": scenario.scene,
+            }
+            if not self.is_bridge_alive():
+                result.update(status="error", error="the bridge is not running")
+            else:
+                log.info(f"Running the ODD scenario '{scenario.name}' "
+                         f"({len(self.results) + 1} of {len(scenarios)})...")
+                result.update(self.run_one(scenario))
+                log.info(f"The ODD scenario '{scenario.name}' {result['status']}")
+            self.results.append(result)
+            self.write(self.clock() - started)
+        log.info(self.summary())
+        return all(result["status"] == "passed" for result in self.results)
+
+    def run_one(self, scenario):
+        setup_started = self.clock()
+        try:
+            scenario_file = self.prepare(scenario)
+        except Exception as e:
+            log.error(f"Failed to prepare the ODD scenario '{scenario.name}': {e}")
+            log.debug(traceback.format_exc())
+            return {"status": "error", "error": str(e), "setup_sec": self.clock() - setup_started}
+        run_started = self.clock()
+        returncode = self.run_scenario(scenario_file)
+        return {
+            "status": "passed" if returncode == 0 else "failed",
+            "returncode": returncode,
+            "setup_sec": run_started - setup_started,
+            "run_sec": self.clock() - run_started,
+        }
+
+    def counts(self):
+        counts = OrderedDict((status, 0) for status in ["passed", "failed", "error"])
+        for result in self.results:
+            counts[result["status"]] += 1
+        return counts
+
+    def summary(self):
+        counts = self.counts()
+        totals = ", ".join(f"{count} {status}" for status, count in counts.items())
+        lines = [f"Suite of {len(self.results)} scenarios: {totals}"]
+        for result in self.results:
+            timing = f"{result['run_sec']:8.1f} s" if "run_sec" in result else " " * 10
+            lines.append(f"  {result['status']:6s} {timing}  {result['name']}")
+        return "\n".join(lines)
+
+    def write(self, duration):
+        if not self.results_file:
+            return
+        report = OrderedDict([
+            ("started", self.started_at),
+            ("duration_sec", duration),
+        ])
+        report.update(self.counts())
+        report["scenarios"] = self.results
+        try:
+            write_atomically(self.results_file, json.dumps(report, indent=2) + "\n")
+        except OSError as e:
+            log.error(f"Failed to write the suite results to '{self.results_file}': {e}")
@@ -0,0 +1,47 @@
+#
+# Copyright (c) 2021 LG Electronics, Inc.
+#
+# This software contains code licensed as described in LICENSE.
+#
+
+"""
+Data the TierIV bridge derives from a loaded scene (the map origin, the spawn
+points, the controllables), kept across the scene resets so that a
+re-initialization with the same map makes no simulator queries for it.
+"""
+
+import threading
+
+
+class SceneCache():
+    """
+    Values computed once per scene name and key. Hits and misses are counted
+    in 'metrics' (a BridgeMetrics) as scene_cache_hits and scene_cache_misses.
+    """
+    def __init__(self, metrics=None):
+        self.metrics = metrics
+        self.lock = threading.Lock()
+        self.scenes = {}
+
+    def get(self, scene, key, compute):
+        with self.lock:
+            entries = self.scenes.setdefault(scene, {})
+            if key in entries:
+                self.count("scene_cache_hits")
+                return entries[key]
+        self.count("scene_cache_misses")
+        value = compute()
+        with self.lock:
+            entries[key] = value
+        return value
+
+    def invalidate(self, scene=None):
+        with self.lock:
+            if scene is None:
+                self.scenes.clear()
+            else:
+                self.scenes.pop(scene, None)
+
+    def count(self, counter):
+        if self.metrics:
+            self.metrics.count(counter)
@@ -0,0 +1,436 @@
+#
+# Copyright (c) 2021 LG Electronics, Inc.
+#
+# This software contains code licensed as described in LICENSE.
+#
+
+"""
+Streaming of the TierIV bridge sensor data over a ZMQ PUB socket, the local
+stand-in for the ROS topics of the sensors.
+
+Every message is a multipart one of: the topic name, a JSON header and the
+raw data of a NumPy array, the layout of which is described by the header
+'fields' the way a sensor_msgs/PointCloud2 does (name, offset, datatype,
+count, and the 'point_step' of a row). The array is sent without copying it;
+a LiDAR scan is memory-mapped right from the PCD file saved by the simulator,
+unless it is thinned out to the requested LiDAR configuration.
+
+The ground truth detections are computed from the entity states the bridge
+takes once per frame, with no simulator calls.
+"""
+
+import heapq
+import itertools
+import json
+import logging
+import os
+import queue
+import threading
+from collections import namedtuple
+
+import numpy as np
+import zmq
+
+
+log = logging.getLogger(__name__)
+
+DEFAULT_SENSOR_PUB_ADDRESS = "tcp://*:5570"
+
+# Messages waiting for publishing; a slow publisher drops messages rather
+# than holding up the simulation
+PUBLISH_QUEUE_SIZE = 8
+
+DEFAULT_DETECTION_RANGE_M = 100.0
+DEFAULT_DETECTION_FOV_DEG = 360.0
+
+DETECTION_LABEL_UNKNOWN = 0
+DETECTION_LABEL_VEHICLE = 1
+DETECTION_LABEL_PEDESTRIAN = 2
+
+# A detected object, in the frame of the sensor entity (X forward, Y left)
+DETECTION_DTYPE = np.dtype([
+    ("x", "<f4"), ("y", "<f4"), ("z", "<f4"), ("yaw", "<f4"), ("speed", "<f4"),
+    ("length", "<f4"), ("width", "<f4"), ("height", "<f4"), ("label", "u1"),
+])
+
+# A sensor of SensorScheduler.due(): 'lag' is the simulation time elapsed
+# since the sensor was due, 'missed' the number of its periods skipped since
+DueSensor = namedtuple("DueSensor", ["name", "stream", "lag", "missed"])
+
+# The sensor frames come at the multiples of the step time, which the due
+# times summed from the sensor periods match only up to the float rounding
+SCHEDULING_TOLERANCE_SEC = 1e-6
+
+# How far (in radians) the elevation of a scan point may be from a requested
+# LiDAR vertical angle for the point to be of that beam
+LIDAR_VERTICAL_ANGLE_TOLERANCE_RAD = np.radians(0.1)
+
+# PCD TYPE and SIZE -> NumPy dtype
+PCD_TYPES = {
+    ("F", 4): "<f4", ("F", 8): "<f8",
+    ("U", 1): "u1", ("U", 2): "<u2", ("U", 4): "<u4", ("U", 8): "<u8",
+    ("I", 1): "i1", ("I", 2): "<i2", ("I", 4): "<i4", ("I", 8): "<i8",
+}
+
+# NumPy dtype -> sensor_msgs/PointField datatype
+POINT_FIELD_DATATYPES = {
+    "i1": 1, "u1": 2, "<i2": 3, "<u2": 4, "<i4": 5, "<u4": 6, "<f4": 7, "<f8": 8,
+    "<i8": 9, "<u8": 10,
+}
+
+
+def read_pcd(filename):
+    """
+    Reads a PCD file into a structured NumPy array, memory-mapped for the
+    'binary' data and parsed for the 'ascii' one
+    """
+    with open(filename, "rb") as f:
+        header = {}
+        header_lines = 0
+        while True:
+            line = f.readline()
+            if not line:
+                raise ValueError(f"'{filename}' has no PCD DATA line")
+            header_lines += 1
+            words = line.decode("ascii").split()
+            if not words or words[0].startswith("#"):
+                continue
+            header[words[0]] = words[1:]
+            if words[0] == "DATA":
+                break
+        data_offset = f.tell()
+
+    counts = [int(count) for count in header.get("COUNT", ["1"] * len(header["FIELDS"]))]
+    dtype = np.dtype([
+        (name, PCD_TYPES[(pcd_type, int(size))], (count,)) if count > 1
+        else (name, PCD_TYPES[(pcd_type, int(size))])
+        for name, pcd_type, size, count in zip(header["FIELDS"], header["TYPE"], header["SIZE"], counts)
+    ])
+    points = int(header["POINTS"][0])
+    data = header["DATA"][0]
+    if data == "binary":
+        if points == 0:
+            return np.zeros(0, dtype)
+        return np.memmap(filename, dtype=dtype, mode="r", offset=data_offset, shape=(points,))
+    if data == "ascii":
+        return np.loadtxt(filename, dtype=dtype, skiprows=header_lines, max_rows=points, ndmin=1)
+    raise ValueError(f"Unsupported PCD data '{data}' in '{filename}'")
+
+
+def filter_scan(points, horizontal_resolution=0.0, vertical_angles=()):
+    """
+    The scan 'points' (with x, y, z fields, in the sensor frame) of the beams
+    at 'vertical_angles', thinned out to a point per beam and
+    'horizontal_resolution' of azimuth, both in radians; the points as they
+    are if neither is set
+    """
+    if horizontal_resolution <= 0.0 and not len(vertical_angles):
+        return points
+    x, y, z = (points[name].astype(np.float64) for name in ("x", "y", "z"))
+    elevations = np.arctan2(z, np.hypot(x, y))
+    if len(vertical_angles):
+        angles = np.sort(np.asarray(vertical_angles, dtype=np.float64))
+        # The nearest requested angle of every point
+        upper = np.minimum(np.searchsorted(angles, elevations), len(angles) - 1)
+        lower = np.maximum(upper - 1, 0)
+        beams = np.where(np.abs(elevations - angles[lower]) < np.abs(elevations - angles[upper]), lower, upper)
+        rows = np.flatnonzero(np.abs(elevations - angles[beams]) <= LIDAR_VERTICAL_ANGLE_TOLERANCE_RAD)
+        beams = beams[rows]
+    else:
+        rows = np.arange(len(points))
+        beams = np.round(elevations / LIDAR_VERTICAL_ANGLE_TOLERANCE_RAD).astype(np.int64)
+    if horizontal_resolution > 0.0:
+        bins = np.floor((np.arctan2(y[rows], x[rows]) + np.pi) / horizontal_resolution).astype(np.int64)
+        # The first point of every beam and azimuth bin
+        _, first = np.unique(np.stack([beams, bins], axis=1), axis=0, return_index=True)
+        rows = rows[np.sort(first)]
+    return points[rows]
+
+
+def ground_truth_detections(states, sensor_row, boxes, range_m, fov_deg):
+    """
+    Detects the entities of 'states' (a unity_coordinates.WorldStates) seen by
+    the one at 'sensor_row': within 'range_m' meters and 'fov_deg' degrees
+    around its heading. 'boxes' are the (N, 4) length, width, height and label
+    of the entities. Returns the detected rows and their DETECTION_DTYPE array.
+    """
+    positions = states.positions
+    orientations = states.orientations
+    x, y, z, w = orientations.T
+    yaws = np.arctan2(2.0 * (w * z + x * y), 1.0 - 2.0 * (y * y + z * z))
+    sensor_yaw = yaws[sensor_row]
+    cos_yaw, sin_yaw = np.cos(sensor_yaw), np.sin(sensor_yaw)
+    offsets = positions - positions[sensor_row]
+    forward = cos_yaw * offsets[:, 0] + sin_yaw * offsets[:, 1]
+    left = cos_yaw * offsets[:, 1] - sin_yaw * offsets[:, 0]
+
+    seen = np.hypot(forward, left) <= range_m
+    if fov_deg < 360.0:
+        seen &= np.abs(np.arctan2(left, forward)) <= np.radians(fov_deg) / 2.0
+    seen[sensor_row] = False
+    rows = np.flatnonzero(seen)
+
+    detections = np.empty(len(rows), DETECTION_DTYPE)
+    detections["x"] = forward[rows]
+    detections["y"] = left[rows]
+    detections["z"] = offsets[rows, 2]
+    detections["yaw"] = np.arctan2(np.sin(yaws[rows] - sensor_yaw), np.cos(yaws[rows] - sensor_yaw))
+    detections["speed"] = states.linear_velocities[rows, 0]
+    detections["length"] = boxes[rows, 0]
+    detections["width"] = boxes[rows, 1]
+    detections["height"] = boxes[rows, 2]
+    detections["label"] = boxes[rows, 3]
+    return rows, detections
+
+
+def point_fields(dtype):
+    """sensor_msgs/PointField-like descriptions of the structured dtype fields"""
+    fields = []
+    for name in dtype.names:
+        field_dtype, offset = dtype.fields[name][:2]
+        base, count = (field_dtype.base, field_dtype.shape[0]) if field_dtype.shape else (field_dtype, 1)
+        fields.append({
+            "name": name,
+            "offset": offset,
+            "datatype": POINT_FIELD_DATATYPES[base.str.replace("|", "")],
+            "count": count,
+        })
+    return fields
+
+
+class SensorPublisher(threading.Thread):
+    """
+    Owns the PUB socket and publishes the messages submitted with submit()
+    from its own thread. A message is produced (e.g. a scan file read) on
+    this thread too, so that the frame loop only pays for the simulator call.
+    """
+    def __init__(self, address=DEFAULT_SENSOR_PUB_ADDRESS, metrics=None):
+        threading.Thread.__init__(self, name="tier4-bridge-sensors", daemon=True)
+        self.address = address
+        self.metrics = metrics
+        self.jobs = queue.Queue(PUBLISH_QUEUE_SIZE)
+        self.context = zmq.Context.instance()
+        self.socket = self.context.socket(zmq.PUB)
+        self.socket.bind(address)
+        log.info(f"Publishing the sensor data at {address}")
+
+    def submit(self, topic, produce, discard=None):
+        """
+        'produce' returns the (header, array) to publish to 'topic', or None to
+        publish nothing; 'discard' is called instead if the queue is full
+        """
+        try:
+            self.jobs.put_nowait((topic, produce))
+        except queue.Full:
+            log.warning(f"The sensor publishing queue is full, dropping a '{topic}' message")
+            self.count("sensor_messages_dropped")
+            if discard:
+                discard()
+
+    def publish(self, topic, header, array):
+        array = np.ascontiguousarray(array)
+        header = dict(header,
+                      fields=point_fields(array.dtype) if array.dtype.names else str(array.dtype),
+                      shape=list(array.shape),
+                      point_step=array.dtype.itemsize)
+        # copy=False hands the array buffer to ZMQ, which holds a reference to it
+        # until the message is sent
+        self.socket.send_multipart([topic.encode(), json.dumps(header).encode(), memoryview(array)],
+                                   copy=False)
+        self.count("sensor_messages_published")
+
+    def run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            topic, produce = job
+            try:
+                message = produce()
+                if message is not None:
+                    self.publish(topic, *message)
+            except Exception as e:
+                log.error(f"Failed to publish a '{topic}' message: {e}")
+        self.socket.close(linger=0)
+
+    def stop(self):
+        self.jobs.put(None)
+
+    def count(self, counter):
+        if self.metrics:
+            self.metrics.count(counter)
+
+
+class LidarStream():
+    """A simulator LiDAR of an entity streamed to a topic every scan_duration"""
+    def __init__(self, entity, sensor, configuration, scan_dir):
+        self.entity = entity
+        self.sensor = sensor
+        self.topic = configuration.topic_name or f"/perception/{entity}/lidar/pointcloud"
+        self.scan_duration = configuration.scan_duration
+        self.configuration = {
+            "horizontal_resolution": configuration.horizontal_resolution,
+            "vertical_angles": list(configuration.vertical_angles),
+            "scan_duration": configuration.scan_duration,
+        }
+        self.scan_dir = scan_dir
+        self.seq = 0
+
+    @property
+    def period(self):
+        return self.scan_duration
+
+    def capture(self, current_time):
+        """
+        Makes the simulator save a scan; returns its file name and message
+        header, or None if the simulator failed to save it
+        """
+        filename = os.path.join(self.scan_dir, f"{self.entity}-{self.seq}.pcd")
+        if self.sensor.save(filename) is False:
+            log.error(f"The LiDAR of '{self.entity}' failed to save a scan to '{filename}'")
+            return None
+        header = {
+            "entity": self.entity,
+            "seq": self.seq,
+            "stamp": current_time,
+            "frame_id": self.sensor.name if hasattr(self.sensor, "name") else "lidar",
+            "configuration": self.configuration,
+        }
+        self.seq += 1
+        return filename, header
+
+
+class DetectionStream():
+    """Ground truth detections of an entity published every update_duration"""
+    def __init__(self, entity, configuration,
+                 range_m=DEFAULT_DETECTION_RANGE_M, fov_deg=DEFAULT_DETECTION_FOV_DEG):
+        self.entity = entity
+        self.topic = configuration.topic_name or f"/perception/{entity}/objects"
+        self.update_duration = configuration.update_duration
+        self.range_m = range_m
+        self.fov_deg = fov_deg
+        self.seq = 0
+
+    @property
+    def period(self):
+        return self.update_duration
+
+    def start_update(self, current_time):
+        """Returns the header of the update due at 'current_time'"""
+        header = {
+            "entity": self.entity,
+            "seq": self.seq,
+            "stamp": current_time,
+            "range": self.range_m,
+            "fov": self.fov_deg,
+        }
+        self.seq += 1
+        return header
+
+    def message(self, header, snapshot, entity_boxes):
+        """
+        The (header, detections) message of the entities in 'snapshot' (the
+        bridge AgentStatesSnapshot), 'entity_boxes' maps an entity name to its
+        (length, width, height, label); None if the entity is not in 'snapshot'
+        """
+        sensor_row = snapshot.index.get(self.entity) if snapshot else None
+        if sensor_row is None:
+            return None
+        names = [None] * len(snapshot.index)
+        for name, row in snapshot.index.items():
+            names[row] = name
+        unknown = (0.0, 0.0, 0.0, DETECTION_LABEL_UNKNOWN)
+        boxes = np.array([entity_boxes.get(name, unknown) for name in names], dtype=np.float32)
+        rows, detections = ground_truth_detections(
+            snapshot.states, sensor_row, boxes.reshape(-1, 4), self.range_m, self.fov_deg)
+        return dict(header,
+                    sim_time=snapshot.sim_time,
+                    objects=[names[row] for row in rows.tolist()]), detections
+
+
+class SensorScheduler():
+    """
+    The attached sensor streams by name, in a min-heap by the simulation time
+    they are next due at, so that a sensor frame costs O(log n) per due sensor
+    rather than a check of every sensor. A stream has a 'period', in simulation
+    seconds; a stream with no period is due on every sensor frame.
+
+    The bridge attaches and removes streams on the simulator worker and pops
+    the due ones on the event loop, so every access is made under 'lock'.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.streams = {}
+        # [due time, insertion order, name, stream]; the entries of the removed
+        # or replaced streams are skipped when popped
+        self.heap = []
+        self.insertions = itertools.count()
+
+    def __len__(self):
+        with self.lock:
+            return len(self.streams)
+
+    def add(self, name, stream, start_time=0.0):
+        """Schedules 'stream', replacing the one of the same name, from 'start_time' on"""
+        with self.lock:
+            self.streams[name] = stream
+            heapq.heappush(self.heap, [start_time, next(self.insertions), name, stream])
+
+    def remove(self, name):
+        with self.lock:
+            self.streams.pop(name, None)
+
+    def has_streams(self, stream_type):
+        """Whether any of the scheduled streams is a 'stream_type' one"""
+        with self.lock:
+            return any(isinstance(stream, stream_type) for stream in self.streams.values())
+
+    def clear(self):
+        with self.lock:
+            self.streams.clear()
+            self.heap.clear()
+
+    def due(self, current_time):
+        """Pops the sensors due at 'current_time' (DueSensor) and reschedules them"""
+        with self.lock:
+            return self.pop_due(current_time)
+
+    def pop_due(self, current_time):
+        due_sensors = []
+        rescheduled = []
+        # The next sensor frame of a later simulation time
+        next_frame_time = current_time + 2 * SCHEDULING_TOLERANCE_SEC
+        while self.heap and self.heap[0][0] <= current_time + SCHEDULING_TOLERANCE_SEC:
+            entry = heapq.heappop(self.heap)
+            due_time, _, name, stream = entry
+            if self.streams.get(name) is not stream:
+                continue
+            if stream.period > 0:
+                lag = max(0.0, current_time - due_time)
+                missed = int((lag + SCHEDULING_TOLERANCE_SEC) // stream.period)
+                entry[0] = max(due_time + (missed + 1) * stream.period, next_frame_time)
+            else:
+                lag, missed = 0.0, 0
+                entry[0] = next_frame_time
+            entry[1] = next(self.insertions)
+            rescheduled.append(entry)
+            due_sensors.append(DueSensor(name, stream, lag, missed))
+        for entry in rescheduled:
+            heapq.heappush(self.heap, entry)
+        return due_sensors
+
+
+def scan_message(filename, header):
+    """
+    The (header, points) message of a saved scan, filtered to the header
+    'configuration' if any; the file is removed
+    """
+    try:
+        points = read_pcd(filename)
+    finally:
+        # The file stays mapped, if it is, until the message is sent
+        os.remove(filename)
+    configuration = header.get("configuration")
+    if configuration:
+        points = filter_scan(points, configuration["horizontal_resolution"], configuration["vertical_angles"])
+    return dict(header, points=len(points)), points
@@ -0,0 +1,51 @@
+#
+# Copyright (c) 2021 LG Electronics, Inc.
+#
+# This software contains code licensed as described in LICENSE.
+#
+
+"""
+The phases of the runner and bridge startup and when they ran, so that the
+startup time is accounted for phase by phase, the concurrent ones included.
+"""
+
+import contextlib
+import threading
+import time
+
+
+class StartupTimeline():
+    """
+    (phase name, start, end) records, relative to the timeline creation.
+    The phases may be recorded from several threads at once.
+    """
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.origin = clock()
+        self.lock = threading.Lock()
+        self.phases = []
+
+    def elapsed(self):
+        return self.clock() - self.origin
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        started = self.clock()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.phases.append((name, started - self.origin, self.clock() - self.origin))
+
+    def timed(self, name, function, *args):
+        """Calls function(*args) as the 'name' phase"""
+        with self.phase(name):
+            return function(*args)
+
+    def summary(self):
+        with self.lock:
+            phases = sorted(self.phases, key=lambda phase: phase[1])
+        lines = [f"Startup timeline, {self.elapsed():.3f} s:"]
+        for name, started, ended in phases:
+            lines.append(f"  {started:8.3f} - {ended:8.3f} s  {ended - started:8.3f} s  {name}")
+        return "\n".join(lines)
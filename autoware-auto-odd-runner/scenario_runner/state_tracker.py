@@ -0,0 +1,118 @@
+#
+# Copyright (c) 2021 LG Electronics, Inc.
+#
+# This software contains code licensed as described in LICENSE.
+#
+
+"""
+Change detection of the entity states the TierIV bridge pushes to the
+simulator, so that the parked vehicles, the pedestrians standing still and the
+entities moving on a straight line at a constant speed cost no simulator call
+on every frame.
+"""
+
+import numpy as np
+
+
+DEFAULT_POSITION_TOLERANCE_M = 0.01
+DEFAULT_ROTATION_TOLERANCE_DEG = 0.1
+DEFAULT_VELOCITY_TOLERANCE_MPS = 0.01
+
+# An entity is pushed at least this often (in simulation time) whatever its
+# state, for the simulator's drift from the extrapolated state to stay bounded
+DEFAULT_REFRESH_INTERVAL_SEC = 1.0
+
+# Below this angular velocity (rad/s) an entity is extrapolated on a straight line
+STRAIGHT_MOTION_ANGULAR_VELOCITY = 1e-3
+
+
+class EntityStateTracker():
+    """
+    Remembers the Unity state (a row of unity_coordinates.UnityStates) last
+    pushed for every entity and the simulation time it was pushed at.
+    changed() tells the entities whose new state differs from the last pushed
+    one extrapolated with its velocity, by more than the position, rotation or
+    velocity tolerance; the rest need not be pushed, the simulator keeps
+    moving them with the velocity it was given. Only the straight line motion
+    is extrapolated, a turning entity is compared to its last pushed rotation.
+    The pushed and skipped updates are counted in 'metrics' (a BridgeMetrics)
+    as entity_updates_pushed and entity_updates_skipped, their ratio is the
+    entity_update_skip_ratio gauge.
+
+    A disabled tracker reports every state as changed.
+    """
+    def __init__(self, enabled=False, metrics=None,
+                 position_tolerance=DEFAULT_POSITION_TOLERANCE_M,
+                 rotation_tolerance=DEFAULT_ROTATION_TOLERANCE_DEG,
+                 velocity_tolerance=DEFAULT_VELOCITY_TOLERANCE_MPS,
+                 refresh_interval=DEFAULT_REFRESH_INTERVAL_SEC):
+        self.enabled = enabled
+        self.metrics = metrics
+        self.position_tolerance = position_tolerance
+        self.rotation_tolerance = rotation_tolerance
+        self.velocity_tolerance = velocity_tolerance
+        self.refresh_interval = refresh_interval
+        # Entity name -> (pushed time, position, rotation, velocity, angular velocity)
+        self.pushed = {}
+        self.pushed_count = 0
+        self.skipped_count = 0
+
+    def clear(self):
+        self.pushed.clear()
+
+    def forget(self, name):
+        """To be called when the entity is despawned or teleported by the bridge"""
+        self.pushed.pop(name, None)
+
+    @property
+    def skip_ratio(self):
+        total = self.pushed_count + self.skipped_count
+        return self.skipped_count / total if total else 0.0
+
+    def changed(self, names, unity_states, current_time):
+        """
+        Returns a boolean array telling which of the 'names' entities are to
+        be pushed their row of 'unity_states', and remembers these states as
+        pushed at 'current_time'.
+        """
+        count = len(names)
+        if not self.enabled:
+            return np.ones(count, dtype=bool)
+        changed = np.ones(count, dtype=bool)
+        known = [row for row, name in enumerate(names) if name in self.pushed]
+        if known:
+            pushed = [self.pushed[names[row]] for row in known]
+            pushed_times = np.array([entry[0] for entry in pushed])
+            pushed_positions = np.array([entry[1] for entry in pushed])
+            pushed_rotations = np.array([entry[2] for entry in pushed])
+            pushed_velocities = np.array([entry[3] for entry in pushed])
+            pushed_angular_velocities = np.array([entry[4] for entry in pushed])
+            elapsed = current_time - pushed_times
+            straight = np.all(np.abs(pushed_angular_velocities) < STRAIGHT_MOTION_ANGULAR_VELOCITY, axis=1)
+            extrapolated = pushed_positions + pushed_velocities * np.where(straight, elapsed, 0.0)[:, None]
+            # The rotations are Euler angles in degrees, compared modulo a full turn
+            rotation_deltas = (unity_states.rotations[known] - pushed_rotations + 180.0) % 360.0 - 180.0
+            position_errors = np.linalg.norm(unity_states.positions[known] - extrapolated, axis=1)
+            velocity_errors = np.linalg.norm(unity_states.velocities[known] - pushed_velocities, axis=1)
+            angular_velocity_errors = np.linalg.norm(
+                unity_states.angular_velocities[known] - pushed_angular_velocities, axis=1)
+            unchanged = np.all(np.abs(rotation_deltas) <= self.rotation_tolerance, axis=1)
+            unchanged &= elapsed < self.refresh_interval
+            unchanged &= position_errors <= self.position_tolerance
+            unchanged &= velocity_errors <= self.velocity_tolerance
+            unchanged &= angular_velocity_errors <= self.velocity_tolerance
+            changed[known] = ~unchanged
+        for row in np.flatnonzero(changed).tolist():
+            self.pushed[names[row]] = (current_time,
+                                       unity_states.positions[row],
+                                       unity_states.rotations[row],
+                                       unity_states.velocities[row],
+                                       unity_states.angular_velocities[row])
+        pushed_count = int(changed.sum())
+        self.pushed_count += pushed_count
+        self.skipped_count += count - pushed_count
+        if self.metrics:
+            self.metrics.count("entity_updates_pushed", pushed_count)
+            self.metrics.count("entity_updates_skipped", count - pushed_count)
+            self.metrics.set_gauge("entity_update_skip_ratio", self.skip_ratio)
+        return changed
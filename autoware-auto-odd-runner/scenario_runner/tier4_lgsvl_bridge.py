@@ -5,21 +5,52 @@
 #
 
 # autopep8: off
+import asyncio
+import concurrent.futures
 import logging
 import os
 import zmq
+import zmq.asyncio
 import sys
 import lgsvl
 import socket as web_socket
 import math
 import numpy as np
 import threading
+import time
+from collections import namedtuple
 
 sys.path.append("proto")
 # A workaround for using inside the docker container
 sys.path.append("/app/proto")
 
 import simulation_api_schema_pb2
+
+try:
+    from . import unity_coordinates
+    from .agent_pool import AgentPool
+    from .bridge_metrics import BridgeMetrics
+    from .frame_pacer import FramePacer
+    from . import frame_watchdog
+    from .scene_cache import SceneCache
+    from . import sensor_streaming
+    from .startup_timeline import StartupTimeline
+    from . import state_tracker
+    from . import traffic_lights
+    from .traffic_recorder import TrafficRecorder
+except ImportError:
+    # Started as a script, see README.md
+    import unity_coordinates
+    from agent_pool import AgentPool
+    from bridge_metrics import BridgeMetrics
+    from frame_pacer import FramePacer
+    import frame_watchdog
+    from scene_cache import SceneCache
+    import sensor_streaming
+    from startup_timeline import StartupTimeline
+    import state_tracker
+    import traffic_lights
+    from traffic_recorder import TrafficRecorder
 # autopep8: on
 
 
@@ -28,7 +59,63 @@ logging.basicConfig(level=logging.INFO, format=FORMAT)
 log = logging.getLogger(__name__)
 
 TIER4_API_PORTS = [5555, 5556, 5557, 5558, 5559,
-                   5560, 5561, 5562, 5563, 5564]
+                   5560, 5561, 5562, 5563, 5564, 5565]
+
+# The ports above are the API port numbers the handlers, metrics and traffic
+# recordings are keyed by; a bridge binds them at the same offsets from its
+# port base, so that several bridges can run on a host
+DEFAULT_PORT_BASE = TIER4_API_PORTS[0]
+
+# The default sensor streaming port (5570) is in the same block
+SENSOR_PUB_PORT_OFFSET = 15
+
+# The endpoints the API ports are bound at, '{port}' standing for the port.
+# A TierIV runner on the same host may rather connect over IPC, e.g.
+# "ipc:///tmp/tier4-bridge-{port}", and a client in the bridge's process over
+# inproc, which skips the I/O thread of ZMQ as well
+DEFAULT_API_ADDRESS = "tcp://*:{port}"
+
+# One request is in flight on an API socket at a time, the round trip is what
+# matters: the IP low delay type of service on TCP (ZMQ sets TCP_NODELAY
+# itself), and no lingering of the unsent replies on shutdown
+IPTOS_LOWDELAY = 0x10
+API_SOCKET_OPTIONS = {
+    zmq.TOS: IPTOS_LOWDELAY,
+    zmq.LINGER: 0,
+}
+
+TIER4_API_NAMES = {
+    5555: "initialize",
+    5556: "update_frame",
+    5557: "update_sensor_frame",
+    5558: "spawn_vehicle_entity",
+    5559: "spawn_pedestrian_entity",
+    5560: "spawn_misc_object_entity",
+    5561: "despawn_entity",
+    5562: "update_entity_status",
+    5563: "attach_lidar_sensor",
+    5564: "attach_detection_sensor",
+    5565: "update_traffic_lights",
+}
+
+# Ports whose handlers talk to the simulator, or need the state its calls
+# set up (the spawned agents of UpdateEntityStatus). In the asyncio server mode
+# their requests are serialized on a single simulator worker thread, while
+# requests to the rest of the ports are answered right away on the event loop
+# (their simulator calls, if any, are queued on the simulator worker).
+SIMULATOR_BOUND_PORTS = {5555, 5556, 5558, 5559, 5562, 5563}
+
+QUEUE_STATS_REPORT_INTERVAL_SEC = 10
+
+DEFAULT_METRICS_INTERVAL_SEC = 10
+
+# Below this number of entities an UpdateEntityStatus request is converted to
+# the simulator states one entity at a time: the NumPy calls of the batch
+# conversion cost more than they save for a few dozen entities
+BATCH_CONVERSION_MIN_ENTITIES = 32
+
+# How long Tier4LgSvlBridgeServerThread.stop() waits for the bridge to shut down
+STOP_TIMEOUT_SEC = 10
 
 DEBUG_NONEGO_VEHICLES = True
 
@@ -82,12 +169,165 @@ def empty_envar_error_msg(envar_name):
         "either not set or empty, can not proceed."
 
 
+# The states of the agents the simulator moves, taken from it once per frame, or
+# the ones received by the last UpdateEntityStatus, in the TierIV "world"
+# coordinates. 'index' maps an agent name to its row in the 'states' arrays.
+AgentStatesSnapshot = namedtuple("AgentStatesSnapshot", ["sim_time", "index", "states"])
+
+# The protobuf messages of a port, reused for every request to the port (a REP
+# socket handles one request at a time), and the method filling the response
+ApiHandler = namedtuple("ApiHandler", ["request", "response", "handle"])
+
+
+def merge_agent_states(entity_states, simulator_states):
+    """
+    The AgentStatesSnapshot of the 'entity_states' entities (as requested by
+    the TierIV runner) with the 'simulator_states' agents (the ones the
+    simulator moves) at their simulator states, added if not requested.
+    Either snapshot may be None.
+    """
+    if simulator_states is None or entity_states is None:
+        return entity_states or simulator_states
+    index = dict(entity_states.index)
+    added = [name for name in simulator_states.index if name not in index]
+    for name in added:
+        index[name] = len(index)
+    added_rows = [simulator_states.index[name] for name in added]
+    states = unity_coordinates.WorldStates(*(
+        np.concatenate((entity_array, simulator_array[added_rows]))
+        for entity_array, simulator_array in zip(entity_states.states, simulator_states.states)))
+    rows = [index[name] for name in simulator_states.index]
+    simulator_rows = list(simulator_states.index.values())
+    for array, simulator_array in zip(states, simulator_states.states):
+        array[rows] = simulator_array[simulator_rows]
+    return AgentStatesSnapshot(entity_states.sim_time, index, states)
+
+
+def api_endpoint(api_address, port):
+    """The endpoint of the port in the 'api_address' template; raises ValueError on a template with no '{port}'"""
+    if "{port}" not in api_address:
+        raise ValueError(f"The API address '{api_address}' has no '{{port}}' placeholder")
+    return api_address.replace("{port}", str(port))
+
+
+def get_envar_flag(envar_name, default=False):
+    value = os.environ.get(envar_name)
+    if not value:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
 def print_vector(vector=lgsvl.Vector(0, 0, 0)):
     return f"[{vector.x:.2f} {vector.y:.2f} {vector.z:.2f}]"
 
 
+class PortQueueStats():
+    """
+    Counts how many requests were queued ahead of every received request,
+    per port. In the polling mode these are the requests to other ports that
+    became ready at the same time and were handled first; in the asyncio mode
+    these are the requests waiting for (or running on) the simulator worker.
+    """
+    def __init__(self, ports):
+        self.requests = dict.fromkeys(ports, 0)
+        self.depth_sum = dict.fromkeys(ports, 0)
+        self.max_depth = dict.fromkeys(ports, 0)
+        self.last_report_time = time.monotonic()
+
+    def observe(self, port, requests_ahead):
+        self.requests[port] += 1
+        self.depth_sum[port] += requests_ahead
+        self.max_depth[port] = max(self.max_depth[port], requests_ahead)
+
+    def summary(self):
+        return {
+            port: {
+                "requests": count,
+                "mean_depth": self.depth_sum[port] / count,
+                "max_depth": self.max_depth[port],
+            }
+            for port, count in self.requests.items() if count
+        }
+
+    def report_if_due(self, interval=QUEUE_STATS_REPORT_INTERVAL_SEC):
+        if time.monotonic() - self.last_report_time >= interval:
+            self.report()
+
+    def report(self):
+        self.last_report_time = time.monotonic()
+        for port, stats in self.summary().items():
+            log.info(f"Port {port} queue depth: mean {stats['mean_depth']:.2f}"
+                     f", max {stats['max_depth']}, requests {stats['requests']}")
+
+
 class Tier4LgSvlBridge():
-    def __init__(self):
+    def __init__(self, use_asyncio=False, pipelined_frames=False,
+                 metrics_dir=None, metrics_interval=DEFAULT_METRICS_INTERVAL_SEC,
+                 record_file=None, agent_pool_size=0,
+                 sensor_pub_address=sensor_streaming.DEFAULT_SENSOR_PUB_ADDRESS, lidar_dir=None,
+                 detection_range_m=sensor_streaming.DEFAULT_DETECTION_RANGE_M,
+                 detection_fov_deg=sensor_streaming.DEFAULT_DETECTION_FOV_DEG,
+                 port_base=DEFAULT_PORT_BASE, simulator_host=None, simulator_port=None,
+                 skip_unchanged_states=False, state_tolerances=None, signal_map_file=None,
+                 frame_deadline_factor=frame_watchdog.DEFAULT_DEADLINE_FACTOR,
+                 frame_min_deadline=frame_watchdog.DEFAULT_MIN_DEADLINE_SEC, fail_stalled_frames=False,
+                 startup_timeline=None, scene=None, api_address=DEFAULT_API_ADDRESS):
+        self.use_asyncio = use_asyncio
+        # The phases of start(), recorded in the runner's timeline if given
+        self.startup_timeline = startup_timeline or StartupTimeline()
+        self.port_base = port_base
+        # Checked before anything is bound
+        api_endpoint(api_address, port_base)
+        self.api_address = api_address
+        self.api_sockets = {}
+        # The pair of sockets stop() wakes the server loop up with
+        self.stop_sender = None
+        self.stop_receiver = None
+        # LGSVL__SIMULATOR_HOST and LGSVL__SIMULATOR_PORT if not given
+        self.simulator_host = simulator_host
+        self.simulator_port = simulator_port
+        self.pipelined_frames = pipelined_frames
+        self.metrics = BridgeMetrics(TIER4_API_NAMES, metrics_dir, metrics_interval)
+        self.agent_pool = AgentPool(agent_pool_size, self.metrics)
+        self.scene_cache = SceneCache(self.metrics)
+        self.frame_pacer = FramePacer(self.metrics)
+        self.frame_watchdog = frame_watchdog.FrameWatchdog(self.metrics, frame_deadline_factor, frame_min_deadline,
+                                                           fail_stalled_frames, metrics_dir, TIER4_API_NAMES)
+        # Lanelet traffic light id -> signal controllable uids, per scene
+        self.signal_map = traffic_lights.load_signal_map(signal_map_file) if signal_map_file else {}
+        self.traffic_light_controller = traffic_lights.TrafficLightController(self.metrics)
+        self.state_tracker = state_tracker.EntityStateTracker(skip_unchanged_states, self.metrics,
+                                                              **(state_tolerances or {}))
+        # The scene to load on initialize, LGSVL__MAP if not set; the runner
+        # sets it per scenario in the suite mode
+        self.scene = scene
+        # The scene known to be loaded in the simulator, to tell a reset from a
+        # load without querying the simulator
+        self.loaded_scene = None
+        self.sensor_pub_address = sensor_pub_address
+        # A directory shared with the simulator, which saves the LiDAR scans there
+        self.lidar_dir = lidar_dir
+        # Bound on the first sensor attachment
+        self.sensor_publisher = None
+        # The LiDAR attachments are made on the simulator worker, the detection
+        # ones on the event loop
+        self.sensor_publisher_lock = threading.Lock()
+        self.detection_range_m = detection_range_m
+        self.detection_fov_deg = detection_fov_deg
+        self.sensor_scheduler = sensor_streaming.SensorScheduler()
+        # The spawned entities' (length, width, height, label), the ground truth
+        # detections report along with the states of the frame
+        self.entity_boxes = {}
+        self.record_file = record_file
+        self.recorder = None
+        self.loop = None
+        self.sim_executor = None
+        self.sim_worker = None
+        # The frame step running on the simulator worker in the pipelined mode
+        self.pending_step = None
+        self.pending_step_error = None
+        self.simulator_queue_depth = 0
+        self.queue_stats = PortQueueStats(TIER4_API_PORTS)
         self.is_api_initialized = False
         self.sim = None
         self.current_sim_time = 0
@@ -97,6 +337,17 @@ class Tier4LgSvlBridge():
         # 'Agents' stores both NPCs and peds as there is no difference between them
         # in terms of the TierIV simulation scenario run
         self.agents = {}
+        # Agent states received during a frame, keyed by the agent name and
+        # pushed to the simulator right before the next simulation step
+        self.pending_agent_states = {}
+        self.pending_agent_states_lock = threading.Lock()
+        # Simulator calls made during the current frame, counted on the thread
+        # making them (the simulator worker, if any); exported as the
+        # frame_simulator_calls gauge once the frame is stepped
+        self.frame_round_trips = 0
+        self.agent_states_snapshot = None
+        # The states of the last UpdateEntityStatus request
+        self.entity_states = None
         self.map_origin_northing = 0
         self.map_origin_easting = 0
 
@@ -109,31 +360,113 @@ class Tier4LgSvlBridge():
         self.current_ros_time = self.initial_ros_time
         self.ego = None
         self.agents.clear()
+        self.sensor_scheduler.clear()
+        self.entity_boxes.clear()
+        self.state_tracker.clear()
+        self.pending_step_error = None
+        with self.pending_agent_states_lock:
+            self.pending_agent_states.clear()
+        self.frame_round_trips = 0
+        self.agent_states_snapshot = None
+        self.entity_states = None
 
     def initialize_api_sockets(self):
         self.api_sockets = {}
-        context = zmq.Context()
-        self.poller = zmq.Poller()
+        # The inproc endpoints are only reachable from the same context, the
+        # process-wide one; the others get a context (an I/O thread) per bridge
+        shared_context = self.api_address.startswith("inproc://")
+        if self.use_asyncio:
+            if shared_context:
+                context = zmq.asyncio.Context.shadow(zmq.Context.instance().underlying)
+            else:
+                context = zmq.asyncio.Context()
+        else:
+            context = zmq.Context.instance() if shared_context else zmq.Context()
+            self.poller = zmq.Poller()
+        stop_address = f"inproc://tier4-bridge-stop-{id(self)}"
+        self.stop_receiver = context.socket(zmq.PAIR)
+        self.stop_receiver.bind(stop_address)
+        # Only ever used by stop(), from whichever thread calls it
+        self.stop_sender = zmq.Context.shadow(context.underlying).socket(zmq.PAIR)
+        self.stop_sender.connect(stop_address)
+        if not self.use_asyncio:
+            self.poller.register(self.stop_receiver, zmq.POLLIN)
         for port in TIER4_API_PORTS:
             api_socket = context.socket(zmq.REP)
-            bind_address = f"tcp://*:{port}"
+            for option, value in API_SOCKET_OPTIONS.items():
+                api_socket.setsockopt(option, value)
+            bind_address = api_endpoint(self.api_address, self.bind_port(port))
             api_socket.bind(bind_address)
-            self.poller.register(api_socket)
-            log.info(f"Registered listener for the port {port}")
+            if not self.use_asyncio:
+                self.poller.register(api_socket)
+            log.info(f"Registered listener at {bind_address}")
             self.api_sockets[port] = api_socket
 
+    def bind_port(self, port):
+        return self.port_base + port - DEFAULT_PORT_BASE
+
     def fill_handlers_lookup_table(self):
+        api = simulation_api_schema_pb2
         self.handlers = {}
-        self.handlers[5555] = self.handle_init_request
-        self.handlers[5556] = self.handle_update_frame
-        self.handlers[5557] = self.handle_update_sensor_frame
-        self.handlers[5558] = self.handle_spawn_vehicle
-        self.handlers[5559] = self.handle_spawn_pedestrian_entity
-        self.handlers[5560] = self.handle_spawn_misc_object_entity
-        self.handlers[5561] = self.handle_despawn_entity
-        self.handlers[5562] = self.handle_update_entity_status
-        self.handlers[5563] = self.handle_attach_lidar_sensor
-        self.handlers[5564] = self.handle_attach_detection_sensor
+        self.handlers[5555] = ApiHandler(api.InitializeRequest(), api.InitializeResponse(),
+                                         self.handle_init_request)
+        self.handlers[5556] = ApiHandler(api.UpdateFrameRequest(), api.UpdateFrameResponse(),
+                                         self.handle_update_frame)
+        self.handlers[5557] = ApiHandler(api.UpdateSensorFrameRequest(), api.UpdateSensorFrameResponse(),
+                                         self.handle_update_sensor_frame)
+        self.handlers[5558] = ApiHandler(api.SpawnVehicleEntityRequest(), api.SpawnVehicleEntityResponse(),
+                                         self.handle_spawn_vehicle)
+        self.handlers[5559] = ApiHandler(api.SpawnPedestrianEntityRequest(), api.SpawnPedestrianEntityResponse(),
+                                         self.handle_spawn_pedestrian_entity)
+        self.handlers[5560] = ApiHandler(api.SpawnMiscObjectEntityRequest(), api.SpawnMiscObjectEntityResponse(),
+                                         self.handle_spawn_misc_object_entity)
+        self.handlers[5561] = ApiHandler(api.DespawnEntityRequest(), api.DespawnEntityResponse(),
+                                         self.handle_despawn_entity)
+        self.handlers[5562] = ApiHandler(api.UpdateEntityStatusRequest(), api.UpdateEntityStatusResponse(),
+                                         self.handle_update_entity_status)
+        self.handlers[5563] = ApiHandler(api.AttachLidarSensorRequest(), api.AttachLidarSensorResponse(),
+                                         self.handle_attach_lidar_sensor)
+        self.handlers[5564] = ApiHandler(api.AttachDetectionSensorRequest(), api.AttachDetectionSensorResponse(),
+                                         self.handle_attach_detection_sensor)
+        self.handlers[5565] = ApiHandler(api.UpdateTrafficLightsRequest(), api.UpdateTrafficLightsResponse(),
+                                         self.handle_update_traffic_lights)
+
+    def process_request(self, port, msg):
+        # 'msg' is either bytes or a zmq.Frame received with copy=False, which
+        # is parsed right from the frame buffer
+        handler = self.handlers[port]
+        started = time.perf_counter()
+        request = handler.request
+        if isinstance(msg, zmq.Frame):
+            msg = msg.buffer
+        try:
+            request.ParseFromString(msg)
+        except TypeError:
+            # The protobuf runtimes not accepting a memoryview
+            request.ParseFromString(bytes(msg))
+        parsed = time.perf_counter()
+        response = handler.response
+        response.Clear()
+        try:
+            handler.handle(request, response)
+        except frame_watchdog.FrameStalledError as e:
+            response.result.success = False
+            response.result.description = str(e)
+        handled = time.perf_counter()
+        self.frame_watchdog.record_request(port, handled - parsed)
+        resp_msg = response.SerializeToString()
+        serialized = time.perf_counter()
+        self.metrics.record(port, "parse", parsed - started)
+        self.metrics.record(port, "handle", handled - parsed)
+        self.metrics.record(port, "serialize", serialized - handled)
+        return resp_msg
+
+    def failed_response(self, port, description):
+        response = self.handlers[port].response
+        response.Clear()
+        response.result.success = False
+        response.result.description = description
+        return response.SerializeToString()
 
     def safe_get_envar(self, envar_name):
         try:
@@ -205,6 +538,32 @@ class Tier4LgSvlBridge():
         agent_state = lgsvl.AgentState(transform, linear, angular)
         return agent_state
 
+    def agent_states_from_entity_statuses(self, statuses):
+        # A batch version of agent_state_from_world_coords() for a sequence of
+        # openscenario_msgs.EntityStatus messages
+        return self.agent_states_from_unity_states(self.unity_states_from_entity_statuses(statuses))
+
+    def unity_states_from_entity_statuses(self, statuses):
+        return unity_coordinates.entity_statuses_to_unity(
+            statuses, self.map_origin_northing, self.map_origin_easting)
+
+    def unity_states_from_world_states(self, world_states):
+        return unity_coordinates.to_unity_states(
+            *world_states, self.map_origin_northing, self.map_origin_easting)
+
+    def agent_states_from_unity_states(self, unity_states):
+        agent_states = []
+        for position, rotation, velocity, angular_velocity in zip(
+                unity_states.positions.tolist(),
+                unity_states.rotations.tolist(),
+                unity_states.velocities.tolist(),
+                unity_states.angular_velocities.tolist()):
+            transform = lgsvl.Transform(lgsvl.Vector(*position), lgsvl.Vector(*rotation))
+            agent_states.append(lgsvl.AgentState(transform,
+                                                 lgsvl.Vector(*velocity),
+                                                 lgsvl.Vector(*angular_velocity)))
+        return agent_states
+
     def compute_scene_origin_coordinates(self):
         # Here we rely on two facts:
         # 1. LG SVL does NOT work with huge maps which are >1 km in size
@@ -217,8 +576,23 @@ class Tier4LgSvlBridge():
         mgrs_square_size_meters = 100 * 1000
         map_origin = lgsvl.Transform(position=lgsvl.Vector(0, 0, 0))
         gps = self.sim.map_to_gps(map_origin)
-        self.map_origin_northing = gps.northing % mgrs_square_size_meters
-        self.map_origin_easting = gps.easting % mgrs_square_size_meters
+        return gps.northing % mgrs_square_size_meters, gps.easting % mgrs_square_size_meters
+
+    def scene_controllables(self):
+        # Controllable uid -> lgsvl.Controllable; the scene controllables (e.g.
+        # the traffic signals) survive a scene reset
+        return self.scene_cache.get(
+            self.loaded_scene, "controllables",
+            lambda: {controllable.uid: controllable for controllable in self.sim.get_controllables()})
+
+    def scene_signals(self):
+        # Lanelet traffic light id -> [lgsvl.Controllable]
+        scene_traffic_lights = self.signal_map.get(self.loaded_scene)
+        if not scene_traffic_lights:
+            return {}
+        return self.scene_cache.get(
+            self.loaded_scene, "signals",
+            lambda: traffic_lights.resolve_signals(scene_traffic_lights, self.scene_controllables()))
 
     def safely_stop_simulation(self):
         if self.sim:
@@ -227,10 +601,10 @@ class Tier4LgSvlBridge():
 
     def setup_sim(self):
         if self.sim:
-            self.sim.reset()
+            # load_scene() resets the scene
             return
-        simulator_host = self.safe_get_envar("LGSVL__SIMULATOR_HOST")
-        simulator_port = int(self.safe_get_envar("LGSVL__SIMULATOR_PORT"))
+        simulator_host = self.simulator_host or self.safe_get_envar("LGSVL__SIMULATOR_HOST")
+        simulator_port = int(self.simulator_port or self.safe_get_envar("LGSVL__SIMULATOR_PORT"))
         log.info(f"Connecting to the LG SVL at {simulator_host}:{simulator_port} ...")
         if not is_socket_alive(simulator_host, simulator_port):
             log.info(f"No LGSVL instance listening to {simulator_host}:{simulator_port} has"
@@ -240,27 +614,44 @@ class Tier4LgSvlBridge():
         self.sim = lgsvl.Simulator(simulator_host, simulator_port)
 
     def load_scene(self):
-        scene_name = self.safe_get_envar("LGSVL__MAP")
+        scene_name = self.scene or self.safe_get_envar("LGSVL__MAP")
         log.info(f"Loading scene {scene_name}")
-        if self.sim.current_scene == scene_name:
+        if self.loaded_scene is None:
+            self.loaded_scene = self.sim.current_scene
+        if self.loaded_scene == scene_name:
             log.info(f"The '{scene_name}' was already loaded, resetting it.")
             self.sim.reset()
         else:
+            # Unknown until the load succeeds
+            self.loaded_scene = None
+            # A (re)loaded scene has controllables of its own, the ones cached
+            # by an earlier load of it are stale
+            self.scene_cache.invalidate(scene_name)
             self.sim.load(scene_name)
-        self.compute_scene_origin_coordinates()
+            self.loaded_scene = scene_name
+        self.map_origin_northing, self.map_origin_easting = self.scene_cache.get(
+            scene_name, "map_origin", self.compute_scene_origin_coordinates)
 
-    def handle_init_request(self, msg):
+    def handle_init_request(self, request, response):
         # port 5555
-        req = simulation_api_schema_pb2.InitializeRequest()
-        req.ParseFromString(msg)
-        response = simulation_api_schema_pb2.InitializeResponse()
         response.result.success = False
+        self.wait_for_pending_step()
         self.soft_reset()
         try:
             self.setup_sim()
             self.load_scene()
-            self.realtime_factor = req.realtime_factor
-            self.step_time = req.step_time
+            # The scene load or reset restores the signals' default policies
+            self.traffic_light_controller.reset(self.scene_signals())
+            self.agent_pool.warm(self.sim, {
+                lgsvl.AgentType.NPC: NPC_CONFIGURATIONS,
+                lgsvl.AgentType.PEDESTRIAN: PEDESTRIAN_CONFIGURATIONS,
+            })
+            self.realtime_factor = request.realtime_factor
+            self.step_time = request.step_time
+            if self.frame_pacer.frames:
+                log.info(f"The previous scenario ran {self.frame_pacer.summary()}")
+            self.frame_pacer.reset(self.realtime_factor)
+            self.frame_watchdog.configure(self.step_time, self.realtime_factor)
             self.is_api_initialized = True
             response.result.success = True
             response.result.description = \
@@ -268,16 +659,11 @@ class Tier4LgSvlBridge():
                 f", step time {self.step_time} seconds."
         except Exception as e:
             response.result.description = str(e)
-
-        resp_msg = response.SerializeToString()
         log.info(f"{response.result.description}")
-        return resp_msg
 
-    def handle_update_frame(self, msg):
+    def handle_update_frame(self, request, response):
         # port 5556
-        request = simulation_api_schema_pb2.UpdateFrameRequest()
-        request.ParseFromString(msg)
-        response = simulation_api_schema_pb2.UpdateFrameResponse()
+        self.metrics.record_frame_request()
         response.result.success = False
         if not self.is_api_initialized:
             response.result.description = "simulator have not initialized yet."
@@ -287,7 +673,19 @@ class Tier4LgSvlBridge():
             if self.initial_ros_time == 0:
                 self.initial_ros_time = self.current_ros_time
             try:
-                self.sim.run(self.step_time)
+                self.wait_for_pending_step()
+                if self.pending_step_error:
+                    error, self.pending_step_error = self.pending_step_error, None
+                    raise RuntimeError(f"previous frame step failed: {error}")
+                # Holds the step back to the requested realtime factor
+                self.frame_pacer.pace(request.current_time)
+                self.frame_watchdog.frame_started(request.current_time)
+                if self.pipelined_frames:
+                    # Reply right away, the next request touching the simulator
+                    # waits for this step in wait_for_pending_step()
+                    self.pending_step = self.sim_executor.submit(self.step_simulation)
+                else:
+                    self.step_simulation()
                 response.result.success = True
                 response.result.description = "succeed to update frame"
             except Exception as e:
@@ -295,38 +693,38 @@ class Tier4LgSvlBridge():
         # log.info(f"UpdateFrameRequest.current_time : {request.current_time}"
         #         f", current_ros_time : {request.current_ros_time.sec}"
         #         f", elapsed ROS: {self.current_ros_time - self.initial_ros_time}")
-        resp_msg = response.SerializeToString()
-        return resp_msg
 
-    def handle_update_sensor_frame(self, msg):
+    def handle_update_sensor_frame(self, request, response):
         # port 5557
-        request = simulation_api_schema_pb2.UpdateSensorFrameRequest()
-        request.ParseFromString(msg)
-        # TODO: handle:
-        # current_time, current_ros_time
-
-        # TODO: As I get it, lidars/radars/other sensors must update and post to their
-        # corresp. ROS topics at this step
-
-        response = simulation_api_schema_pb2.UpdateSensorFrameResponse()
         response.result.success = False
-        response.result.description = "update_sensor_frame not implemented"
-        resp_msg = response.SerializeToString()
-        # log.error(response.result.description)  # DEBUG
-        return resp_msg
+        if not self.is_api_initialized:
+            response.result.description = "simulator have not initialized yet."
+            return
+        try:
+            due_sensors = self.sensor_scheduler.due(request.current_time)
+            for due_sensor in due_sensors:
+                self.metrics.record_sensor_lag(due_sensor.name, due_sensor.lag)
+                if due_sensor.missed:
+                    self.metrics.count("sensor_updates_missed", due_sensor.missed)
+            if due_sensors:
+                # All the due sensors are updated by a single simulator worker job,
+                # queued behind a pipelined frame step rather than waiting for it
+                self.run_on_simulator(self.update_sensors, due_sensors, request.current_time)
+            response.result.success = True
+            response.result.description = "succeed to update sensor frame"
+        except Exception as e:
+            response.result.description = str(e)
 
-    def handle_spawn_vehicle(self, msg):
+    def handle_spawn_vehicle(self, request, response):
         # port 5558
-        request = simulation_api_schema_pb2.SpawnVehicleEntityRequest()
-        request.ParseFromString(msg)
-        response = simulation_api_schema_pb2.SpawnVehicleEntityResponse()
         response.result.success = False
         response.result.description = ""
 
         if not self.sim:
             response.result.description = "LG SVL simulator is not running"
-            resp_msg = response.SerializeToString()
-            return resp_msg
+            return
+
+        self.wait_for_pending_step()
 
         vehicle_name = request.parameters.name
         vehicle_type = request.parameters.vehicle_category
@@ -345,6 +743,7 @@ class Tier4LgSvlBridge():
                     ego_configuration,
                     lgsvl.AgentType.EGO,
                     agent_state)
+                self.frame_round_trips += 1
             else:
                 # As the TierIV editor does not allow setting any assetID as the NPC name,
                 # the bridge just requests some default NPC creation. Any next NPC is
@@ -352,29 +751,28 @@ class Tier4LgSvlBridge():
                 npc_configuration = NPC_CONFIGURATIONS[
                     len(self.agents) % len(NPC_CONFIGURATIONS)
                 ]
-                self.agents[vehicle_name] = self.sim.add_agent(
+                self.agents[vehicle_name] = self.agent_pool.acquire(
+                    self.sim,
                     npc_configuration,
                     lgsvl.AgentType.NPC,
                     agent_state)
+                self.frame_round_trips += 1
+            self.record_entity_box(vehicle_name, request.parameters.bounding_box,
+                                   sensor_streaming.DETECTION_LABEL_VEHICLE)
             response.result.success = True
         except Exception as e:
             response.result.description = str(e)
 
-        resp_msg = response.SerializeToString()
-        return resp_msg
-
-    def handle_spawn_pedestrian_entity(self, msg):
+    def handle_spawn_pedestrian_entity(self, request, response):
         # port 5559
-        request = simulation_api_schema_pb2.SpawnPedestrianEntityRequest()
-        request.ParseFromString(msg)
-        response = simulation_api_schema_pb2.SpawnPedestrianEntityResponse()
         response.result.success = False
         response.result.description = ""
 
         if not self.sim:
             response.result.description = "LG SVL simulator is not running"
-            resp_msg = response.SerializeToString()
-            return resp_msg
+            return
+
+        self.wait_for_pending_step()
 
         ped_name = request.parameters.name
         ped_type = request.parameters.pedestrian_category
@@ -392,154 +790,632 @@ class Tier4LgSvlBridge():
             ped_configuration = PEDESTRIAN_CONFIGURATIONS[
                 len(self.agents) % len(PEDESTRIAN_CONFIGURATIONS)
             ]
-            self.agents[ped_name] = self.sim.add_agent(
+            self.agents[ped_name] = self.agent_pool.acquire(
+                self.sim,
                 ped_configuration,
                 lgsvl.AgentType.PEDESTRIAN,
                 agent_state)
+            self.frame_round_trips += 1
+            self.record_entity_box(ped_name, request.parameters.bounding_box,
+                                   sensor_streaming.DETECTION_LABEL_PEDESTRIAN)
             response.result.success = True
         except Exception as e:
             response.result.description = str(e)
 
-        resp_msg = response.SerializeToString()
-        return resp_msg
-
-    def handle_spawn_misc_object_entity(self, msg):
+    def handle_spawn_misc_object_entity(self, request, response):
         # port 5560
-        request = simulation_api_schema_pb2.SpawnMiscObjectEntityRequest()
-        request.ParseFromString(msg)
         # TODO: handle:
         # parameters: name, misc_object_category, bounding_box
-        response = simulation_api_schema_pb2.SpawnMiscObjectEntityResponse()
         response.result.success = False
         response.result.description = "spawn_misc_object_entity not implemented"
-        resp_msg = response.SerializeToString()
         log.error(response.result.description)  # DEBUG
-        return resp_msg
 
-    def handle_despawn_entity(self, msg):
+    def handle_despawn_entity(self, request, response):
         # port 5561
-        request = simulation_api_schema_pb2.DespawnEntityRequest()
-        request.ParseFromString(msg)
         agent_name = request.name
-        response = simulation_api_schema_pb2.DespawnEntityResponse()
         response.result.success = False
         try:
             if agent_name == "ego":
                 # This is a hack to handle only a car named "ego" BUT not of an
                 # 'ego' type, as the scenario runner does not works with genuine Ego
                 # vehicles without the AutowareAuto AD stack running.
-                self.sim.remove_agent(self.ego)
+                agent = self.ego
+                if agent is None:
+                    raise KeyError(agent_name)
                 self.ego = None
             else:
-                self.sim.remove_agent(self.agents[agent_name])
-                self.agents.pop(agent_name)
+                agent = self.agents.pop(agent_name)
+            with self.pending_agent_states_lock:
+                self.pending_agent_states.pop(agent_name, None)
+            self.entity_boxes.pop(agent_name, None)
+            self.state_tracker.forget(agent_name)
+            self.sensor_scheduler.remove(f"lidar/{agent_name}")
+            self.sensor_scheduler.remove(f"detection/{agent_name}")
+            # The bookkeeping above is done right away; the simulator side removal
+            # (or parking of a pooled agent) is queued behind a running frame step
+            # in the asyncio mode.
+            self.run_on_simulator(self.release_agent, agent)
             response.result.success = True
             response.result.description = f"successfully despawned agent {agent_name}"
         except Exception as e:
             response.result.description = str(e)
-        resp_msg = response.SerializeToString()
         log.error(response.result.description)  # DEBUG
-        return resp_msg
 
-    def handle_update_entity_status(self, msg):
+    def handle_update_entity_status(self, request, response):
         # port 5562
-        request = simulation_api_schema_pb2.UpdateEntityStatusRequest()
-        request.ParseFromString(msg)
-        response = simulation_api_schema_pb2.UpdateEntityStatusResponse()
         response.result.success = False
 
         if not self.ego or not self.sim:
             # TODO: handle the case with multiple egos and NPCs
-            resp_msg = response.SerializeToString()
-            return resp_msg
+            return
         try:
-            for agent_status in request.status:
-                agent_name = agent_status.name
-                new_agent_state = self.agent_state_from_world_coords(
-                    agent_status.pose.position,
-                    agent_status.pose.orientation,
-                    agent_status.action_status.twist.linear,
-                    agent_status.action_status.twist.angular
-                )
-
-                # log.info(f"New {agent_name} position: {print_vector(new_agent_state.position)}, "
+            names = [agent_status.name for agent_status in request.status]
+            # This is a hack to handle only a car named "ego" BUT not of an
+            # 'ego' type, as the scenario runner does not works with genuine Ego
+            # vehicles without the AutowareAuto AD stack running.
+            agents = [self.ego if agent_name == "ego" else self.agents[agent_name] for agent_name in names]
+            rows, new_agent_states = self.agent_states_to_push(names, request.status)
+            for row, new_agent_state in zip(rows, new_agent_states):
+                # log.info(f"New {names[row]} position: {print_vector(new_agent_state.position)}, "
                 #         f"rotation: {print_vector(new_agent_state.rotation)}")
-                if agent_name == "ego":
-                    # This is a hack to handle only a car named "ego" BUT not of an
-                    # 'ego' type, as the scenario runner does not works with genuine Ego
-                    # vehicles without the AutowareAuto AD stack running.
-                    self.ego.state = new_agent_state
-                else:
-                    self.agents[agent_name].state = new_agent_state
+                # A later update of the same agent within the frame replaces this one
+                with self.pending_agent_states_lock:
+                    self.pending_agent_states[names[row]] = (agents[row], new_agent_state)
+            self.fill_updated_entity_statuses(names, request.status, response.status)
             response.result.success = True
         except Exception as e:
             response.result.description = str(e)
 
-        resp_msg = response.SerializeToString()
-        return resp_msg
-
-    def handle_attach_lidar_sensor(self, msg):
+    def agent_states_to_push(self, names, statuses):
+        # Returns the rows of the 'statuses' to push to the simulator and their
+        # lgsvl.AgentState
+        if len(statuses) < BATCH_CONVERSION_MIN_ENTITIES and not self.state_tracker.enabled \
+                and not self.sensor_scheduler.has_streams(sensor_streaming.DetectionStream):
+            # No state arrays are needed by the state tracker nor the detections
+            self.entity_states = None
+            return range(len(statuses)), [
+                self.agent_state_from_world_coords(status.pose.position,
+                                                   status.pose.orientation,
+                                                   status.action_status.twist.linear,
+                                                   status.action_status.twist.angular)
+                for status in statuses]
+        world_states = unity_coordinates.WorldStates(*unity_coordinates.entity_status_arrays(statuses))
+        # Replaced rather than updated, the ground truth detections are
+        # computed from it on the sensor publisher thread
+        self.entity_states = AgentStatesSnapshot(
+            self.current_sim_time, {name: row for row, name in enumerate(names)}, world_states)
+        unity_states = self.unity_states_from_world_states(world_states)
+        # Only the entities the simulator can not keep moving on its own are pushed
+        rows = np.flatnonzero(self.state_tracker.changed(names, unity_states, self.current_sim_time))
+        return rows.tolist(), self.agent_states_from_unity_states(
+            unity_coordinates.UnityStates(*(array[rows] for array in unity_states)))
+
+    def handle_attach_lidar_sensor(self, request, response):
         # port 5563
-        request = simulation_api_schema_pb2.AttachLidarSensorRequest()
-        request.ParseFromString(msg)
-        # TODO: handle:
-        # configuration: entity, horizontal_resolution, [vertical_angles], scan_duration, topic_name
-        response = simulation_api_schema_pb2.AttachLidarSensorResponse()
         response.result.success = False
-        response.result.description = "attach_lidar_sensor not implemented"
-        resp_msg = response.SerializeToString()
-        log.error(response.result.description)  # DEBUG
-        return resp_msg
+        configuration = request.configuration
+        try:
+            if not self.lidar_dir:
+                raise RuntimeError(empty_envar_error_msg("LGSVL__BRIDGE_LIDAR_DIR"))
+            agent = self.ego if configuration.entity == "ego" else self.agents.get(configuration.entity)
+            if agent is None:
+                raise KeyError(f"no entity named '{configuration.entity}'")
+            if configuration.horizontal_resolution < 0 or \
+                    any(abs(angle) > math.pi / 2 for angle in configuration.vertical_angles):
+                raise ValueError("the LiDAR horizontal resolution and vertical angles are out of range"
+                                 " (in radians)")
+            self.wait_for_pending_step()
+            # The PythonAPI can not add a sensor to a running agent, so the LiDAR
+            # of the vehicle configuration is streamed with the requested timing
+            sensor = next((sensor for sensor in agent.get_sensors()
+                           if isinstance(sensor, lgsvl.LidarSensor)), None)
+            self.frame_round_trips += 1
+            if sensor is None:
+                raise ValueError(f"the '{configuration.entity}' vehicle configuration has no LiDAR")
+            self.ensure_sensor_publisher()
+            lidar_stream = sensor_streaming.LidarStream(
+                configuration.entity, sensor, configuration, self.lidar_dir)
+            self.sensor_scheduler.add(f"lidar/{configuration.entity}", lidar_stream, self.current_sim_time)
+            response.result.success = True
+            response.result.description = \
+                f"LiDAR '{sensor.name}' of '{configuration.entity}' streamed to '{lidar_stream.topic}'"
+        except Exception as e:
+            response.result.description = str(e)
+        log.info(response.result.description)
 
-    def handle_attach_detection_sensor(self, msg):
+    def handle_attach_detection_sensor(self, request, response):
         # port 5564
-        request = simulation_api_schema_pb2.AttachDetectionSensorRequest()
-        request.ParseFromString(msg)
-        # TODO: handle:
-        # configuration: entity, update_duration, topic_name
-        response = simulation_api_schema_pb2.AttachDetectionSensorResponse()
         response.result.success = False
-        response.result.description = "attach_detection_sensor not implemented"
-        resp_msg = response.SerializeToString()
-        log.error(response.result.description)  # DEBUG
-        return resp_msg
+        configuration = request.configuration
+        try:
+            if configuration.entity != "ego" and configuration.entity not in self.agents:
+                raise KeyError(f"no entity named '{configuration.entity}'")
+            self.ensure_sensor_publisher()
+            detection_stream = sensor_streaming.DetectionStream(
+                configuration.entity, configuration, self.detection_range_m, self.detection_fov_deg)
+            self.sensor_scheduler.add(f"detection/{configuration.entity}", detection_stream,
+                                      self.current_sim_time)
+            response.result.success = True
+            response.result.description = \
+                f"ground truth detections of '{configuration.entity}' streamed to '{detection_stream.topic}'"
+        except Exception as e:
+            response.result.description = str(e)
+        log.info(response.result.description)
+
+    def handle_update_traffic_lights(self, request, response):
+        # port 5565
+        response.result.success = False
+        if not self.is_api_initialized:
+            response.result.description = "simulator have not initialized yet."
+            return
+        try:
+            controls, unmapped = self.traffic_light_controller.changed_controls(request.states)
+            if controls:
+                # All the changed signals in a single simulator worker job
+                self.run_on_simulator(self.apply_traffic_light_controls, controls)
+            response.result.success = True
+            response.result.description = f"updated {len(controls)} signal(s)"
+            if unmapped:
+                response.result.description += f", no signal for the traffic light(s) {unmapped}"
+        except Exception as e:
+            response.result.description = str(e)
+
+    def release_agent(self, agent):
+        self.agent_pool.release(self.sim, agent)
+        self.frame_round_trips += 1
+
+    def apply_traffic_light_controls(self, controls):
+        self.traffic_light_controller.apply(controls)
+        self.frame_round_trips += len(controls)
+
+    def ensure_sensor_publisher(self):
+        with self.sensor_publisher_lock:
+            if self.sensor_publisher is None:
+                self.sensor_publisher = sensor_streaming.SensorPublisher(self.sensor_pub_address, self.metrics)
+                self.sensor_publisher.start()
+
+    def update_sensors(self, due_sensors, current_time):
+        # The PythonAPI has no call saving several sensors at once, so the LiDAR
+        # scans are saved one call each, back to back
+        for due_sensor in due_sensors:
+            if isinstance(due_sensor.stream, sensor_streaming.LidarStream):
+                self.capture_lidar_scan(due_sensor.stream, current_time)
+            else:
+                self.publish_detections(due_sensor.stream, current_time)
+
+    def capture_lidar_scan(self, lidar_stream, current_time):
+        # Only the save is made on the request; the scan is read (memory-mapped)
+        # and published on the sensor publisher thread
+        scan = lidar_stream.capture(current_time)
+        self.frame_round_trips += 1
+        if scan is None:
+            return
+        filename, header = scan
+        self.sensor_publisher.submit(
+            lidar_stream.topic,
+            lambda: sensor_streaming.scan_message(filename, header),
+            discard=lambda: os.remove(filename))
+
+    def publish_detections(self, detection_stream, current_time):
+        # Computed on the sensor publisher thread from the states the TierIV
+        # runner sent last, the simulator-moved agents at their last frame's
+        # states; both are replaced rather than updated by the next ones
+        header = detection_stream.start_update(current_time)
+        entity_states = self.entity_states
+        snapshot = self.agent_states_snapshot
+        entity_boxes = dict(self.entity_boxes)
+        self.sensor_publisher.submit(
+            detection_stream.topic,
+            lambda: detection_stream.message(header, merge_agent_states(entity_states, snapshot), entity_boxes))
+
+    def simulator_moved_agents(self):
+        # The agents the simulator moves, rather than the TierIV runner
+        return {"ego": self.ego} if self.ego else {}
+
+    def record_entity_box(self, name, bounding_box, label):
+        dimensions = bounding_box.dimensions
+        self.entity_boxes[name] = (dimensions.x, dimensions.y, dimensions.z, label)
+
+    def step_simulation(self):
+        started = time.perf_counter()
+        try:
+            self.flush_agent_states()
+            self.sim.run(self.step_time)
+            self.frame_round_trips += 1
+            self.take_agent_states_snapshot()
+            self.frame_round_trips += self.agent_pool.pin_parked(self.current_sim_time)
+        finally:
+            overrun = self.frame_watchdog.frame_finished()
+            self.metrics.record_frame_step(time.perf_counter() - started)
+            self.metrics.set_gauge("frame_simulator_calls", self.frame_round_trips)
+            self.metrics.count("simulator_calls", self.frame_round_trips)
+            log.debug(f"Simulator round-trips in the frame: {self.frame_round_trips}")
+            self.frame_round_trips = 0
+        if overrun:
+            raise frame_watchdog.FrameStalledError(overrun)
+
+    def take_agent_states_snapshot(self):
+        # The PythonAPI has no bulk state query, so this is one state getter per
+        # agent the simulator moves, once per frame; the other agents are where
+        # the TierIV runner has put them, as its requests tell
+        agents = self.simulator_moved_agents()
+        names = list(agents)
+        agent_states = [agents[name].state for name in names]
+        self.frame_round_trips += len(names)
+        world_states = unity_coordinates.agent_states_to_world(
+            agent_states, self.map_origin_northing, self.map_origin_easting)
+        self.agent_states_snapshot = AgentStatesSnapshot(
+            self.current_sim_time,
+            {name: row for row, name in enumerate(names)},
+            world_states)
+
+    def fill_updated_entity_statuses(self, names, entity_statuses, updated_entity_statuses):
+        # Answers with the requested statuses, but for the agents the simulator
+        # moves, which are answered with their states of the last completed frame;
+        # in the pipelined mode that is the frame before the one which may be still
+        # running. UpdatedEntityStatus is not the EntityStatus message, so the
+        # statuses are copied by their fields rather than extend()-ed.
+        add = updated_entity_statuses.add
+        for entity_status in entity_statuses:
+            add(name=entity_status.name, action_status=entity_status.action_status, pose=entity_status.pose)
+        snapshot = self.agent_states_snapshot
+        if snapshot is None:
+            return
+        for name, row in snapshot.index.items():
+            if name not in names:
+                continue
+            updated = updated_entity_statuses[names.index(name)]
+            position = updated.pose.position
+            position.x, position.y, position.z = snapshot.states.positions[row].tolist()
+            orientation = updated.pose.orientation
+            orientation.x, orientation.y, orientation.z, orientation.w = \
+                snapshot.states.orientations[row].tolist()
+            linear = updated.action_status.twist.linear
+            linear.x, linear.y, linear.z = snapshot.states.linear_velocities[row].tolist()
+            angular = updated.action_status.twist.angular
+            angular.x, angular.y, angular.z = snapshot.states.angular_velocities[row].tolist()
+
+    def wait_for_pending_step(self):
+        # The barrier of the pipelined mode: called before anything touching the
+        # simulator state. A step failure is reported by the next UpdateFrame.
+        pending_step = self.pending_step
+        if pending_step is None:
+            return
+        if threading.current_thread() is self.sim_worker and not pending_step.done():
+            # In the asyncio mode, a step submitted after this request was queued
+            # runs on this very worker right after it: this request goes first
+            return
+        try:
+            pending_step.result(self.frame_watchdog.wait_timeout())
+        except concurrent.futures.TimeoutError:
+            # The step is left pending, every request touching the simulator
+            # fails until it completes
+            raise frame_watchdog.FrameStalledError(
+                self.frame_watchdog.stall_description() or "frame step stalled")
+        except Exception as e:
+            log.error(f"Pipelined frame step failed: {e}")
+            self.pending_step_error = e
+        self.pending_step = None
+
+    def flush_agent_states(self):
+        # The PythonAPI has no bulk state setter, so the buffered states are pushed
+        # one call per agent, but only once per frame whatever the number of
+        # UpdateEntityStatus requests received for the agent during the frame.
+        with self.pending_agent_states_lock:
+            pending_agent_states = self.pending_agent_states
+            self.pending_agent_states = {}
+        for agent, agent_state in pending_agent_states.values():
+            agent.state = agent_state
+            self.frame_round_trips += 1
+
+    def run_on_simulator(self, function, *args):
+        # Fire-and-forget simulator call. Without the simulator worker (polling
+        # mode) the call is made right away and its errors are propagated.
+        if not self.sim_executor:
+            return function(*args)
+
+        def log_failure(future):
+            if future.exception():
+                log.error(f"Simulator call {function.__name__} failed: {future.exception()}")
+
+        self.sim_executor.submit(function, *args).add_done_callback(log_failure)
 
     def start(self):
-        self.initialize_api_sockets()
-        self.fill_handlers_lookup_table()
-        self.setup_sim()
-        self.load_scene()
+        if self.use_asyncio:
+            self.loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self.loop)
+        if self.use_asyncio or self.pipelined_frames:
+            self.sim_executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix="tier4-bridge-sim",
+                initializer=self.register_sim_worker)
+        timeline = self.startup_timeline
+        # The simulator connection and the scene load take seconds, the API
+        # sockets are bound meanwhile
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1,
+                                                   thread_name_prefix="tier4-bridge-startup") as startup:
+            simulator_started = startup.submit(self.start_simulator)
+            with timeline.phase("bridge: bind the API ports"):
+                self.initialize_api_sockets()
+                self.fill_handlers_lookup_table()
+                if self.record_file:
+                    self.recorder = TrafficRecorder(self.record_file)
+            simulator_started.result()
+        self.frame_watchdog.start()
+
+    def register_sim_worker(self):
+        self.sim_worker = threading.current_thread()
+
+    def start_simulator(self):
+        timeline = self.startup_timeline
+        with timeline.phase("bridge: connect to the simulator"):
+            self.setup_sim()
+        with timeline.phase("bridge: load the scene"):
+            self.load_scene()
+
+    def record_traffic(self, port, received_time, msg, resp_msg):
+        if self.recorder:
+            self.recorder.record(port, received_time, msg.bytes, resp_msg)
+
+    def shutdown(self):
+        self.frame_watchdog.stop()
+        self.metrics.write()
+        if self.sensor_publisher:
+            self.sensor_publisher.stop()
+        if self.recorder:
+            self.recorder.close()
+        if self.sim_executor:
+            self.sim_executor.shutdown(wait=False)
+        # Unbinds the endpoints, the IPC socket files included
+        for api_socket in self.api_sockets.values():
+            api_socket.close()
+        self.stop_receiver.close()
+        self.stop_sender.close(linger=0)
+
+    def stop(self):
+        """Makes poll() shut the bridge down and return; callable from any thread"""
+        if self.stop_sender is not None and not self.stop_sender.closed:
+            self.stop_sender.send(b"")
 
     def poll(self):
+        if self.use_asyncio:
+            return self.poll_async()
+
+        poll_timeout = min(QUEUE_STATS_REPORT_INTERVAL_SEC, self.metrics.write_interval)
         while True:
             try:
-                new_data_sockets = dict(self.poller.poll())
+                new_data_sockets = dict(self.poller.poll(poll_timeout * 1000))
             except KeyboardInterrupt:
                 break
+            if self.stop_receiver in new_data_sockets:
+                break
 
-            for port in TIER4_API_PORTS:
+            ready_ports = [port for port in TIER4_API_PORTS
+                           if self.api_sockets[port] in new_data_sockets]
+            for requests_ahead, port in enumerate(ready_ports):
+                self.queue_stats.observe(port, requests_ahead)
                 api_socket = self.api_sockets[port]
-                if api_socket in new_data_sockets:
-                    msg = api_socket.recv()
-                    result = self.handlers[port](msg)
-                    api_socket.send(result)
+                msg = api_socket.recv(copy=False)
+                received_time = time.time()
+                result = self.process_request(port, msg)
+                sending = time.perf_counter()
+                api_socket.send(result, copy=False)
+                self.metrics.record(port, "send", time.perf_counter() - sending)
+                self.record_traffic(port, received_time, msg, result)
+            self.queue_stats.report_if_due()
+            self.metrics.write_if_due()
+
+        self.shutdown()
+
+    def poll_async(self):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self.serve())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.shutdown()
+
+    async def serve(self):
+        tasks = [asyncio.ensure_future(self.serve_port(port)) for port in TIER4_API_PORTS]
+        tasks.append(asyncio.ensure_future(self.report_queue_stats()))
+        tasks.append(asyncio.ensure_future(self.write_metrics()))
+        tasks.append(asyncio.ensure_future(self.stop_receiver.recv()))
+        # Served until stop() is called, or a task fails
+        done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.wait(pending)
+        for task in done:
+            task.result()
+
+    async def serve_port(self, port):
+        api_socket = self.api_sockets[port]
+        while True:
+            msg = await api_socket.recv(copy=False)
+            received_time = time.time()
+            stall = self.frame_watchdog.fail_stalled and self.frame_watchdog.stall_description()
+            if stall and port in SIMULATOR_BOUND_PORTS:
+                # Not queued behind the stalled step on the simulator worker
+                result = self.failed_response(port, stall)
+            elif port in SIMULATOR_BOUND_PORTS:
+                self.queue_stats.observe(port, self.simulator_queue_depth)
+                self.simulator_queue_depth += 1
+                try:
+                    if self.pending_step is not None:
+                        # The pipelined step's barrier, awaited here rather than
+                        # by the handler on the simulator worker running the step
+                        await asyncio.wait([asyncio.wrap_future(self.pending_step)])
+                    result = await self.loop.run_in_executor(
+                        self.sim_executor, self.process_request, port, msg)
+                finally:
+                    self.simulator_queue_depth -= 1
+            else:
+                self.queue_stats.observe(port, 0)
+                result = self.process_request(port, msg)
+            sending = time.perf_counter()
+            await api_socket.send(result, copy=False)
+            self.metrics.record(port, "send", time.perf_counter() - sending)
+            self.record_traffic(port, received_time, msg, result)
+
+    async def write_metrics(self):
+        while True:
+            await asyncio.sleep(self.metrics.write_interval)
+            self.metrics.write()
+
+    async def report_queue_stats(self):
+        while True:
+            await asyncio.sleep(QUEUE_STATS_REPORT_INTERVAL_SEC)
+            self.queue_stats.report()
 
 
 class Tier4LgSvlBridgeServerThread(threading.Thread):
-    def __init__(self, startup_completed):
-        threading.Thread.__init__(self, args=(startup_completed,))
+    """
+    Runs a Tier4LgSvlBridge. 'startup_completed' is set once the bridge has
+    started up, or failed to, in which case the thread ends with the failure
+    in 'startup_error'. The startup phases are recorded in 'startup_timeline'
+    if given, otherwise they are logged.
+    """
+    def __init__(self, startup_completed, use_asyncio=None, pipelined_frames=None,
+                 metrics_dir=None, record_file=None, agent_pool_size=None,
+                 sensor_pub_address=None, lidar_dir=None,
+                 port_base=None, simulator_host=None, simulator_port=None, skip_unchanged_states=None,
+                 signal_map_file=None, fail_stalled_frames=None, startup_timeline=None, scene=None,
+                 api_address=None, name=None):
+        threading.Thread.__init__(self, args=(startup_completed,), name=name)
         self.startup_completed = startup_completed
         self.startup_completed.clear()
+        self.startup_error = None
+        self.startup_timeline = startup_timeline
+        if use_asyncio is None:
+            use_asyncio = get_envar_flag("LGSVL__BRIDGE_ASYNCIO")
+        self.use_asyncio = use_asyncio
+        if pipelined_frames is None:
+            pipelined_frames = get_envar_flag("LGSVL__BRIDGE_PIPELINED_FRAMES")
+        self.pipelined_frames = pipelined_frames
+        if metrics_dir is None:
+            metrics_dir = os.environ.get("LGSVL__BRIDGE_METRICS_DIR")
+        self.metrics_dir = metrics_dir
+        self.metrics_interval = float(os.environ.get("LGSVL__BRIDGE_METRICS_INTERVAL_SEC",
+                                                     DEFAULT_METRICS_INTERVAL_SEC))
+        if record_file is None:
+            record_file = os.environ.get("LGSVL__BRIDGE_RECORD_FILE")
+        self.record_file = record_file
+        if agent_pool_size is None:
+            agent_pool_size = int(os.environ.get("LGSVL__BRIDGE_AGENT_POOL_SIZE", 0))
+        self.agent_pool_size = agent_pool_size
+        if port_base is None:
+            port_base = int(os.environ.get("LGSVL__BRIDGE_PORT_BASE", DEFAULT_PORT_BASE))
+        self.port_base = port_base
+        if api_address is None:
+            api_address = os.environ.get("LGSVL__BRIDGE_API_ADDRESS", DEFAULT_API_ADDRESS)
+        self.api_address = api_address
+        if sensor_pub_address is None:
+            sensor_pub_address = os.environ.get(
+                "LGSVL__BRIDGE_SENSOR_PUB_ADDRESS",
+                f"tcp://*:{port_base + SENSOR_PUB_PORT_OFFSET}")
+        self.sensor_pub_address = sensor_pub_address
+        if lidar_dir is None:
+            lidar_dir = os.environ.get("LGSVL__BRIDGE_LIDAR_DIR")
+        self.lidar_dir = lidar_dir
+        # The detection range and field of view are not part of the TierIV
+        # DetectionSensorConfiguration
+        self.detection_range_m = float(os.environ.get("LGSVL__BRIDGE_DETECTION_RANGE_M",
+                                                      sensor_streaming.DEFAULT_DETECTION_RANGE_M))
+        self.detection_fov_deg = float(os.environ.get("LGSVL__BRIDGE_DETECTION_FOV_DEG",
+                                                      sensor_streaming.DEFAULT_DETECTION_FOV_DEG))
+        if skip_unchanged_states is None:
+            skip_unchanged_states = get_envar_flag("LGSVL__BRIDGE_SKIP_UNCHANGED_STATES")
+        self.skip_unchanged_states = skip_unchanged_states
+        self.state_tolerances = {
+            "position_tolerance": float(os.environ.get("LGSVL__BRIDGE_POSITION_TOLERANCE_M",
+                                                       state_tracker.DEFAULT_POSITION_TOLERANCE_M)),
+            "rotation_tolerance": float(os.environ.get("LGSVL__BRIDGE_ROTATION_TOLERANCE_DEG",
+                                                       state_tracker.DEFAULT_ROTATION_TOLERANCE_DEG)),
+            "velocity_tolerance": float(os.environ.get("LGSVL__BRIDGE_VELOCITY_TOLERANCE_MPS",
+                                                       state_tracker.DEFAULT_VELOCITY_TOLERANCE_MPS)),
+            "refresh_interval": float(os.environ.get("LGSVL__BRIDGE_STATE_REFRESH_SEC",
+                                                     state_tracker.DEFAULT_REFRESH_INTERVAL_SEC)),
+        }
+        if signal_map_file is None:
+            signal_map_file = os.environ.get("LGSVL__BRIDGE_SIGNAL_MAP_FILE")
+        self.signal_map_file = signal_map_file
+        self.frame_deadline_factor = float(os.environ.get("LGSVL__BRIDGE_FRAME_DEADLINE_FACTOR",
+                                                          frame_watchdog.DEFAULT_DEADLINE_FACTOR))
+        self.frame_min_deadline = float(os.environ.get("LGSVL__BRIDGE_FRAME_MIN_DEADLINE_SEC",
+                                                       frame_watchdog.DEFAULT_MIN_DEADLINE_SEC))
+        if fail_stalled_frames is None:
+            fail_stalled_frames = get_envar_flag("LGSVL__BRIDGE_FAIL_STALLED_FRAMES")
+        self.fail_stalled_frames = fail_stalled_frames
+        self.simulator_host = simulator_host
+        self.simulator_port = simulator_port
+        self.scene = scene
+        # Set once the bridge is created in run()
+        self.server = None
+
+    def stop(self, timeout=STOP_TIMEOUT_SEC):
+        """
+        Stops a started up bridge and waits for the thread to end, which makes
+        the final metrics write and closes the traffic recording
+        """
+        if self.server is None or not self.startup_completed.is_set() or self.startup_error is not None:
+            return
+        self.server.stop()
+        self.join(timeout)
+        if self.is_alive():
+            log.error(f"The bridge has not shut down in {timeout} seconds")
+
+    def set_scene(self, scene):
+        """Sets the scene the next initialize request loads (or resets, if it is the loaded one)"""
+        self.scene = scene
+        if self.server:
+            self.server.scene = scene
 
     def run(self):
-        server = Tier4LgSvlBridge()
         log.info("Server startup ...")
-        server.start()
+        try:
+            server = self.start_server()
+        except (Exception, SystemExit) as e:
+            # The bridge exits on a missing simulator or environment variable
+            self.startup_error = e
+            log.error(f"Failed to start the bridge up: {e!r}")
+            self.startup_completed.set()
+            return
         log.info("Server startup completed")
         self.startup_completed.set()
         log.info("Start polling ...")
         server.poll()
 
+    def start_server(self):
+        timeline = self.startup_timeline or StartupTimeline()
+        server = Tier4LgSvlBridge(use_asyncio=self.use_asyncio,
+                                  pipelined_frames=self.pipelined_frames,
+                                  metrics_dir=self.metrics_dir,
+                                  metrics_interval=self.metrics_interval,
+                                  record_file=self.record_file,
+                                  agent_pool_size=self.agent_pool_size,
+                                  sensor_pub_address=self.sensor_pub_address,
+                                  lidar_dir=self.lidar_dir,
+                                  detection_range_m=self.detection_range_m,
+                                  detection_fov_deg=self.detection_fov_deg,
+                                  port_base=self.port_base,
+                                  simulator_host=self.simulator_host,
+                                  simulator_port=self.simulator_port,
+                                  skip_unchanged_states=self.skip_unchanged_states,
+                                  state_tolerances=self.state_tolerances,
+                                  signal_map_file=self.signal_map_file,
+                                  frame_deadline_factor=self.frame_deadline_factor,
+                                  frame_min_deadline=self.frame_min_deadline,
+                                  fail_stalled_frames=self.fail_stalled_frames,
+                                  startup_timeline=timeline,
+                                  scene=self.scene,
+                                  api_address=self.api_address)
+        self.server = server
+        server.start()
+        if not self.startup_timeline:
+            log.info(timeline.summary())
+        return server
+
 
 if __name__ == "__main__":
     bridge_started_up = threading.Event()
@@ -0,0 +1,132 @@
+#
+# Copyright (c) 2021 LG Electronics, Inc.
+#
+# This software contains code licensed as described in LICENSE.
+#
+
+"""
+The TierIV traffic light states applied to the SVL Simulator signals. The
+lanelet traffic light ids of the TierIV scenarios are mapped to the signal
+controllable uids of a scene by a JSON file:
+
+    {"BorregasAve": {"34806": ["c47d0a35-...", "9e2d4b6c-..."], ...}, ...}
+
+which is resolved into the lgsvl.Controllable objects once per scene load.
+"""
+
+import json
+import logging
+
+
+log = logging.getLogger(__name__)
+
+# simulation_api_schema.TrafficLightState.LampState.State values of the lamp
+# colors; the arrow lamps have no SVL Simulator signal counterpart
+LAMP_COLORS = {
+    1: "red",
+    2: "green",
+    3: "yellow",
+}
+
+# The signal state of a traffic light with no lit color lamp
+DARK_SIGNAL_STATE = "black"
+
+
+def load_signal_map(filename):
+    """The JSON signal map file -> {scene: {lanelet traffic light id: [controllable uid, ...]}}"""
+    with open(filename) as f:
+        scenes = json.load(f)
+    signal_map = {}
+    for scene, traffic_lights in scenes.items():
+        signal_map[scene] = {
+            int(traffic_light_id): [uids] if isinstance(uids, str) else list(uids)
+            for traffic_light_id, uids in traffic_lights.items()}
+    return signal_map
+
+
+def signal_control_policy(traffic_light_state):
+    """
+    The SVL Simulator control policy holding the signal in the color of the
+    most confident lit color lamp of a TierIV TrafficLightState
+    """
+    color_lamps = [lamp for lamp in traffic_light_state.lamp_states if lamp.type in LAMP_COLORS]
+    if not color_lamps:
+        color = DARK_SIGNAL_STATE
+    else:
+        color = LAMP_COLORS[max(color_lamps, key=lambda lamp: lamp.confidence).type]
+    # A policy with no "loop" keeps the signal in its last state
+    return f"{color}=0"
+
+
+def resolve_signals(traffic_lights, controllables):
+    """
+    {lanelet traffic light id: [controllable uid, ...]} and the scene
+    controllables by uid -> {lanelet traffic light id: [lgsvl.Controllable, ...]}
+    """
+    signals = {}
+    for traffic_light_id, uids in traffic_lights.items():
+        missing = [uid for uid in uids if uid not in controllables]
+        if missing:
+            log.warning(f"The traffic light {traffic_light_id} signal(s) {missing} are not in the scene")
+        signals[traffic_light_id] = [controllables[uid] for uid in uids if uid in controllables]
+    return signals
+
+
+class TrafficLightController():
+    """
+    Turns TierIV traffic light states into the control calls of the signals
+    whose state changed since the last update. The policies applied are
+    remembered per controllable until reset(), which is to be called on every
+    scene (re)load as the simulator restores the signals' default policies.
+    The controls made and the lanelet ids with no signal are counted in
+    'metrics' (a BridgeMetrics) as traffic_light_controls and
+    traffic_lights_unmapped.
+    """
+    def __init__(self, metrics=None):
+        self.metrics = metrics
+        self.signals = {}
+        # Controllable uid -> the control policy last applied
+        self.applied = {}
+        # The unmapped lanelet ids are logged once per scene load
+        self.logged_unmapped = set()
+
+    def reset(self, signals):
+        """'signals' is the resolve_signals() lookup of the loaded scene"""
+        self.signals = signals
+        self.applied.clear()
+        self.logged_unmapped.clear()
+
+    def changed_controls(self, traffic_light_states):
+        """
+        Returns the [(lgsvl.Controllable, control policy)] of the signals to
+        update, and the lanelet ids of 'traffic_light_states' with no signal
+        """
+        controls = {}
+        unmapped = []
+        for traffic_light_state in traffic_light_states:
+            signals = self.signals.get(traffic_light_state.id)
+            if not signals:
+                unmapped.append(traffic_light_state.id)
+                if traffic_light_state.id not in self.logged_unmapped:
+                    self.logged_unmapped.add(traffic_light_state.id)
+                    log.warning(f"No signal for the traffic light {traffic_light_state.id}, see "
+                                "LGSVL__BRIDGE_SIGNAL_MAP_FILE")
+                continue
+            policy = signal_control_policy(traffic_light_state)
+            for signal in signals:
+                # A later state of a signal shared by several traffic lights wins
+                controls[signal.uid] = (signal, policy)
+        changed = [(signal, policy) for uid, (signal, policy) in controls.items()
+                   if self.applied.get(uid) != policy]
+        for signal, policy in changed:
+            self.applied[signal.uid] = policy
+        if self.metrics:
+            self.metrics.count("traffic_light_controls", len(changed))
+            if unmapped:
+                self.metrics.count("traffic_lights_unmapped", len(unmapped))
+        return changed, unmapped
+
+    @staticmethod
+    def apply(controls):
+        for signal, policy in controls:
+            signal.control(policy)
@@ -0,0 +1,88 @@
+#
+# Copyright (c) 2021 LG Electronics, Inc.
+#
+# This software contains code licensed as described in LICENSE.
+#
+
+"""
+Append-only binary log of the TierIV bridge ZMQ traffic.
+
+The file starts with the FILE_MAGIC header followed by records of:
+
+    port (uint16), timestamp (float64, seconds since the epoch),
+    request length (uint32), response length (uint32),
+    request bytes, response bytes
+
+all little-endian.
+"""
+
+import atexit
+import logging
+import struct
+import threading
+import time
+from collections import namedtuple
+
+
+log = logging.getLogger(__name__)
+
+FILE_MAGIC = b"T4BRREC1"
+
+RECORD_HEADER = struct.Struct("<HdII")
+
+FLUSH_INTERVAL_SEC = 1
+
+TrafficRecord = namedtuple("TrafficRecord", ["port", "timestamp", "request", "response"])
+
+
+class TrafficRecorder():
+    def __init__(self, filename):
+        self.filename = filename
+        self.file = open(filename, "ab")
+        if self.file.tell() == 0:
+            self.file.write(FILE_MAGIC)
+        self.records = 0
+        self.last_flush_time = time.monotonic()
+        # The bridge closes the recording on its shutdown; a process exiting
+        # without shutting the bridge down still gets the buffered tail written
+        self.lock = threading.Lock()
+        atexit.register(self.close)
+        log.info(f"Recording the bridge traffic to '{filename}'")
+
+    def record(self, port, timestamp, request, response):
+        with self.lock:
+            if self.file.closed:
+                return
+            self.file.write(RECORD_HEADER.pack(port, timestamp, len(request), len(response)))
+            self.file.write(request)
+            self.file.write(response)
+            self.records += 1
+            # The bridge runs in a daemon thread, keep the loss on its abrupt exit small
+            if time.monotonic() - self.last_flush_time >= FLUSH_INTERVAL_SEC:
+                self.file.flush()
+                self.last_flush_time = time.monotonic()
+
+    def close(self):
+        atexit.unregister(self.close)
+        with self.lock:
+            if self.file.closed:
+                return
+            self.file.close()
+        log.info(f"Recorded {self.records} requests to '{self.filename}'")
+
+
+def read_records(filename):
+    with open(filename, "rb") as f:
+        if f.read(len(FILE_MAGIC)) != FILE_MAGIC:
+            raise ValueError(f"'{filename}' is not a bridge traffic recording")
+        while True:
+            header = f.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                # A recording interrupted in the middle of a record is still usable
+                return
+            port, timestamp, request_length, response_length = RECORD_HEADER.unpack(header)
+            request = f.read(request_length)
+            response = f.read(response_length)
+            if len(response) < response_length:
+                return
+            yield TrafficRecord(port, timestamp, request, response)
@@ -0,0 +1,169 @@
+#
+# Copyright (c) 2021 LG Electronics, Inc.
+#
+# This software contains code licensed as described in LICENSE.
+#
+
+"""
+Batch (NumPy) conversion of the TierIV "world" entity states to the Unity
+coordinates used by the LG SVL Simulator, and back.
+
+The functions here mirror the scalar Tier4LgSvlBridge.to_unity_*() methods and
+euler_degree_from_quaternion(), which stay the reference implementation; the
+batch path converts all the entities of an UpdateEntityStatusRequest in one
+pass instead of calling the scalar functions for each entity.
+"""
+
+from collections import namedtuple
+
+import numpy as np
+
+
+UnityStates = namedtuple("UnityStates",
+                         ["positions", "rotations", "velocities", "angular_velocities"])
+
+WorldStates = namedtuple("WorldStates",
+                         ["positions", "orientations", "linear_velocities", "angular_velocities"])
+
+
+def entity_status_arrays(statuses):
+    """
+    Loads the poses and twists of the openscenario_msgs.EntityStatus messages
+    into arrays: positions (N, 3), quaternions (N, 4) in the (x, y, z, w)
+    order, linear (N, 3) and angular (N, 3) velocities.
+    """
+    rows = []
+    for status in statuses:
+        position = status.pose.position
+        orientation = status.pose.orientation
+        linear = status.action_status.twist.linear
+        angular = status.action_status.twist.angular
+        rows.append((position.x, position.y, position.z,
+                     orientation.x, orientation.y, orientation.z, orientation.w,
+                     linear.x, linear.y, linear.z,
+                     angular.x, angular.y, angular.z))
+    data = np.array(rows, dtype=np.float64).reshape(-1, 13)
+    return data[:, 0:3], data[:, 3:7], data[:, 7:10], data[:, 10:13]
+
+
+def agent_state_arrays(agent_states):
+    """
+    Loads the lgsvl.AgentState objects into arrays: positions (N, 3),
+    rotations (N, 3), velocities (N, 3) and angular velocities (N, 3)
+    """
+    rows = []
+    for agent_state in agent_states:
+        position = agent_state.transform.position
+        rotation = agent_state.transform.rotation
+        velocity = agent_state.velocity
+        angular_velocity = agent_state.angular_velocity
+        rows.append((position.x, position.y, position.z,
+                     rotation.x, rotation.y, rotation.z,
+                     velocity.x, velocity.y, velocity.z,
+                     angular_velocity.x, angular_velocity.y, angular_velocity.z))
+    data = np.array(rows, dtype=np.float64).reshape(-1, 12)
+    return data[:, 0:3], data[:, 3:6], data[:, 6:9], data[:, 9:12]
+
+
+def euler_degrees_from_quaternions(quaternions):
+    """
+    Converts quaternions (N, 4) in the (x, y, z, w) order into (N, 3) euler
+    angles (roll, pitch, yaw) in degrees, see euler_degree_from_quaternion()
+    """
+    x, y, z, w = quaternions.T
+    roll_x = np.degrees(np.arctan2(2.0 * (w * x + y * z), 1.0 - 2.0 * (x * x + y * y)))
+    pitch_y = np.degrees(np.arcsin(np.clip(2.0 * (w * y - z * x), -1.0, 1.0)))
+    yaw_z = np.degrees(np.arctan2(2.0 * (w * z + x * y), 1.0 - 2.0 * (y * y + z * z)))
+    return np.stack((roll_x, pitch_y, yaw_z), axis=1)
+
+
+def quaternions_from_euler_degrees(euler_angles):
+    """
+    Converts (N, 3) euler angles (roll, pitch, yaw) in degrees into (N, 4)
+    quaternions in the (x, y, z, w) order, the inverse of
+    euler_degrees_from_quaternions()
+    """
+    half_angles = np.radians(euler_angles) / 2.0
+    cr, cp, cy = np.cos(half_angles).T
+    sr, sp, sy = np.sin(half_angles).T
+    return np.stack((sr * cp * cy - cr * sp * sy,
+                     cr * sp * cy + sr * cp * sy,
+                     cr * cp * sy - sr * sp * cy,
+                     cr * cp * cy + sr * sp * sy), axis=1)
+
+
+def to_unity_positions(world_positions, map_origin_northing, map_origin_easting):
+    return np.stack((-(world_positions[:, 1] - map_origin_northing),
+                     world_positions[:, 2],
+                     world_positions[:, 0] - map_origin_easting), axis=1)
+
+
+def to_unity_rotations(world_orientation_quaternions):
+    roll_x, pitch_y, yaw_z = euler_degrees_from_quaternions(world_orientation_quaternions).T
+    return np.stack((pitch_y, -yaw_z, -roll_x), axis=1)
+
+
+def to_unity_linear_velocities(vehicle_linear_velocities, unity_rotations):
+    # Here we rely on a vehicle always having only its X axis velocity (forward-backward)
+    unity_yaw = np.radians(unity_rotations[:, 1])
+    forward = vehicle_linear_velocities[:, 0]
+    return np.stack((forward * np.sin(unity_yaw),
+                     np.zeros_like(forward),
+                     forward * np.cos(unity_yaw)), axis=1)
+
+
+def to_unity_angular_velocities(vehicle_angular_velocities):
+    # only an angular velocity around unity Y axis is converted
+    unity_angular_velocities = np.zeros_like(vehicle_angular_velocities)
+    unity_angular_velocities[:, 1] = vehicle_angular_velocities[:, 2]
+    return unity_angular_velocities
+
+
+def to_unity_states(world_positions,
+                    world_orientation_quaternions,
+                    vehicle_linear_velocities,
+                    vehicle_angular_velocities,
+                    map_origin_northing,
+                    map_origin_easting):
+    unity_rotations = to_unity_rotations(world_orientation_quaternions)
+    return UnityStates(
+        to_unity_positions(world_positions, map_origin_northing, map_origin_easting),
+        unity_rotations,
+        to_unity_linear_velocities(vehicle_linear_velocities, unity_rotations),
+        to_unity_angular_velocities(vehicle_angular_velocities))
+
+
+def entity_statuses_to_unity(statuses, map_origin_northing, map_origin_easting):
+    return to_unity_states(*entity_status_arrays(statuses),
+                           map_origin_northing, map_origin_easting)
+
+
+def to_world_states(unity_positions,
+                    unity_rotations,
+                    unity_velocities,
+                    unity_angular_velocities,
+                    map_origin_northing,
+                    map_origin_easting):
+    """
+    The inverse of to_unity_states(). As the forward conversion keeps only the
+    forward (X axis) vehicle velocity and the yaw rate, so does this one.
+    """
+    world_positions = np.stack((unity_positions[:, 2] + map_origin_easting,
+                                map_origin_northing - unity_positions[:, 0],
+                                unity_positions[:, 1]), axis=1)
+    world_orientations = quaternions_from_euler_degrees(
+        np.stack((-unity_rotations[:, 2], unity_rotations[:, 0], -unity_rotations[:, 1]), axis=1))
+
+    unity_yaw = np.radians(unity_rotations[:, 1])
+    vehicle_linear_velocities = np.zeros_like(unity_velocities)
+    vehicle_linear_velocities[:, 0] = unity_velocities[:, 0] * np.sin(unity_yaw) \
+        + unity_velocities[:, 2] * np.cos(unity_yaw)
+    vehicle_angular_velocities = np.zeros_like(unity_angular_velocities)
+    vehicle_angular_velocities[:, 2] = unity_angular_velocities[:, 1]
+    return WorldStates(world_positions, world_orientations,
+                       vehicle_linear_velocities, vehicle_angular_velocities)
+
+
+def agent_states_to_world(agent_states, map_origin_northing, map_origin_easting):
+    return to_world_states(*agent_state_arrays(agent_states),
+                           map_origin_northing, map_origin_easting)
@@ -98,6 +98,7 @@ setup(
         'console_scripts': [
             'run_scenario = scenario_runner:main',
             'run = scenario_runner:main',
+            'replay_bridge_traffic = scenario_runner.replay_traffic:main',
         ],
     },
     install_requires=["lgsvl", ],
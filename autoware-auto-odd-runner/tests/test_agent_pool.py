@@ -0,0 +1,88 @@
+import pytest
+
+# The agent pool needs the PythonAPI
+lgsvl = pytest.importorskip("lgsvl")
+agent_pool = pytest.importorskip("scenario_runner.agent_pool")
+bridge_metrics = pytest.importorskip("scenario_runner.bridge_metrics")
+
+
+class RecordingAgent:
+    def __init__(self, uid, state):
+        self.uid = uid
+        self.state = state
+
+
+class RecordingSimulator:
+    def __init__(self):
+        self.agents = {}
+        self.added = 0
+        self.removed = 0
+
+    def add_agent(self, name, agent_type, state=None, color=None):
+        self.added += 1
+        agent = RecordingAgent(f"{name}-{self.added}", state)
+        self.agents[agent.uid] = agent
+        return agent
+
+    def remove_agent(self, agent):
+        self.removed += 1
+        del self.agents[agent.uid]
+
+
+def spawn_state(x):
+    state = lgsvl.AgentState()
+    state.transform.position = lgsvl.Vector(x, 0, 0)
+    return state
+
+
+class TestAgentPool:
+    def test_acquire_and_release_reuse_parked_agents(self):
+        sim = RecordingSimulator()
+        metrics = bridge_metrics.BridgeMetrics({})
+        pool = agent_pool.AgentPool(size=2, metrics=metrics)
+        pool.warm(sim, {lgsvl.AgentType.NPC: ["Sedan", "SUV"]})
+        assert sim.added == 4
+
+        first = pool.acquire(sim, "Sedan", lgsvl.AgentType.NPC, spawn_state(1))
+        second = pool.acquire(sim, "Sedan", lgsvl.AgentType.NPC, spawn_state(2))
+        third = pool.acquire(sim, "Sedan", lgsvl.AgentType.NPC, spawn_state(3))
+        assert sim.added == 5
+        assert first.state.transform.position.x == 1
+        assert metrics.counters == {"agent_pool_hits": 2, "agent_pool_misses": 1}
+
+        for agent in (first, second, third):
+            pool.release(sim, agent)
+        # Only 'size' agents are kept parked, the rest are removed
+        assert sim.removed == 1
+        assert first.state.transform.position.y == agent_pool.PARKING_POSITION.y
+        assert pool.acquire(sim, "Sedan", lgsvl.AgentType.NPC, spawn_state(4)) in (first, second, third)
+
+    def test_disabled_pool_adds_and_removes_agents(self):
+        sim = RecordingSimulator()
+        pool = agent_pool.AgentPool(size=0)
+        pool.warm(sim, {lgsvl.AgentType.NPC: ["Sedan"]})
+        agent = pool.acquire(sim, "Sedan", lgsvl.AgentType.NPC, spawn_state(1))
+        pool.release(sim, agent)
+        assert (sim.added, sim.removed) == (1, 1)
+
+    def test_parked_agents_are_pinned_at_rest(self):
+        sim = RecordingSimulator()
+        pool = agent_pool.AgentPool(size=2)
+        pool.warm(sim, {lgsvl.AgentType.NPC: ["Sedan"]})
+        first, second = sim.agents.values()
+        assert first.state.velocity.y == 0
+        # Falling under the scene
+        for agent in (first, second):
+            agent.state.transform.position.y -= 500
+            agent.state.velocity.y = -100
+
+        assert pool.pin_parked(0.0) == 2
+        assert first.state.transform.position.y == agent_pool.PARKING_POSITION.y
+        assert first.state.velocity.y == 0
+        assert pool.pin_parked(agent_pool.PARKING_PIN_INTERVAL_SEC / 2) == 0
+        assert pool.pin_parked(agent_pool.PARKING_PIN_INTERVAL_SEC) == 2
+
+        second.state.velocity.y = -100
+        acquired = pool.acquire(sim, "Sedan", lgsvl.AgentType.NPC, spawn_state(1))
+        assert acquired.state.velocity.y == 0
+        assert pool.pin_parked(2 * agent_pool.PARKING_PIN_INTERVAL_SEC) == 1
@@ -0,0 +1,39 @@
+import pytest
+
+# The bridge needs the PythonAPI
+pytest.importorskip("lgsvl")
+zmq = pytest.importorskip("zmq")
+tier4_lgsvl_bridge = pytest.importorskip("scenario_runner.tier4_lgsvl_bridge")
+
+
+class TestApiTransport:
+    def test_api_endpoint(self):
+        assert tier4_lgsvl_bridge.api_endpoint("tcp://*:{port}", 5556) == "tcp://*:5556"
+        assert tier4_lgsvl_bridge.api_endpoint("ipc:///tmp/bridge-{port}.ipc", 5656) == "ipc:///tmp/bridge-5656.ipc"
+        with pytest.raises(ValueError, match="no '{port}'"):
+            tier4_lgsvl_bridge.Tier4LgSvlBridge(api_address="ipc:///tmp/bridge")
+
+    @pytest.mark.parametrize("transport", ["inproc", "ipc"])
+    def test_binds_the_api_address(self, tmp_path, transport):
+        if transport == "ipc":
+            api_address = f"ipc://{tmp_path}/bridge-{{port}}"
+        else:
+            api_address = "inproc://test-bridge-{port}"
+        bridge = tier4_lgsvl_bridge.Tier4LgSvlBridge(api_address=api_address, port_base=6555)
+        bridge.initialize_api_sockets()
+        try:
+            api_socket = bridge.api_sockets[5561]
+            assert api_socket.getsockopt(zmq.LINGER) == 0
+            assert api_socket.getsockopt(zmq.TOS) == tier4_lgsvl_bridge.IPTOS_LOWDELAY
+
+            client = zmq.Context.instance().socket(zmq.REQ)
+            client.connect(tier4_lgsvl_bridge.api_endpoint(api_address, 6561))
+            client.send(b"request")
+            assert api_socket.poll(5000)
+            assert api_socket.recv() == b"request"
+            api_socket.send(b"response")
+            assert client.recv() == b"response"
+            client.close(linger=0)
+        finally:
+            for api_socket in bridge.api_sockets.values():
+                api_socket.close()
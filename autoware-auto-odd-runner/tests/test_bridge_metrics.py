@@ -0,0 +1,46 @@
+import json
+import random
+
+import pytest
+
+bridge_metrics = pytest.importorskip("scenario_runner.bridge_metrics")
+
+
+class TestLatencyHistogram:
+    def test_bucket_value_round_trip(self):
+        histogram = bridge_metrics.LatencyHistogram(sub_bucket_bits=8)
+        for value_us in [0, 1, 255, 256, 257, 1000, 123456, 10 ** 8]:
+            index = histogram.bucket_index(value_us)
+            assert abs(histogram.bucket_value(index) - value_us) <= value_us / 128 + 1
+
+    def test_percentiles(self):
+        rng = random.Random(0)
+        values = [rng.uniform(0.0001, 0.5) for _ in range(10000)]
+        histogram = bridge_metrics.LatencyHistogram()
+        for value in values:
+            histogram.record(value)
+        values.sort()
+        for percent in bridge_metrics.REPORTED_PERCENTILES:
+            exact = values[int(len(values) * percent / 100) - 1]
+            assert histogram.percentile(percent) == pytest.approx(exact, rel=0.01)
+        assert histogram.count == len(values)
+        assert histogram.max == values[-1]
+
+
+class TestBridgeMetrics:
+    def test_write(self, tmp_path):
+        metrics = bridge_metrics.BridgeMetrics({5556: "update_frame"}, str(tmp_path))
+        metrics.record(5556, "handle", 0.02)
+        metrics.record_frame_step(0.02)
+        metrics.count("agent_pool_hits")
+        metrics.record_sensor_lag("lidar/ego", 0.05)
+
+        metrics.write()
+
+        summary = json.loads((tmp_path / bridge_metrics.METRICS_JSON_FILENAME).read_text())
+        assert summary["requests"]["5556"]["phases"]["handle"]["count"] == 1
+        prometheus = (tmp_path / bridge_metrics.METRICS_PROMETHEUS_FILENAME).read_text()
+        assert 'tier4_bridge_request_phase_seconds_count{port="5556",api="update_frame",phase="handle"} 1' \
+            in prometheus
+        assert "tier4_bridge_agent_pool_hits_total 1" in prometheus
+        assert 'tier4_bridge_sensor_lag_seconds_count{sensor="lidar/ego"} 1' in prometheus
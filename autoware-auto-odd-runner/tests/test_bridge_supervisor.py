@@ -0,0 +1,26 @@
+import pytest
+
+# The supervisor imports the bridge, which needs the PythonAPI
+pytest.importorskip("lgsvl")
+bridge_supervisor = pytest.importorskip("scenario_runner.bridge_supervisor")
+
+
+class TestTier4BridgeSupervisor:
+    def test_port_blocks(self, tmp_path):
+        supervisor = bridge_supervisor.Tier4BridgeSupervisor(
+            [("127.0.0.1", 8181), ("127.0.0.1", 8182)], port_base=6000, port_stride=50,
+            lidar_dir=str(tmp_path))
+        threads = [instance.thread for instance in supervisor.instances]
+        assert [thread.port_base for thread in threads] == [6000, 6050]
+        assert [thread.sensor_pub_address for thread in threads] == ["tcp://*:6015", "tcp://*:6065"]
+        assert [thread.simulator_port for thread in threads] == [8181, 8182]
+        assert threads[1].lidar_dir == str(tmp_path / "instance-1")
+
+    def test_overlapping_port_blocks(self):
+        with pytest.raises(ValueError):
+            bridge_supervisor.Tier4BridgeSupervisor([("127.0.0.1", 8181)], port_stride=10)
+
+    def test_parse_endpoint(self):
+        assert bridge_supervisor.parse_endpoint("10.0.0.2:8182") == ("10.0.0.2", 8182)
+        with pytest.raises(ValueError):
+            bridge_supervisor.parse_endpoint("8182")
@@ -0,0 +1,122 @@
+import functools
+import hashlib
+import http.server
+import os
+import threading
+
+import pytest
+
+download_cache = pytest.importorskip("scenario_runner.download_cache")
+
+
+class CountingHandler(http.server.SimpleHTTPRequestHandler):
+    requests = []
+
+    def do_GET(self):
+        self.requests.append(("GET", self.path))
+        super().do_GET()
+
+    def do_HEAD(self):
+        self.requests.append(("HEAD", self.path))
+        super().do_HEAD()
+
+    def log_message(self, *args):
+        pass
+
+
+class NoValidatorsHandler(CountingHandler):
+    """A server telling neither the ETag nor the Last-Modified time of the files"""
+    def send_header(self, keyword, value):
+        if keyword not in ("ETag", "Last-Modified"):
+            super().send_header(keyword, value)
+
+
+@pytest.fixture(params=[CountingHandler])
+def server(tmp_path, request):
+    served_dir = tmp_path / "served"
+    served_dir.mkdir()
+    CountingHandler.requests = []
+    httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0),
+                                            functools.partial(request.param, directory=str(served_dir)))
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    httpd.served_dir = served_dir
+    httpd.url = f"http://127.0.0.1:{httpd.server_address[1]}"
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def make_cache(tmp_path, **kwargs):
+    output_dir = tmp_path / "output"
+    output_dir.mkdir(exist_ok=True)
+    return download_cache.DownloadCache(str(tmp_path / "cache"), tries=1, **kwargs), str(output_dir)
+
+
+class TestDownloadCache:
+    def test_local_files(self, tmp_path):
+        cache, output_dir = make_cache(tmp_path)
+        (tmp_path / "map.osm").write_text("<osm/>")
+        assert cache.fetch(str(tmp_path / "map.osm"), output_dir) == str(tmp_path / "map.osm")
+        assert cache.fetch(f"file://{tmp_path}/map.osm", output_dir) == str(tmp_path / "map.osm")
+        with pytest.raises(FileNotFoundError):
+            cache.fetch(str(tmp_path / "missing.osm"), output_dir)
+
+    def test_revalidates_the_cached_files(self, tmp_path, server):
+        cache, output_dir = make_cache(tmp_path)
+        served = server.served_dir / "map.osm"
+        served.write_text("<osm/>")
+        os.utime(served, (1000000, 1000000))
+
+        path = cache.fetch(f"{server.url}/map.osm", output_dir)
+        assert path == os.path.join(output_dir, "map.osm")
+        assert open(path).read() == "<osm/>"
+        assert cache.fetch(f"{server.url}/map.osm", output_dir) == path
+        assert CountingHandler.requests == [("GET", "/map.osm"), ("HEAD", "/map.osm")]
+
+        served.write_text("<osm version='2'/>")
+        assert open(cache.fetch(f"{server.url}/map.osm", output_dir)).read() == "<osm version='2'/>"
+        assert CountingHandler.requests[2:] == [("HEAD", "/map.osm"), ("GET", "/map.osm")]
+
+        # Offline
+        server.shutdown()
+        server.server_close()
+        assert open(cache.fetch(f"{server.url}/map.osm", output_dir)).read() == "<osm version='2'/>"
+
+    @pytest.mark.parametrize("server", [NoValidatorsHandler], indirect=True)
+    def test_revalidates_by_size_without_validators(self, tmp_path, server):
+        cache, output_dir = make_cache(tmp_path)
+        served = server.served_dir / "map.osm"
+        served.write_text("<osm/>")
+
+        path = cache.fetch(f"{server.url}/map.osm", output_dir)
+        assert cache.fetch(f"{server.url}/map.osm", output_dir) == path
+        assert CountingHandler.requests == [("GET", "/map.osm"), ("HEAD", "/map.osm")]
+
+        served.write_text("<osm version='2'/>")
+        assert open(cache.fetch(f"{server.url}/map.osm", output_dir)).read() == "<osm version='2'/>"
+        assert CountingHandler.requests[2:] == [("HEAD", "/map.osm"), ("GET", "/map.osm")]
+
+    def test_expected_hash(self, tmp_path, server):
+        cache, output_dir = make_cache(tmp_path)
+        (server.served_dir / "scenario.yaml").write_text("scenario")
+        sha256 = hashlib.sha256(b"scenario").hexdigest()
+
+        with pytest.raises(RuntimeError, match="not 00"):
+            cache.fetch(f"{server.url}/scenario.yaml#sha256={'0' * 64}", output_dir)
+        cache.fetch(f"{server.url}/scenario.yaml#sha256={sha256}", output_dir)
+        CountingHandler.requests.clear()
+        path = cache.fetch(f"{server.url}/scenario.yaml#sha256={sha256}", output_dir)
+        assert open(path).read() == "scenario"
+        assert CountingHandler.requests == []
+
+    def test_evicts_the_least_recently_used_files(self, tmp_path, server):
+        cache, output_dir = make_cache(tmp_path, max_size=25)
+        for name in ["a", "b", "c"]:
+            (server.served_dir / name).write_text(name * 10)
+        cache.fetch(f"{server.url}/a", output_dir)
+        cache.fetch(f"{server.url}/b", output_dir)
+        cache.fetch(f"{server.url}/a", output_dir)
+        cache.fetch(f"{server.url}/c", output_dir)
+        objects = os.listdir(cache.objects_dir)
+        assert sorted(objects) == sorted(hashlib.sha256(name.encode() * 10).hexdigest() for name in ["a", "c"])
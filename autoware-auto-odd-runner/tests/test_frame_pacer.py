@@ -0,0 +1,61 @@
+import pytest
+
+frame_pacer = pytest.importorskip("scenario_runner.frame_pacer")
+bridge_metrics = pytest.importorskip("scenario_runner.bridge_metrics")
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(round(seconds, 6))
+        self.now += seconds
+
+
+class TestFramePacer:
+    def test_paces_to_the_realtime_factor(self):
+        clock = FakeClock()
+        metrics = bridge_metrics.BridgeMetrics({})
+        pacer = frame_pacer.FramePacer(metrics, clock=clock, sleep=clock.sleep)
+        pacer.reset(2.0)
+
+        # The frames step 0.1 s of simulation time, due every 0.05 s
+        for frame, frame_duration in enumerate([0.02, 0.02, 0.08, 0.01]):
+            pacer.pace(frame * 0.1)
+            clock.now += frame_duration
+        pacer.pace(0.4)
+
+        # The slow third frame makes the fourth one late, and the fifth one
+        # sleeps less to get back on the schedule
+        assert clock.slept == [0.03, 0.03, 0.01]
+        assert pacer.late_frames == 1
+        assert pacer.achieved_realtime_factor == pytest.approx(2.0)
+        assert metrics.gauges["target_realtime_factor"] == 2.0
+
+    def test_restarts_the_schedule_when_far_behind(self):
+        clock = FakeClock()
+        metrics = bridge_metrics.BridgeMetrics({})
+        pacer = frame_pacer.FramePacer(metrics, max_catch_up=0.5, clock=clock, sleep=clock.sleep)
+        pacer.reset(1.0)
+        pacer.pace(0.0)
+        clock.now += 2.0
+        assert pacer.pace(0.1) == pytest.approx(-1.9)
+        clock.now += 0.01
+        pacer.pace(0.2)
+        assert clock.slept == [0.09]
+        assert metrics.counters == {"pacing_resyncs": 1}
+
+    def test_no_pacing(self):
+        clock = FakeClock()
+        pacer = frame_pacer.FramePacer(clock=clock, sleep=clock.sleep)
+        pacer.reset(0.0)
+        for frame in range(3):
+            assert pacer.pace(frame * 0.1) == 0.0
+            clock.now += 0.01
+        assert clock.slept == []
+        assert pacer.achieved_realtime_factor == pytest.approx(0.2 / 0.02)
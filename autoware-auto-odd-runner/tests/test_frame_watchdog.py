@@ -0,0 +1,52 @@
+import time
+
+import pytest
+
+frame_watchdog = pytest.importorskip("scenario_runner.frame_watchdog")
+bridge_metrics = pytest.importorskip("scenario_runner.bridge_metrics")
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+class TestFrameWatchdog:
+    def test_deadline(self):
+        watchdog = frame_watchdog.FrameWatchdog(deadline_factor=20.0, min_deadline=5.0)
+        watchdog.configure(0.05, 0.0)
+        assert watchdog.deadline_sec == 5.0
+        watchdog.configure(0.5, 0.5)
+        assert watchdog.deadline_sec == 20.0
+
+    def test_reports_a_stalled_frame(self, tmp_path):
+        metrics = bridge_metrics.BridgeMetrics({5556: "update_frame"})
+        watchdog = frame_watchdog.FrameWatchdog(metrics, min_deadline=0.05, fail_stalled=True,
+                                                report_dir=str(tmp_path), api_names={5556: "update_frame"})
+        watchdog.configure(0.001, 0.0)
+        watchdog.start()
+        try:
+            watchdog.record_request(5556, 0.002)
+            watchdog.frame_started(1.5)
+            assert watchdog.stall_description() is None
+            wait_until(lambda: watchdog.deadline_misses == 1)
+            assert watchdog.wait_timeout() == 0.0
+            assert "frame step at 1.500 s stalled" in watchdog.stall_description()
+            assert metrics.counters["frame_deadline_misses"] == 1
+            assert metrics.gauges["stalled_frame"] == 1
+            report = (tmp_path / frame_watchdog.STALL_REPORT_FILENAME).read_text()
+            assert "update_frame: 2.000 ms" in report
+            assert "MainThread" in report
+
+            assert "over its 0.1 s deadline" in watchdog.frame_finished()
+            assert metrics.gauges["stalled_frame"] == 0
+            # A frame finished in time
+            watchdog.frame_started(1.6)
+            assert watchdog.frame_finished() is None
+        finally:
+            watchdog.stop()
+            watchdog.join(5.0)
+        assert not watchdog.is_alive()
+        assert watchdog.deadline_misses == 1
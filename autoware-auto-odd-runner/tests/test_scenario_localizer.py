@@ -0,0 +1,116 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+yaml = pytest.importorskip("yaml")
+scenario_localizer = pytest.importorskip("scenario_runner.scenario_localizer")
+
+RUNNER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+YAML_SCENARIO = """\
+ScenarioModifiers:
+  ScenarioModifier: []
+OpenSCENARIO:
+  FileHeader: {revMajor: 1, revMinor: 0, description: 'true ego', author: 'Tier IV'}
+  RoadNetwork:
+    LogicFile:
+      filepath: lanelet2_map.osm
+  Entities:
+    ScenarioObject:
+      - name: ego
+        ObjectController:
+          Controller:
+            name: ''
+            Properties:
+              Property:
+                - name: isEgo
+                  value: 'true'
+      - name: npc
+        ObjectController:
+          Controller:
+            name: ''
+            Properties:
+              Property:
+                - name: maxSpeed
+                  value: 'true'
+"""
+
+XOSC_SCENARIO = """\
+<?xml version="1.0" encoding="UTF-8"?>
+<OpenSCENARIO>
+  <RoadNetwork>
+    <LogicFile filepath="lanelet2_map.osm"/>
+  </RoadNetwork>
+  <Entities>
+    <ScenarioObject name="ego">
+      <ObjectController>
+        <Controller name="">
+          <Properties>
+            <Property name="isEgo" value="true"/>
+          </Properties>
+        </Controller>
+      </ObjectController>
+    </ScenarioObject>
+  </Entities>
+</OpenSCENARIO>
+"""
+
+
+def properties(scenario, entity):
+    for scenario_object in scenario["OpenSCENARIO"]["Entities"]["ScenarioObject"]:
+        if scenario_object["name"] == entity:
+            return scenario_object["ObjectController"]["Controller"]["Properties"]["Property"]
+
+
+class TestScenarioLocalizer:
+    def test_localize_yaml(self):
+        localized = yaml.safe_load(scenario_localizer.localize_yaml(YAML_SCENARIO, "/tmp/map.osm"))
+        assert localized["OpenSCENARIO"]["RoadNetwork"]["LogicFile"]["filepath"] == "/tmp/map.osm"
+        assert properties(localized, "ego") == [{"name": "isEgo", "value": "false"}]
+        assert properties(localized, "npc") == [{"name": "maxSpeed", "value": "true"}]
+        assert localized["OpenSCENARIO"]["FileHeader"]["description"] == "true ego"
+        with pytest.raises(ValueError, match="no RoadNetwork LogicFile"):
+            scenario_localizer.localize_yaml("OpenSCENARIO: {}\n", "/tmp/map.osm")
+
+    def test_localize_xosc(self):
+        localized = scenario_localizer.localize_xosc(XOSC_SCENARIO, "/tmp/map.osm")
+        assert '<LogicFile filepath="/tmp/map.osm" />' in localized
+        assert '<Property name="isEgo" value="false" />' in localized
+
+    def test_caches_the_localized_scenarios(self, tmp_path):
+        (tmp_path / "a.yaml").write_text(YAML_SCENARIO)
+        localizer = scenario_localizer.ScenarioLocalizer(str(tmp_path / "cache"))
+        localized_filename = localizer.localize(str(tmp_path / "a.yaml"), "/tmp/map.osm")
+        assert yaml.safe_load(open(localized_filename))["OpenSCENARIO"]["RoadNetwork"]["LogicFile"] == {
+            "filepath": "/tmp/map.osm"}
+
+        os.utime(localized_filename, (0, 0))
+        assert localizer.localize(str(tmp_path / "a.yaml"), "/tmp/map.osm") == localized_filename
+        assert os.path.getmtime(localized_filename) == 0
+        assert localizer.localize(str(tmp_path / "a.yaml"), "/tmp/other.osm") != localized_filename
+
+    def test_localizes_a_batch(self, tmp_path):
+        (tmp_path / "a.yaml").write_text(YAML_SCENARIO)
+        (tmp_path / "b.xosc").write_text(XOSC_SCENARIO)
+        (tmp_path / "broken.yaml").write_text("OpenSCENARIO: [\n")
+        localizer = scenario_localizer.ScenarioLocalizer(str(tmp_path / "cache"), max_workers=2)
+        a, b, broken, missing = localizer.localize_all([
+            (str(tmp_path / "a.yaml"), "/tmp/map.osm"),
+            (str(tmp_path / "b.xosc"), "/tmp/map.osm"),
+            (str(tmp_path / "broken.yaml"), "/tmp/map.osm"),
+            (str(tmp_path / "missing.yaml"), "/tmp/map.osm")])
+        assert a.result().endswith("-a.yaml")
+        assert "/tmp/map.osm" in open(b.result()).read()
+        with pytest.raises(ValueError, match="Failed to localize the scenario '.*broken.yaml'"):
+            broken.result()
+        with pytest.raises(FileNotFoundError):
+            missing.result()
+
+    def test_worker_processes_do_not_import_the_bridge(self):
+        # The spawned processes import the scenario_runner package to call localize_file()
+        subprocess.run([sys.executable, "-c",
+                        "import sys; import scenario_runner.scenario_localizer; "
+                        "assert 'scenario_runner.tier4_lgsvl_bridge' not in sys.modules"],
+                       cwd=RUNNER_DIR, check=True)
@@ -0,0 +1,61 @@
+import json
+
+import pytest
+
+scenario_suite = pytest.importorskip("scenario_runner.scenario_suite")
+
+
+class TestScenarioSuite:
+    def test_load_manifest(self, tmp_path):
+        (tmp_path / "suite.txt").write_text("# Shalun\n"
+                                            "https://example.com/a.yaml https://example.com/shalun.osm\n"
+                                            "\n"
+                                            "/scenarios/b.yaml file:///maps/kashiwa.osm#sha256=00 kashiwa\n")
+        scenarios = scenario_suite.load_manifest(str(tmp_path / "suite.txt"))
+        assert [(s.index, s.name, s.hd_map_url, s.scene) for s in scenarios] == [
+            (0, "a.yaml", "https://example.com/shalun.osm", None),
+            (1, "b.yaml", "file:///maps/kashiwa.osm#sha256=00", "kashiwa")]
+
+        (tmp_path / "suite.json").write_text(json.dumps([
+            {"scenario": "a.xosc", "map": "shalun.osm", "scene": "shalun", "name": "cut-in"}]))
+        scenario, = scenario_suite.load_manifest(str(tmp_path / "suite.json"))
+        assert (scenario.scenario_url, scenario.scene, scenario.name) == ("a.xosc", "shalun", "cut-in")
+
+        (tmp_path / "invalid.txt").write_text("a.yaml shalun.pcd\n")
+        with pytest.raises(ValueError, match="expected \\*.osm"):
+            scenario_suite.load_manifest(str(tmp_path / "invalid.txt"))
+
+    def test_groups_the_scenarios_by_scene(self):
+        scenarios = [scenario_suite.SuiteScenario(index, f"{index}.yaml", "map.osm", scene)
+                     for index, scene in enumerate(["shalun", "kashiwa", "shalun", None, "kashiwa"])]
+        assert [s.index for s in scenario_suite.group_by_scene(scenarios)] == [0, 2, 1, 4, 3]
+
+    def test_runs_the_scenarios(self, tmp_path):
+        scenarios = [scenario_suite.SuiteScenario(index, f"{name}.yaml", "map.osm")
+                     for index, name in enumerate(["pass", "fail", "broken", "pass-too", "late"])]
+        ran = []
+
+        def prepare(scenario):
+            if scenario.name == "broken.yaml":
+                raise RuntimeError("Failed to download URL 'broken.yaml'")
+            return f"/tmp/localized_{scenario.name}"
+
+        def run(scenario_file):
+            ran.append(scenario_file)
+            return 1 if "fail" in scenario_file else 0
+
+        results_file = tmp_path / "results.json"
+        suite = scenario_suite.ScenarioSuite(prepare, run, lambda: len(ran) < 3, str(results_file))
+        assert not suite.run(scenarios)
+        assert ran == ["/tmp/localized_pass.yaml", "/tmp/localized_fail.yaml", "/tmp/localized_pass-too.yaml"]
+
+        results = json.loads(results_file.read_text())
+        assert (results["passed"], results["failed"], results["error"]) == (2, 1, 2)
+        assert [(r["name"], r["status"]) for r in results["scenarios"]] == [
+            ("pass.yaml", "passed"), ("fail.yaml", "failed"), ("broken.yaml", "error"),
+            ("pass-too.yaml", "passed"), ("late.yaml", "error")]
+        assert results["scenarios"][1]["returncode"] == 1
+        assert "run_sec" in results["scenarios"][0]
+        assert results["scenarios"][2]["error"] == "Failed to download URL 'broken.yaml'"
+        assert results["scenarios"][4]["error"] == "the bridge is not running"
+        assert "2 passed, 1 failed, 2 error" in suite.summary()
@@ -0,0 +1,25 @@
+import pytest
+
+scene_cache = pytest.importorskip("scenario_runner.scene_cache")
+bridge_metrics = pytest.importorskip("scenario_runner.bridge_metrics")
+
+
+class TestSceneCache:
+    def test_values_are_computed_once_per_scene(self):
+        metrics = bridge_metrics.BridgeMetrics({})
+        cache = scene_cache.SceneCache(metrics)
+        computed = []
+
+        def origin(value):
+            def compute():
+                computed.append(value)
+                return value
+            return compute
+
+        assert cache.get("BorregasAve", "map_origin", origin(1)) == 1
+        assert cache.get("BorregasAve", "map_origin", origin(2)) == 1
+        assert cache.get("SanFrancisco", "map_origin", origin(3)) == 3
+        cache.invalidate("BorregasAve")
+        assert cache.get("BorregasAve", "map_origin", origin(4)) == 4
+        assert computed == [1, 3, 4]
+        assert metrics.counters == {"scene_cache_hits": 1, "scene_cache_misses": 3}
@@ -0,0 +1,171 @@
+import json
+
+import numpy as np
+import pytest
+import zmq
+
+sensor_streaming = pytest.importorskip("scenario_runner.sensor_streaming")
+
+POINT_DTYPE = np.dtype([("x", "<f4"), ("y", "<f4"), ("z", "<f4"), ("intensity", "u1")])
+
+
+def write_pcd(path, points, data="binary"):
+    header = ("VERSION 0.7\n"
+              "FIELDS x y z intensity\n"
+              "SIZE 4 4 4 1\n"
+              "TYPE F F F U\n"
+              "COUNT 1 1 1 1\n"
+              f"WIDTH {len(points)}\n"
+              "HEIGHT 1\n"
+              f"POINTS {len(points)}\n"
+              f"DATA {data}\n")
+    with open(path, "wb") as f:
+        f.write(header.encode("ascii"))
+        if data == "binary":
+            f.write(points.tobytes())
+        else:
+            for point in points:
+                f.write((" ".join(str(value) for value in point.tolist()) + "\n").encode("ascii"))
+
+
+def make_points(count):
+    points = np.zeros(count, POINT_DTYPE)
+    points["x"] = np.arange(count)
+    points["z"] = -1.5
+    points["intensity"] = 7
+    return points
+
+
+class TestReadPcd:
+    @pytest.mark.parametrize("data", ["binary", "ascii"])
+    def test_reads_the_points(self, tmp_path, data):
+        points = make_points(5)
+        write_pcd(tmp_path / "scan.pcd", points, data)
+        read = sensor_streaming.read_pcd(str(tmp_path / "scan.pcd"))
+        assert read.dtype == POINT_DTYPE
+        assert read.tolist() == points.tolist()
+
+    def test_point_fields(self):
+        assert sensor_streaming.point_fields(POINT_DTYPE) == [
+            {"name": "x", "offset": 0, "datatype": 7, "count": 1},
+            {"name": "y", "offset": 4, "datatype": 7, "count": 1},
+            {"name": "z", "offset": 8, "datatype": 7, "count": 1},
+            {"name": "intensity", "offset": 12, "datatype": 2, "count": 1},
+        ]
+
+
+class TestFilterScan:
+    def make_scan(self):
+        # 4 beams at -2, 0, 2 and 4 degrees, a point every 0.5 degrees of azimuth
+        elevations, azimuths = np.meshgrid(np.radians([-2.0, 0.0, 2.0, 4.0]),
+                                           np.radians(np.arange(-179.75, 180.0, 0.5)), indexing="ij")
+        points = np.zeros(elevations.size, POINT_DTYPE)
+        points["x"] = (10.0 * np.cos(elevations) * np.cos(azimuths)).ravel()
+        points["y"] = (10.0 * np.cos(elevations) * np.sin(azimuths)).ravel()
+        points["z"] = (10.0 * np.sin(elevations)).ravel()
+        return points
+
+    def test_unconfigured_scan_is_not_filtered(self):
+        points = self.make_scan()
+        assert sensor_streaming.filter_scan(points) is points
+
+    def test_keeps_the_requested_beams(self):
+        points = self.make_scan()
+        filtered = sensor_streaming.filter_scan(points, vertical_angles=np.radians([4.0, -2.0, 1.0]))
+        elevations = np.degrees(np.arctan2(filtered["z"], np.hypot(filtered["x"], filtered["y"])))
+        assert sorted(set(np.round(elevations, 3).tolist())) == [-2.0, 4.0]
+        assert len(filtered) == 2 * 720
+
+    def test_thins_out_to_the_horizontal_resolution(self):
+        points = self.make_scan()
+        filtered = sensor_streaming.filter_scan(points, horizontal_resolution=np.radians(2.0),
+                                                vertical_angles=np.radians([0.0]))
+        azimuths = np.degrees(np.arctan2(filtered["y"], filtered["x"]))
+        assert len(filtered) == 180
+        assert np.diff(np.sort(azimuths)) == pytest.approx(2.0, abs=1e-3)
+        # Every beam is thinned out on its own
+        assert len(sensor_streaming.filter_scan(points, horizontal_resolution=np.radians(2.0))) == 4 * 180
+
+
+class TestSensorPublisher:
+    def test_publishes_a_scan_and_removes_its_file(self, tmp_path):
+        address = "inproc://test-sensor-streaming"
+        publisher = sensor_streaming.SensorPublisher(address)
+        subscriber = zmq.Context.instance().socket(zmq.SUB)
+        subscriber.connect(address)
+        subscriber.subscribe(b"")
+        publisher.start()
+        try:
+            points = make_points(1000)
+            filename = str(tmp_path / "ego-0.pcd")
+            write_pcd(filename, points)
+            publisher.submit("/lidar", lambda: sensor_streaming.scan_message(filename, {"seq": 0}))
+            assert subscriber.poll(5000)
+            topic, header, data = subscriber.recv_multipart()
+        finally:
+            publisher.stop()
+            subscriber.close(linger=0)
+        header = json.loads(header)
+        assert topic == b"/lidar"
+        assert header["seq"] == 0
+        assert header["points"] == 1000
+        assert header["point_step"] == POINT_DTYPE.itemsize
+        assert np.frombuffer(data, POINT_DTYPE).tolist() == points.tolist()
+        assert not (tmp_path / "ego-0.pcd").exists()
+
+
+class TestGroundTruthDetections:
+    def test_range_and_field_of_view(self):
+        unity_coordinates = pytest.importorskip("scenario_runner.unity_coordinates")
+        # The sensor entity heads north (yaw 90 degrees)
+        euler_angles = np.array([[0.0, 0.0, 90.0], [0.0, 0.0, 0.0], [0.0, 0.0, 0.0], [0.0, 0.0, 180.0]])
+        states = unity_coordinates.WorldStates(
+            positions=np.array([[10.0, 10.0, 0.0], [10.0, 30.0, 0.0], [10.0, -10.0, 0.0], [-200.0, 10.0, 0.0]]),
+            orientations=unity_coordinates.quaternions_from_euler_degrees(euler_angles),
+            linear_velocities=np.array([[0.0, 0.0, 0.0], [5.0, 0.0, 0.0], [0.0, 0.0, 0.0], [0.0, 0.0, 0.0]]),
+            angular_velocities=np.zeros((4, 3)))
+        boxes = np.array([[4.0, 2.0, 1.5, 1], [4.5, 2.0, 1.5, 1], [0.5, 0.5, 1.8, 2], [4.0, 2.0, 1.5, 1]])
+
+        rows, detections = sensor_streaming.ground_truth_detections(states, 0, boxes, 100.0, 360.0)
+        assert rows.tolist() == [1, 2]
+        assert detections["x"] == pytest.approx([20.0, -20.0], abs=1e-4)
+        assert detections["y"] == pytest.approx([0.0, 0.0], abs=1e-4)
+        assert detections["yaw"] == pytest.approx(np.radians([-90.0, -90.0]), abs=1e-4)
+        assert detections["speed"].tolist() == [5.0, 0.0]
+        assert detections["label"].tolist() == [1, 2]
+
+        rows, detections = sensor_streaming.ground_truth_detections(states, 0, boxes, 100.0, 90.0)
+        assert rows.tolist() == [1]
+        assert detections["length"].tolist() == [4.5]
+
+
+class Stream:
+    def __init__(self, period):
+        self.period = period
+
+
+class TestSensorScheduler:
+    def test_due_sensors(self):
+        scheduler = sensor_streaming.SensorScheduler()
+        lidar, detection, every_frame = Stream(0.1), Stream(0.25), Stream(0.0)
+        scheduler.add("lidar/ego", lidar)
+        scheduler.add("detection/ego", detection)
+        scheduler.add("every-frame/ego", every_frame)
+
+        def due(current_time):
+            return sorted((due_sensor.name, round(due_sensor.lag, 6), due_sensor.missed)
+                          for due_sensor in scheduler.due(current_time))
+
+        assert due(0.0) == [("detection/ego", 0.0, 0), ("every-frame/ego", 0.0, 0), ("lidar/ego", 0.0, 0)]
+        assert due(0.0) == []
+        assert due(0.05) == [("every-frame/ego", 0.0, 0)]
+        assert due(0.12) == [("every-frame/ego", 0.0, 0), ("lidar/ego", 0.02, 0)]
+        # A sensor frame late by more than a period skips the missed updates
+        assert due(0.53) == [("detection/ego", 0.28, 1), ("every-frame/ego", 0.0, 0), ("lidar/ego", 0.33, 3)]
+        # The due times summed from the periods are matched up to the float rounding
+        assert due(0.6) == [("every-frame/ego", 0.0, 0), ("lidar/ego", 0.0, 0)]
+
+        scheduler.remove("every-frame/ego")
+        scheduler.add("lidar/ego", Stream(1.0), start_time=0.7)
+        assert due(0.75) == [("detection/ego", 0.0, 0), ("lidar/ego", 0.05, 0)]
+        assert len(scheduler) == 2
@@ -0,0 +1,32 @@
+import pytest
+
+startup_timeline = pytest.importorskip("scenario_runner.startup_timeline")
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 10.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestStartupTimeline:
+    def test_phases(self):
+        clock = FakeClock()
+        timeline = startup_timeline.StartupTimeline(clock)
+        with timeline.phase("download"):
+            clock.now += 1.5
+
+        def load_scene():
+            clock.now += 2.0
+            return "scene"
+
+        assert timeline.timed("load the scene", load_scene) == "scene"
+        with pytest.raises(RuntimeError):
+            with timeline.phase("wait for the bridge"):
+                raise RuntimeError("failed")
+
+        assert timeline.phases == [("download", 0.0, 1.5), ("load the scene", 1.5, 3.5),
+                                   ("wait for the bridge", 3.5, 3.5)]
+        assert timeline.summary().splitlines()[0] == "Startup timeline, 3.500 s:"
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+state_tracker = pytest.importorskip("scenario_runner.state_tracker")
+unity_coordinates = pytest.importorskip("scenario_runner.unity_coordinates")
+bridge_metrics = pytest.importorskip("scenario_runner.bridge_metrics")
+
+NAMES = ["parked", "straight", "turning"]
+
+
+def unity_states(time):
+    # A parked vehicle, one driving along the Unity Z axis at 10 m/s and one
+    # turning on the spot
+    return unity_coordinates.UnityStates(
+        positions=np.array([[5.0, 0.0, 5.0], [0.0, 0.0, 10.0 * time], [-5.0, 0.0, 0.0]]),
+        rotations=np.array([[0.0, 90.0, 0.0], [0.0, 0.0, 0.0], [0.0, 30.0 * time, 0.0]]),
+        velocities=np.array([[0.0, 0.0, 0.0], [0.0, 0.0, 10.0], [0.0, 0.0, 0.0]]),
+        angular_velocities=np.array([[0.0, 0.0, 0.0], [0.0, 0.0, 0.0], [0.0, 0.5, 0.0]]))
+
+
+class TestEntityStateTracker:
+    def test_skips_the_states_the_simulator_extrapolates(self):
+        metrics = bridge_metrics.BridgeMetrics({})
+        tracker = state_tracker.EntityStateTracker(True, metrics, refresh_interval=0.5)
+
+        assert tracker.changed(NAMES, unity_states(0.0), 0.0).tolist() == [True, True, True]
+        assert tracker.changed(NAMES, unity_states(0.1), 0.1).tolist() == [False, False, True]
+        # Within the tolerances
+        states = unity_states(0.2)
+        states.positions[0, 0] += 0.005
+        states.rotations[1, 1] += 359.95
+        assert tracker.changed(NAMES, states, 0.2).tolist() == [False, False, True]
+        # The straight entity stops
+        states = unity_states(0.3)
+        states.velocities[1, 2] = 0.0
+        assert tracker.changed(NAMES, states, 0.3).tolist() == [False, True, True]
+        # Refreshed after 'refresh_interval' even if unchanged
+        assert tracker.changed(NAMES[:1], unity_states(0.5), 0.5).tolist() == [True]
+
+        assert (tracker.pushed_count, tracker.skipped_count) == (8, 5)
+        assert metrics.counters["entity_updates_skipped"] == 5
+        assert metrics.gauges["entity_update_skip_ratio"] == pytest.approx(5 / 13)
+
+    def test_forgotten_and_disabled(self):
+        tracker = state_tracker.EntityStateTracker(True)
+        tracker.changed(NAMES, unity_states(0.0), 0.0)
+        tracker.forget("parked")
+        assert tracker.changed(NAMES, unity_states(0.0), 0.0).tolist() == [True, False, False]
+
+        tracker = state_tracker.EntityStateTracker(False)
+        tracker.changed(NAMES, unity_states(0.0), 0.0)
+        assert tracker.changed(NAMES, unity_states(0.0), 0.0).tolist() == [True, True, True]
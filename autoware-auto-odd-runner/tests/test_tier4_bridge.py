@@ -0,0 +1,293 @@
+import itertools
+import json
+import os
+import sys
+import threading
+
+import numpy as np
+import pytest
+
+# The bridge needs the PythonAPI
+pytest.importorskip("lgsvl")
+zmq = pytest.importorskip("zmq")
+tier4_lgsvl_bridge = pytest.importorskip("scenario_runner.tier4_lgsvl_bridge")
+traffic_recorder = pytest.importorskip("scenario_runner.traffic_recorder")
+sensor_streaming = pytest.importorskip("scenario_runner.sensor_streaming")
+
+# The fake simulator and the synthetic TierIV client of the benchmarks
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+                                "benchmarks"))
+fake_simulator = pytest.importorskip("fake_simulator")
+tier4_client = pytest.importorskip("tier4_client")
+api = pytest.importorskip("simulation_api_schema_pb2")
+
+STEP_TIME_SEC = 0.05
+
+# Long enough for any request, short enough to fail a deadlock quickly
+RESPONSE_TIMEOUT_MS = 5000
+
+port_bases = itertools.count(9555, 100)
+
+
+@pytest.fixture
+def start_bridge(monkeypatch):
+    """
+    Starts a bridge against the fake simulator, bound over inproc; returns its
+    thread and an initialized client of it
+    """
+    monkeypatch.setenv("LGSVL__MAP", "BorregasAve")
+    monkeypatch.setenv("LGSVL__VEHICLE_0", "Lexus2016RXHybrid (Autoware.Auto)")
+    threads = []
+    clients = []
+
+    def start(call_latency=None, **kwargs):
+        port_base = next(port_bases)
+        api_address = "inproc://test-tier4-bridge-{port}"
+        started_up = threading.Event()
+        with fake_simulator.install_fake_simulator(call_latency=call_latency):
+            thread = tier4_lgsvl_bridge.Tier4LgSvlBridgeServerThread(
+                started_up, api_address=api_address, port_base=port_base,
+                sensor_pub_address=f"inproc://test-tier4-bridge-sensors-{port_base}", **kwargs)
+            thread.daemon = True
+            thread.start()
+            assert started_up.wait(RESPONSE_TIMEOUT_MS / 1000)
+        assert thread.startup_error is None
+        threads.append(thread)
+        client = tier4_client.SyntheticTier4Client(port_base=port_base, api_address=api_address)
+        for api_socket in client.sockets.values():
+            api_socket.setsockopt(zmq.RCVTIMEO, RESPONSE_TIMEOUT_MS)
+        clients.append(client)
+        client.call_checked(tier4_client.PORTS["initialize"], tier4_client.initialize_request(STEP_TIME_SEC))
+        return thread, client
+
+    yield start
+    for client in clients:
+        client.close()
+    for thread in threads:
+        thread.stop()
+
+
+def send(client, port, request):
+    client.sockets[port].send(request.SerializeToString())
+
+
+def receive(client, port):
+    response = client.responses[port]
+    response.ParseFromString(client.sockets[port].recv())
+    assert response.result.success, response.result.description
+    return response
+
+
+def call_checked(client, port, request, response_type):
+    # For the ports the synthetic client does not parse the responses of
+    response = response_type.FromString(client.call(port, request.SerializeToString()))
+    assert response.result.success, response.result.description
+    return response
+
+
+class TestTier4LgSvlBridge:
+    def test_asyncio_serves_the_ports(self, start_bridge):
+        _, client = start_bridge(use_asyncio=True)
+        names = tier4_client.entity_names(6)
+        for name in names:
+            client.call_checked(tier4_client.spawn_port(name), tier4_client.spawn_request(name))
+        for frame in range(5):
+            entity_status = api.UpdateEntityStatusResponse.FromString(client.call(
+                tier4_client.PORTS["update_entity_status"],
+                tier4_client.entity_status_request(names, frame, STEP_TIME_SEC).SerializeToString()))
+            assert entity_status.result.success, entity_status.result.description
+            client.call_checked(tier4_client.PORTS["update_frame"],
+                                tier4_client.update_frame_request(frame, STEP_TIME_SEC))
+        assert [status.name for status in entity_status.status] == names
+        client.call_checked(tier4_client.PORTS["despawn_entity"], api.DespawnEntityRequest(name=names[-1]))
+
+    def test_asyncio_sensor_frame_during_a_frame_step(self, start_bridge):
+        # The frame step holds the simulator worker, the sensor frame is answered on the event loop
+        _, client = start_bridge(call_latency={"run": 0.5}, use_asyncio=True)
+        client.call_checked(tier4_client.PORTS["spawn_vehicle_entity"], tier4_client.spawn_request("ego"))
+        update_frame = tier4_client.PORTS["update_frame"]
+        update_sensor_frame = tier4_client.PORTS["update_sensor_frame"]
+        send(client, update_frame, tier4_client.update_frame_request(0, STEP_TIME_SEC))
+        send(client, update_sensor_frame, tier4_client.update_sensor_frame_request(0, STEP_TIME_SEC))
+
+        sensor_frame = api.UpdateSensorFrameResponse.FromString(client.sockets[update_sensor_frame].recv())
+
+        assert sensor_frame.result.success, sensor_frame.result.description
+        assert not client.sockets[update_frame].poll(0)
+        receive(client, update_frame)
+
+    def test_asyncio_pipelined_spawns_during_frames(self, start_bridge):
+        # Every spawn is sent along with an UpdateFrame, both handled on the
+        # simulator worker, which also runs the pipelined frame steps
+        _, client = start_bridge(call_latency={"run": 0.005}, use_asyncio=True, pipelined_frames=True)
+        update_frame = tier4_client.PORTS["update_frame"]
+        spawn_vehicle = tier4_client.PORTS["spawn_vehicle_entity"]
+        client.call_checked(spawn_vehicle, tier4_client.spawn_request("ego"))
+        for frame in range(20):
+            send(client, update_frame, tier4_client.update_frame_request(frame, STEP_TIME_SEC))
+            send(client, spawn_vehicle, tier4_client.spawn_request(f"entity-{frame * 5 + 1}"))
+            receive(client, update_frame)
+            receive(client, spawn_vehicle)
+
+    @pytest.mark.parametrize("use_asyncio", [False, True])
+    def test_stop_writes_the_final_metrics(self, start_bridge, tmp_path, use_asyncio):
+        thread, client = start_bridge(use_asyncio=use_asyncio, metrics_dir=str(tmp_path))
+        client.call_checked(tier4_client.PORTS["spawn_vehicle_entity"], tier4_client.spawn_request("ego"))
+        for frame in range(3):
+            client.call_checked(tier4_client.PORTS["update_frame"],
+                                tier4_client.update_frame_request(frame, STEP_TIME_SEC))
+
+        thread.stop()
+
+        assert not thread.is_alive()
+        metrics = json.loads((tmp_path / "tier4_bridge_metrics.json").read_text())
+        assert metrics["frames"]["step"]["count"] == 3
+
+    @pytest.mark.parametrize("use_asyncio", [False, True])
+    def test_stop_closes_the_traffic_recording(self, start_bridge, tmp_path, use_asyncio):
+        record_file = str(tmp_path / "traffic.bin")
+        thread, client = start_bridge(use_asyncio=use_asyncio, record_file=record_file)
+        names = tier4_client.entity_names(3)
+        for name in names:
+            client.call_checked(tier4_client.spawn_port(name), tier4_client.spawn_request(name))
+        for frame in range(5):
+            client.call(tier4_client.PORTS["update_entity_status"],
+                        tier4_client.entity_status_request(names, frame, STEP_TIME_SEC).SerializeToString())
+            client.call_checked(tier4_client.PORTS["update_frame"],
+                                tier4_client.update_frame_request(frame, STEP_TIME_SEC))
+
+        thread.stop()
+
+        frame_ports = [tier4_client.PORTS["update_entity_status"], tier4_client.PORTS["update_frame"]]
+        expected_ports = [tier4_client.PORTS["initialize"]] + [tier4_client.spawn_port(name) for name in names]
+        expected_ports.extend(frame_ports * 5)
+        assert [record.port for record in traffic_recorder.read_records(record_file)] == expected_ports
+
+    def test_scene_change_invalidates_the_scene_cache(self, start_bridge):
+        thread, client = start_bridge()
+        simulator = thread.server.sim
+        initialize = tier4_client.initialize_request(STEP_TIME_SEC)
+        # A reset of the loaded scene uses the cached scene data
+        client.call_checked(tier4_client.PORTS["initialize"], initialize)
+        assert simulator.calls["map_to_gps"] == 1
+        for scene in ["SanFrancisco", "BorregasAve"]:
+            thread.set_scene(scene)
+            client.call_checked(tier4_client.PORTS["initialize"], initialize)
+
+        # BorregasAve loaded again, rather than reset, is queried again
+        assert simulator.calls["load"] == 3
+        assert simulator.calls["map_to_gps"] == 3
+
+    def test_lidar_configuration_in_radians(self, start_bridge, tmp_path):
+        _, client = start_bridge(lidar_dir=str(tmp_path))
+        client.call_checked(tier4_client.PORTS["spawn_vehicle_entity"], tier4_client.spawn_request("ego"))
+        lidar = api.AttachLidarSensorRequest()
+        lidar.configuration.entity = "ego"
+        lidar.configuration.horizontal_resolution = np.radians(0.2)
+        lidar.configuration.vertical_angles.extend(np.radians([-15.0, 15.0]).tolist())
+        call_checked(client, tier4_client.PORTS["attach_lidar_sensor"], lidar, api.AttachLidarSensorResponse)
+        # In degrees
+        lidar.configuration.vertical_angles[:] = [-15.0, 15.0]
+        response = api.AttachLidarSensorResponse.FromString(
+            client.call(tier4_client.PORTS["attach_lidar_sensor"], lidar.SerializeToString()))
+
+        assert not response.result.success
+        assert "out of range" in response.result.description
+
+    def test_detections_of_the_requested_entity_states(self, start_bridge):
+        thread, client = start_bridge()
+        names = tier4_client.entity_names(3)
+        for name in names:
+            client.call_checked(tier4_client.spawn_port(name), tier4_client.spawn_request(name))
+        detection = api.AttachDetectionSensorRequest()
+        detection.configuration.entity = "ego"
+        call_checked(client, tier4_client.PORTS["attach_detection_sensor"], detection,
+                     api.AttachDetectionSensorResponse)
+        subscriber = zmq.Context.instance().socket(zmq.SUB)
+        subscriber.connect(thread.sensor_pub_address)
+        subscriber.subscribe(b"")
+        try:
+            call_checked(client, tier4_client.PORTS["update_entity_status"],
+                         tier4_client.entity_status_request(names, 0, STEP_TIME_SEC), api.UpdateEntityStatusResponse)
+            client.call_checked(tier4_client.PORTS["update_frame"], tier4_client.update_frame_request(0, STEP_TIME_SEC))
+            # The fake simulator has moved the entities on by 0.5 m, the TierIV
+            # runner by 1 m
+            call_checked(client, tier4_client.PORTS["update_entity_status"],
+                         tier4_client.entity_status_request(names, 1, 2 * STEP_TIME_SEC),
+                         api.UpdateEntityStatusResponse)
+            call_checked(client, tier4_client.PORTS["update_sensor_frame"],
+                         tier4_client.update_sensor_frame_request(1, STEP_TIME_SEC), api.UpdateSensorFrameResponse)
+            assert subscriber.poll(RESPONSE_TIMEOUT_MS)
+            _, header, data = subscriber.recv_multipart()
+        finally:
+            subscriber.close(linger=0)
+
+        # The entities are where the runner has put them, the ego where the simulator has
+        assert json.loads(header)["objects"] == names[1:]
+        detections = np.frombuffer(data, sensor_streaming.DETECTION_DTYPE)
+        assert detections["x"] == pytest.approx([5.5, 10.5], abs=1e-4)
+        assert detections["y"] == pytest.approx([2.0, 4.0], abs=1e-4)
+
+    def test_entity_statuses_answered_from_the_requests(self, start_bridge):
+        thread, client = start_bridge()
+        simulator = thread.server.sim
+        names = tier4_client.entity_names(3)
+        for name in names:
+            client.call_checked(tier4_client.spawn_port(name), tier4_client.spawn_request(name))
+        for frame in range(3):
+            state_gets = simulator.calls["agent_state_get"]
+            # The fake simulator moves the entities on by 0.5 m a frame, the TierIV runner by 1 m
+            entity_status = call_checked(client, tier4_client.PORTS["update_entity_status"],
+                                         tier4_client.entity_status_request(names, frame, 2 * STEP_TIME_SEC),
+                                         api.UpdateEntityStatusResponse)
+            client.call_checked(tier4_client.PORTS["update_frame"],
+                                tier4_client.update_frame_request(frame, STEP_TIME_SEC))
+            # Only the ego's state is taken from the simulator
+            assert simulator.calls["agent_state_get"] - state_gets == 1
+
+        assert [status.name for status in entity_status.status] == names
+        # The ego where the simulator has moved it from its frame 1 state, the
+        # rest where the runner has put them
+        assert [status.pose.position.x for status in entity_status.status] == \
+            pytest.approx([1.5, 7.0, 12.0], abs=1e-4)
+
+    @pytest.mark.parametrize("use_asyncio", [False, True])
+    def test_entity_states_pushed_once_a_frame(self, start_bridge, use_asyncio):
+        thread, client = start_bridge(use_asyncio=use_asyncio)
+        simulator = thread.server.sim
+        names = tier4_client.entity_names(3)
+        for name in names:
+            client.call_checked(tier4_client.spawn_port(name), tier4_client.spawn_request(name))
+        for frame in range(3):
+            state_sets = simulator.calls["agent_state_set"]
+            # The second request of the frame replaces the states of the first
+            for _ in range(2):
+                call_checked(client, tier4_client.PORTS["update_entity_status"],
+                             tier4_client.entity_status_request(names, frame, STEP_TIME_SEC),
+                             api.UpdateEntityStatusResponse)
+            client.call_checked(tier4_client.PORTS["update_frame"],
+                                tier4_client.update_frame_request(frame, STEP_TIME_SEC))
+
+            assert simulator.calls["agent_state_set"] - state_sets == len(names)
+            # The state setters, the step and the ego's state getter, and the
+            # spawns in the first frame
+            spawns = len(names) if frame == 0 else 0
+            assert thread.server.metrics.gauges["frame_simulator_calls"] == spawns + len(names) + 2
+
+    @pytest.mark.parametrize("entity_count", [1, tier4_lgsvl_bridge.BATCH_CONVERSION_MIN_ENTITIES + 1])
+    def test_scalar_and_batch_conversions_agree(self, start_bridge, monkeypatch, entity_count):
+        thread, _ = start_bridge()
+        names = tier4_client.entity_names(entity_count)
+        statuses = tier4_client.entity_status_request(names, 3, STEP_TIME_SEC).status
+        agent_states = {}
+        for conversion, min_entities in [("scalar", sys.maxsize), ("batch", 0)]:
+            monkeypatch.setattr(tier4_lgsvl_bridge, "BATCH_CONVERSION_MIN_ENTITIES", min_entities)
+            rows, states = thread.server.agent_states_to_push(names, statuses)
+            assert list(rows) == list(range(entity_count))
+            agent_states[conversion] = [
+                [state.position.x, state.position.y, state.position.z,
+                 state.rotation.x, state.rotation.y, state.rotation.z,
+                 state.velocity.x, state.velocity.y, state.velocity.z]
+                for state in states]
+
+        assert np.allclose(agent_states["scalar"], agent_states["batch"], atol=1e-6)
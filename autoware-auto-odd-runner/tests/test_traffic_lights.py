@@ -0,0 +1,63 @@
+import json
+
+import pytest
+
+traffic_lights = pytest.importorskip("scenario_runner.traffic_lights")
+api = pytest.importorskip("simulation_api_schema_pb2")
+
+LampState = api.TrafficLightState.LampState
+
+
+class Signal:
+    def __init__(self, uid):
+        self.uid = uid
+        self.policies = []
+
+    def control(self, policy):
+        self.policies.append(policy)
+
+
+def traffic_light_state(traffic_light_id, *lamps):
+    state = api.TrafficLightState(id=traffic_light_id)
+    for lamp_type, confidence in lamps:
+        state.lamp_states.add(type=lamp_type, confidence=confidence)
+    return state
+
+
+class TestTrafficLights:
+    def test_load_and_resolve_the_signal_map(self, tmp_path):
+        (tmp_path / "signals.json").write_text(json.dumps({"BorregasAve": {"10": "a", "11": ["b", "c"]}}))
+        signal_map = traffic_lights.load_signal_map(str(tmp_path / "signals.json"))
+        assert signal_map == {"BorregasAve": {10: ["a"], 11: ["b", "c"]}}
+
+        controllables = {"a": Signal("a"), "b": Signal("b")}
+        signals = traffic_lights.resolve_signals(signal_map["BorregasAve"], controllables)
+        assert signals == {10: [controllables["a"]], 11: [controllables["b"]]}
+
+    def test_control_policy(self):
+        state = traffic_light_state(10, (LampState.LEFT, 1.0), (LampState.RED, 0.4), (LampState.GREEN, 0.9))
+        assert traffic_lights.signal_control_policy(state) == "green=0"
+        assert traffic_lights.signal_control_policy(traffic_light_state(10, (LampState.LEFT, 1.0))) == "black=0"
+
+    def test_applies_only_the_changed_states(self):
+        a, b, c = Signal("a"), Signal("b"), Signal("c")
+        controller = traffic_lights.TrafficLightController()
+        controller.reset({10: [a], 11: [b, c]})
+
+        controls, unmapped = controller.changed_controls([
+            traffic_light_state(10, (LampState.RED, 1.0)),
+            traffic_light_state(11, (LampState.GREEN, 1.0)),
+            traffic_light_state(12, (LampState.GREEN, 1.0))])
+        controller.apply(controls)
+        assert unmapped == [12]
+        assert (a.policies, b.policies, c.policies) == (["red=0"], ["green=0"], ["green=0"])
+
+        controls, _ = controller.changed_controls([
+            traffic_light_state(10, (LampState.RED, 1.0)),
+            traffic_light_state(11, (LampState.YELLOW, 1.0))])
+        assert [(signal.uid, policy) for signal, policy in controls] == [("b", "yellow=0"), ("c", "yellow=0")]
+
+        # A scene reload restores the default policies, so every state is applied again
+        controller.reset({10: [a], 11: [b, c]})
+        controls, _ = controller.changed_controls([traffic_light_state(10, (LampState.RED, 1.0))])
+        assert [(signal.uid, policy) for signal, policy in controls] == [("a", "red=0")]
@@ -0,0 +1,27 @@
+import pytest
+
+traffic_recorder = pytest.importorskip("scenario_runner.traffic_recorder")
+
+
+class TestTrafficRecorder:
+    def test_round_trip(self, tmp_path):
+        filename = str(tmp_path / "traffic.bin")
+        recorder = traffic_recorder.TrafficRecorder(filename)
+        recorder.record(5556, 1.5, b"request", b"response")
+        recorder.record(5562, 2.5, b"", b"\x00\x01")
+        recorder.close()
+
+        records = list(traffic_recorder.read_records(filename))
+
+        assert records == [traffic_recorder.TrafficRecord(5556, 1.5, b"request", b"response"),
+                           traffic_recorder.TrafficRecord(5562, 2.5, b"", b"\x00\x01")]
+
+    def test_truncated_record_is_skipped(self, tmp_path):
+        filename = str(tmp_path / "traffic.bin")
+        recorder = traffic_recorder.TrafficRecorder(filename)
+        recorder.record(5556, 1.5, b"request", b"response")
+        recorder.close()
+        with open(filename, "ab") as f:
+            f.write(traffic_recorder.RECORD_HEADER.pack(5556, 2.5, 100, 100) + b"partial")
+
+        assert len(list(traffic_recorder.read_records(filename))) == 1
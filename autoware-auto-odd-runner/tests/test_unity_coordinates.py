@@ -0,0 +1,93 @@
+import math
+import random
+
+import numpy as np
+import pytest
+
+# The bridge needs the PythonAPI
+lgsvl = pytest.importorskip("lgsvl")
+tier4_lgsvl_bridge = pytest.importorskip("scenario_runner.tier4_lgsvl_bridge")
+simulation_api_schema_pb2 = tier4_lgsvl_bridge.simulation_api_schema_pb2
+unity_coordinates = tier4_lgsvl_bridge.unity_coordinates
+
+
+def random_entity_statuses(count, seed=0):
+    rng = random.Random(seed)
+    request = simulation_api_schema_pb2.UpdateEntityStatusRequest()
+    for i in range(count):
+        status = request.status.add()
+        status.name = f"npc{i}"
+        status.pose.position.x = rng.uniform(0, 100000)
+        status.pose.position.y = rng.uniform(0, 100000)
+        status.pose.position.z = rng.uniform(-10, 10)
+        roll, pitch, yaw = (rng.uniform(-math.pi, math.pi) for _ in range(3))
+        cr, sr = math.cos(roll / 2), math.sin(roll / 2)
+        cp, sp = math.cos(pitch / 2), math.sin(pitch / 2)
+        cy, sy = math.cos(yaw / 2), math.sin(yaw / 2)
+        status.pose.orientation.x = sr * cp * cy - cr * sp * sy
+        status.pose.orientation.y = cr * sp * cy + sr * cp * sy
+        status.pose.orientation.z = cr * cp * sy - sr * sp * cy
+        status.pose.orientation.w = cr * cp * cy + sr * sp * sy
+        status.action_status.twist.linear.x = rng.uniform(-5, 30)
+        status.action_status.twist.angular.z = rng.uniform(-1, 1)
+    return request.status
+
+
+def as_list(vector):
+    return [vector.x, vector.y, vector.z]
+
+
+class TestUnityCoordinates:
+    def test_euler_degrees_match_scalar(self):
+        quaternions = np.array([[0, 0, 0, 1],
+                                [0.5, 0.5, 0.5, 0.5],
+                                [0.7071068, 0, 0, 0.7071068],
+                                [0, 0.7071068, 0, 0.7071068],
+                                [0, 0.8, 0, 0.6]])
+        expected = [tier4_lgsvl_bridge.euler_degree_from_quaternion(*q) for q in quaternions]
+        np.testing.assert_allclose(unity_coordinates.euler_degrees_from_quaternions(quaternions),
+                                   expected, atol=1e-9)
+
+    def test_batch_matches_scalar(self):
+        bridge = tier4_lgsvl_bridge.Tier4LgSvlBridge()
+        bridge.map_origin_northing = 12345.6
+        bridge.map_origin_easting = 54321.0
+        statuses = random_entity_statuses(200)
+
+        batch = bridge.agent_states_from_entity_statuses(statuses)
+
+        assert len(batch) == len(statuses)
+        for status, batch_state in zip(statuses, batch):
+            scalar_state = bridge.agent_state_from_world_coords(
+                status.pose.position,
+                status.pose.orientation,
+                status.action_status.twist.linear,
+                status.action_status.twist.angular)
+            np.testing.assert_allclose(as_list(batch_state.transform.position),
+                                       as_list(scalar_state.transform.position), atol=1e-9)
+            np.testing.assert_allclose(as_list(batch_state.transform.rotation),
+                                       as_list(scalar_state.transform.rotation), atol=1e-9)
+            np.testing.assert_allclose(as_list(batch_state.velocity),
+                                       as_list(scalar_state.velocity), atol=1e-9)
+            np.testing.assert_allclose(as_list(batch_state.angular_velocity),
+                                       as_list(scalar_state.angular_velocity), atol=1e-9)
+
+    def test_empty_batch(self):
+        states = unity_coordinates.entity_statuses_to_unity([], 0, 0)
+        assert states.positions.shape == (0, 3)
+        assert states.rotations.shape == (0, 3)
+
+    def test_world_unity_round_trip(self):
+        statuses = random_entity_statuses(50, seed=1)
+        positions, quaternions, linear, angular = unity_coordinates.entity_status_arrays(statuses)
+        unity_states = unity_coordinates.to_unity_states(positions, quaternions, linear, angular,
+                                                         12345.6, 54321.0)
+
+        world_states = unity_coordinates.to_world_states(*unity_states, 12345.6, 54321.0)
+
+        np.testing.assert_allclose(world_states.positions, positions, atol=1e-6)
+        # q and -q are the same rotation
+        same_sign = np.sign(np.sum(world_states.orientations * quaternions, axis=1))
+        np.testing.assert_allclose(world_states.orientations * same_sign[:, None], quaternions, atol=1e-9)
+        np.testing.assert_allclose(world_states.linear_velocities[:, 0], linear[:, 0], atol=1e-9)
+        np.testing.assert_allclose(world_states.angular_velocities[:, 2], angular[:, 2], atol=1e-9)
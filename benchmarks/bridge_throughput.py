@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2021 LG Electronics, Inc.
+#
+# This software contains code licensed as described in LICENSE.
+#
+
+"""
+Throughput benchmark of the TierIV bridge (autoware-auto-odd runner).
+
+A synthetic TierIV client (tier4_client.py) drives all the bridge ports over
+ZMQ: Initialize, the entity spawns and the sensor attachments, then a loop of
+UpdateEntityStatus, UpdateTrafficLights, UpdateSensorFrame and UpdateFrame
+requests. The bridge runs in this process against the fake simulator, for a
+number of entity counts, and the frames per second, per-message latencies and
+CPU time per frame are written as a versioned JSON report. With --baseline the
+report is compared to a previous one and the check fails on a regression.
+"""
+
+import argparse
+import json
+import logging
+import math
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+RUNNER_DIR = os.path.join(os.path.dirname(BENCHMARKS_DIR), "autoware-auto-odd-runner")
+
+# autopep8: off
+sys.path[:0] = [RUNNER_DIR, os.path.join(RUNNER_DIR, "scenario_runner", "proto")]
+
+import simulation_api_schema_pb2 as api  # noqa: E402
+from fake_simulator import install_fake_simulator, parse_call_latency  # noqa: E402
+from scenario_runner.bridge_supervisor import Tier4BridgeSupervisor  # noqa: E402
+import tier4_client  # noqa: E402
+from tier4_client import PORTS, SyntheticTier4Client  # noqa: E402
+# autopep8: on
+
+
+FORMAT = "[%(levelname)6s] [%(name)s] %(message)s"
+logging.basicConfig(level=logging.INFO, format=FORMAT)
+log = logging.getLogger("bridge_throughput")
+
+REPORT_VERSION = 5
+
+LIDAR_SCAN_DURATION_SEC = 0.1
+DETECTION_UPDATE_DURATION_SEC = 0.1
+
+# Traffic lights of the fake scene, with their lanelet ids mapped to the fake
+# simulator signals "signal-<n>"
+TRAFFIC_LIGHT_COUNT = 8
+TRAFFIC_LIGHT_IDS = [1000 + index for index in range(TRAFFIC_LIGHT_COUNT)]
+
+DEFAULT_ENTITY_COUNTS = [1, 10, 50, 100, 250, 500]
+
+STEP_TIME_SEC = 0.05
+
+BRIDGE_STARTUP_TIMEOUT_SEC = 30
+
+# The compared metrics, with the direction of a regression
+REGRESSION_CHECKS = {
+    "frames_per_sec": -1,
+    "cpu_sec_per_frame": +1,
+}
+
+
+def start_bridges(mode, agent_pool_size, skip_unchanged_states, lidar_dir, signal_map_file, instances):
+    """Starts the bridges, all against the fake simulator; returns their port bases"""
+    simulator = (os.environ["LGSVL__SIMULATOR_HOST"], int(os.environ["LGSVL__SIMULATOR_PORT"]))
+    supervisor = Tier4BridgeSupervisor([simulator] * instances,
+                                       lidar_dir=lidar_dir,
+                                       use_asyncio=mode == "asyncio",
+                                       pipelined_frames=mode == "pipelined",
+                                       agent_pool_size=agent_pool_size,
+                                       skip_unchanged_states=skip_unchanged_states,
+                                       signal_map_file=signal_map_file)
+    supervisor.start(BRIDGE_STARTUP_TIMEOUT_SEC)
+    return [instance.thread.port_base for instance in supervisor.instances]
+
+
+def attach_sensors(client):
+    # The ego's LiDAR and ground truth detections are streamed; the
+    # SpawnMiscObjectEntity the bridge does not implement is still sent, the
+    # way the TierIV runner does
+    lidar = api.AttachLidarSensorRequest()
+    lidar.configuration.entity = "ego"
+    # A VLP-16
+    lidar.configuration.horizontal_resolution = math.radians(0.2)
+    lidar.configuration.vertical_angles.extend([math.radians(-15 + 2 * beam) for beam in range(16)])
+    lidar.configuration.scan_duration = LIDAR_SCAN_DURATION_SEC
+    lidar.configuration.topic_name = "/perception/lidar/pointcloud"
+    client.call(PORTS["attach_lidar_sensor"], lidar.SerializeToString())
+    detection = api.AttachDetectionSensorRequest()
+    detection.configuration.entity = "ego"
+    detection.configuration.update_duration = DETECTION_UPDATE_DURATION_SEC
+    detection.configuration.topic_name = "/perception/objects"
+    client.call(PORTS["attach_detection_sensor"], detection.SerializeToString())
+    misc_object = api.SpawnMiscObjectEntityRequest()
+    misc_object.parameters.name = "misc-object"
+    client.call(PORTS["spawn_misc_object_entity"], misc_object.SerializeToString())
+
+
+def set_up_entities(client, entity_count):
+    client.call_checked(PORTS["initialize"], tier4_client.initialize_request(STEP_TIME_SEC))
+    names = tier4_client.entity_names(entity_count)
+    for name in names:
+        client.call_checked(tier4_client.spawn_port(name), tier4_client.spawn_request(name))
+    attach_sensors(client)
+    return names
+
+
+def write_signal_map(filename):
+    with open(filename, "wt") as f:
+        json.dump({os.environ["LGSVL__MAP"]: {
+            str(traffic_light_id): f"signal-{index}" for index, traffic_light_id in enumerate(TRAFFIC_LIGHT_IDS)
+        }}, f)
+
+
+def run_frames(client, frames):
+    for entity_status, traffic_lights, sensor_frame, update_frame in frames:
+        client.call(PORTS["update_entity_status"], entity_status)
+        client.call(PORTS["update_traffic_lights"], traffic_lights)
+        client.call(PORTS["update_sensor_frame"], sensor_frame)
+        client.call_checked(PORTS["update_frame"], update_frame)
+
+
+def run_entity_count(clients, entity_count, frame_count, warmup_frames):
+    """Runs the frames with a client (thread) per bridge instance at once"""
+    for client in clients:
+        names = set_up_entities(client, entity_count)
+
+    # The entity statuses move a little every frame, as the real ones would
+    requests = [
+        (tier4_client.entity_status_request(names, frame, STEP_TIME_SEC).SerializeToString(),
+         tier4_client.traffic_lights_request(TRAFFIC_LIGHT_IDS, frame, STEP_TIME_SEC).SerializeToString(),
+         tier4_client.update_sensor_frame_request(frame, STEP_TIME_SEC).SerializeToString(),
+         tier4_client.update_frame_request(frame, STEP_TIME_SEC))
+        for frame in range(warmup_frames + frame_count)
+    ]
+
+    for client in clients:
+        run_frames(client, requests[:warmup_frames])
+        client.reset_latencies()
+
+    client_cpu = [0.0] * len(clients)
+
+    def run_measured_frames(index):
+        started = time.thread_time()
+        run_frames(clients[index], requests[warmup_frames:])
+        client_cpu[index] = time.thread_time() - started
+
+    threads = [threading.Thread(target=run_measured_frames, args=(index,)) for index in range(len(clients))]
+    started = time.perf_counter()
+    process_cpu_started = time.process_time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    # The bridges run in this process, everything but the client threads is their CPU time
+    bridge_cpu = time.process_time() - process_cpu_started - sum(client_cpu)
+    total_frames = frame_count * len(clients)
+
+    # The next Initialize drops the rest of the entities
+    if len(names) > 1:
+        for client in clients:
+            client.call_checked(PORTS["despawn_entity"], api.DespawnEntityRequest(name=names[-1]))
+
+    return {
+        "entities": entity_count,
+        "frames": frame_count,
+        "elapsed_sec": elapsed,
+        "frames_per_sec": total_frames / elapsed if elapsed else 0.0,
+        "cpu_sec_per_frame": bridge_cpu / total_frames,
+        "client_cpu_sec_per_frame": sum(client_cpu) / total_frames,
+        # Of the first bridge instance
+        "latency": clients[0].latency_summary(),
+    }
+
+
+def run(args):
+    with install_fake_simulator(call_latency=parse_call_latency(args.call_latency),
+                                signal_count=TRAFFIC_LIGHT_COUNT), \
+            tempfile.TemporaryDirectory(prefix="tier4-bridge-lidar-") as lidar_dir:
+        os.environ.setdefault("LGSVL__MAP", "BorregasAve")
+        os.environ.setdefault("LGSVL__VEHICLE_0", "Lexus2016RXHybrid (Autoware.Auto)")
+        signal_map_file = os.path.join(lidar_dir, "signal_map.json")
+        write_signal_map(signal_map_file)
+        port_bases = start_bridges(args.mode, args.agent_pool_size, args.skip_unchanged_states,
+                                   lidar_dir, signal_map_file, args.instances)
+        logging.getLogger("scenario_runner.tier4_lgsvl_bridge").setLevel(logging.WARNING)
+
+        clients = [SyntheticTier4Client(port_base=port_base) for port_base in port_bases]
+        results = []
+        try:
+            for entity_count in args.entities:
+                result = run_entity_count(clients, entity_count, args.frames, args.warmup_frames)
+                log.info(f"{entity_count} entities: {result['frames_per_sec']:.1f} frames/s, "
+                         f"{result['cpu_sec_per_frame'] * 1000:.3f} ms CPU/frame, "
+                         f"UpdateEntityStatus p50 "
+                         f"{result['latency'][str(PORTS['update_entity_status'])]['p50'] * 1000:.3f} ms, "
+                         f"UpdateFrame p50 {result['latency'][str(PORTS['update_frame'])]['p50'] * 1000:.3f} ms")
+                results.append(result)
+        finally:
+            for client in clients:
+                client.close()
+
+    return {
+        "version": REPORT_VERSION,
+        "timestamp": time.time(),
+        "config": {
+            "mode": args.mode,
+            "instances": args.instances,
+            "agent_pool_size": args.agent_pool_size,
+            "skip_unchanged_states": args.skip_unchanged_states,
+            "frames": args.frames,
+            "warmup_frames": args.warmup_frames,
+            "step_time": STEP_TIME_SEC,
+            "call_latency": parse_call_latency(args.call_latency),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+        },
+        "results": results,
+    }
+
+
+def find_regressions(report, baseline, tolerance):
+    """
+    The REGRESSION_CHECKS metrics of the report worse than the baseline ones
+    by more than the tolerance (a fraction), for the entity counts present
+    in both reports
+    """
+    if baseline.get("version") != report["version"]:
+        raise ValueError(f"The baseline report version {baseline.get('version')} differs from "
+                         f"{report['version']}, regenerate the baseline")
+    if baseline["config"]["mode"] != report["config"]["mode"]:
+        raise ValueError(f"The baseline report is of the '{baseline['config']['mode']}' bridge mode, "
+                         f"not '{report['config']['mode']}'")
+    if baseline["config"].get("instances", 1) != report["config"]["instances"]:
+        raise ValueError(f"The baseline report is of {baseline['config'].get('instances', 1)} bridge "
+                         f"instance(s), not {report['config']['instances']}")
+    if baseline["config"].get("skip_unchanged_states", False) != report["config"]["skip_unchanged_states"]:
+        raise ValueError("The baseline report differs in skipping the unchanged entity states")
+    baseline_results = {result["entities"]: result for result in baseline["results"]}
+    regressions = []
+    for result in report["results"]:
+        baseline_result = baseline_results.get(result["entities"])
+        if baseline_result is None:
+            continue
+        for metric, direction in REGRESSION_CHECKS.items():
+            value, baseline_value = result[metric], baseline_result[metric]
+            if (value - baseline_value) * direction > tolerance * baseline_value:
+                regressions.append(f"{result['entities']} entities: {metric} {value:.6g}, "
+                                   f"baseline {baseline_value:.6g}")
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(os.path.basename(sys.argv[0]),
+                                     description='Benchmark the TierIV bridge throughput')
+    parser.add_argument('--entities', type=int, nargs='+', default=DEFAULT_ENTITY_COUNTS,
+                        help='Entity counts to benchmark (default: %(default)s)')
+    parser.add_argument('--frames', type=int, default=200,
+                        help='Measured frames per entity count (default: %(default)s)')
+    parser.add_argument('--warmup-frames', type=int, default=20,
+                        help='Frames sent before measuring (default: %(default)s)')
+    parser.add_argument('--mode', choices=['polling', 'asyncio', 'pipelined'], default='polling',
+                        help='Bridge server mode, see LGSVL__BRIDGE_ASYNCIO and '
+                        'LGSVL__BRIDGE_PIPELINED_FRAMES (default: %(default)s)')
+    parser.add_argument('--instances', type=int, default=1,
+                        help='Bridges run at once, each on a port block of its own and with a client '
+                        'thread of its own (default: %(default)s)')
+    parser.add_argument('--agent-pool-size', type=int, default=0,
+                        help='Bridge agent pool size, see LGSVL__BRIDGE_AGENT_POOL_SIZE (default: %(default)s)')
+    parser.add_argument('--skip-unchanged-states', action='store_true',
+                        help='Skip pushing the entity states the simulator extrapolates, see '
+                        'LGSVL__BRIDGE_SKIP_UNCHANGED_STATES')
+    parser.add_argument('--call-latency', type=str, default='',
+                        help='Fake simulator call latency, see runner_benchmarks.py (default: none)')
+    parser.add_argument('--json-report', metavar='FILE', type=str,
+                        help='Write the report to a JSON file')
+    parser.add_argument('--baseline', metavar='FILE', type=str,
+                        help='Fail if the results are worse than the ones of this report')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Allowed relative regression against the baseline (default: %(default)s)')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    report = run(args)
+
+    if args.json_report:
+        with open(args.json_report, "wt") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        try:
+            regressions = find_regressions(report, baseline, args.tolerance)
+        except ValueError as e:
+            log.error(str(e))
+            return 2
+        for regression in regressions:
+            log.error(f"Regression: {regression}")
+        if regressions:
+            return 1
+        log.info(f"No regression against '{args.baseline}'")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2021 LG Electronics, Inc.
+#
+# This software contains code licensed as described in LICENSE.
+#
+
+"""
+Time the TierIV bridge takes to convert the entity statuses of an
+UpdateEntityStatus request to the simulator agent states, per entity count.
+
+The conversion is timed one entity at a time ("scalar"), in NumPy arrays
+("batch") and as the bridge picks between the two (see
+BATCH_CONVERSION_MIN_ENTITIES), with no detection sensor attached and the
+unchanged states pushed, i.e. when the state arrays are not needed. The bridge
+runs in this process against the fake simulator, the conversion is called on
+this thread. The p50/p95/p99 times are logged and written as a versioned JSON
+report.
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import sys
+import threading
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+RUNNER_DIR = os.path.join(os.path.dirname(BENCHMARKS_DIR), "autoware-auto-odd-runner")
+
+# autopep8: off
+sys.path[:0] = [RUNNER_DIR, os.path.join(RUNNER_DIR, "scenario_runner", "proto")]
+
+import numpy as np  # noqa: E402
+
+from fake_simulator import install_fake_simulator  # noqa: E402
+from scenario_runner import tier4_lgsvl_bridge  # noqa: E402
+from scenario_runner.bridge_metrics import LatencyHistogram  # noqa: E402
+import tier4_client  # noqa: E402
+# autopep8: on
+
+
+FORMAT = "[%(levelname)6s] [%(name)s] %(message)s"
+logging.basicConfig(level=logging.INFO, format=FORMAT)
+log = logging.getLogger("entity_status_conversion")
+
+REPORT_VERSION = 1
+
+STEP_TIME_SEC = 0.05
+
+BRIDGE_STARTUP_TIMEOUT_SEC = 30
+
+PORT_BASE = 8555
+
+# The BATCH_CONVERSION_MIN_ENTITIES each conversion is timed with, None for
+# the bridge's own
+CONVERSIONS = {
+    "scalar": sys.maxsize,
+    "batch": 0,
+    "bridge": None,
+}
+
+
+def start_bridge():
+    started_up = threading.Event()
+    thread = tier4_lgsvl_bridge.Tier4LgSvlBridgeServerThread(
+        started_up, api_address="inproc://tier4-bridge-{port}", port_base=PORT_BASE,
+        sensor_pub_address=f"inproc://tier4-bridge-sensors-{PORT_BASE}", name="tier4-bridge")
+    thread.daemon = True
+    thread.start()
+    started_up.wait(BRIDGE_STARTUP_TIMEOUT_SEC)
+    if not started_up.is_set() or thread.startup_error is not None:
+        raise RuntimeError(f"The bridge failed to start up: {thread.startup_error!r}")
+    return thread
+
+
+def measure_conversion(bridge, statuses, names, min_entities, count, warmup_count):
+    default_min_entities = tier4_lgsvl_bridge.BATCH_CONVERSION_MIN_ENTITIES
+    if min_entities is not None:
+        tier4_lgsvl_bridge.BATCH_CONVERSION_MIN_ENTITIES = min_entities
+    histogram = LatencyHistogram()
+    try:
+        for index in range(warmup_count + count):
+            converting = time.perf_counter()
+            bridge.agent_states_to_push(names, statuses)
+            if index >= warmup_count:
+                histogram.record(time.perf_counter() - converting)
+    finally:
+        tier4_lgsvl_bridge.BATCH_CONVERSION_MIN_ENTITIES = default_min_entities
+    return histogram.summary()
+
+
+def check_conversions_agree(bridge, statuses, names):
+    """Both conversions have to give the same agent states for the timings to compare"""
+    default_min_entities = tier4_lgsvl_bridge.BATCH_CONVERSION_MIN_ENTITIES
+    agent_states = {}
+    for conversion in ("scalar", "batch"):
+        tier4_lgsvl_bridge.BATCH_CONVERSION_MIN_ENTITIES = CONVERSIONS[conversion]
+        try:
+            _, agent_states[conversion] = bridge.agent_states_to_push(names, statuses)
+        finally:
+            tier4_lgsvl_bridge.BATCH_CONVERSION_MIN_ENTITIES = default_min_entities
+    rows = [
+        [[state.position.x, state.position.y, state.position.z,
+          state.rotation.x, state.rotation.y, state.rotation.z,
+          state.velocity.x, state.velocity.y, state.velocity.z]
+         for state in agent_states[conversion]]
+        for conversion in ("scalar", "batch")
+    ]
+    if not np.allclose(*rows, atol=1e-6):
+        raise RuntimeError("The scalar and batch conversions do not agree")
+
+
+def run(args):
+    results = {}
+    with install_fake_simulator():
+        os.environ.setdefault("LGSVL__MAP", "BorregasAve")
+        os.environ.setdefault("LGSVL__VEHICLE_0", "Lexus2016RXHybrid (Autoware.Auto)")
+        thread = start_bridge()
+        logging.getLogger("scenario_runner.tier4_lgsvl_bridge").setLevel(logging.WARNING)
+        client = tier4_client.SyntheticTier4Client(port_base=PORT_BASE, api_address="inproc://tier4-bridge-{port}")
+        try:
+            client.call_checked(tier4_client.PORTS["initialize"], tier4_client.initialize_request(STEP_TIME_SEC))
+        finally:
+            client.close()
+        try:
+            for entity_count in args.entities:
+                names = tier4_client.entity_names(entity_count)
+                statuses = tier4_client.entity_status_request(names, 0, STEP_TIME_SEC).status
+                check_conversions_agree(thread.server, statuses, names)
+                result = {
+                    conversion: measure_conversion(thread.server, statuses, names, min_entities,
+                                                   args.requests, args.warmup_requests)
+                    for conversion, min_entities in CONVERSIONS.items()
+                }
+                results[str(entity_count)] = result
+                log.info(f"{entity_count} entities: " + ", ".join(
+                    f"{conversion} p50 {latency['p50'] * 1e6:.0f} us"
+                    for conversion, latency in result.items()))
+        finally:
+            thread.stop()
+
+    return {
+        "version": REPORT_VERSION,
+        "timestamp": time.time(),
+        "config": {
+            "entities": args.entities,
+            "requests": args.requests,
+            "warmup_requests": args.warmup_requests,
+            "batch_conversion_min_entities": tier4_lgsvl_bridge.BATCH_CONVERSION_MIN_ENTITIES,
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+        },
+        "results": results,
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(os.path.basename(sys.argv[0]),
+                                     description='Benchmark the TierIV bridge entity status conversion')
+    parser.add_argument('--entities', type=int, nargs='+', default=[1, 10, 20, 50, 100, 500],
+                        help='Entities in the UpdateEntityStatus request (default: %(default)s)')
+    parser.add_argument('--requests', type=int, default=1000,
+                        help='Measured conversions per entity count and conversion (default: %(default)s)')
+    parser.add_argument('--warmup-requests', type=int, default=100,
+                        help='Conversions run before measuring (default: %(default)s)')
+    parser.add_argument('--json-report', metavar='FILE', type=str,
+                        help='Write the report to a JSON file')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    report = run(args)
+    if args.json_report:
+        with open(args.json_report, "wt") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
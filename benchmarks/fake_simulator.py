@@ -0,0 +1,493 @@
+#
+# Copyright (c) 2021 LG Electronics, Inc.
+#
+# This software contains code licensed as described in LICENSE.
+#
+
+"""
+An in-process stand-in for the LG SVL Simulator websocket API.
+
+FakeSimulator answers the lgsvl.Simulator calls made by the scenario runners
+(load, reset, run, add_agent, agent.state, controllables, ...) without
+simulating anything but moving the agents along their velocities, and makes
+every call cost a configurable latency, so that the runners' own overheads
+can be measured on a machine with no simulator:
+
+    with install_fake_simulator(call_latency={"default": 0.001, "add_agent": 0.01},
+                                scene_load_sec=2.0) as fake:
+        run_random_traffic()
+    print(fake.instances[0].calls)
+
+install_fake_simulator() replaces lgsvl.Simulator and points the
+LGSVL__SIMULATOR_HOST/PORT environment variables at a listening socket, so
+the runners' "is the simulator alive" checks pass. A runner started in a
+subprocess gets the fake through sitecustomize.py, see README.md.
+"""
+
+import itertools
+import os
+import socket
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+
+import lgsvl
+import numpy as np
+
+
+# The PythonAPI agent classes, so that the runners' isinstance() checks hold
+# for the fake agents. FakeAgent goes first in the MRO and overrides all of
+# the remote calls.
+EgoVehicleBase = getattr(lgsvl, "EgoVehicle", object)
+NpcVehicleBase = getattr(lgsvl, "NpcVehicle", object)
+PedestrianBase = getattr(lgsvl, "Pedestrian", object)
+LidarSensorBase = getattr(lgsvl, "LidarSensor", object)
+
+FIXED_DELTA_TIME_SEC = 0.01
+
+DEFAULT_SPAWN_COUNT = 4
+DEFAULT_RANDOM_AGENT_COUNT = 20
+
+# Points of a fake LiDAR scan, about a 32 beam LiDAR at 10 Hz
+LIDAR_SCAN_POINTS = 60000
+
+FAKE_SIMULATOR_ENVAR = "LGSVL__FAKE_SIMULATOR"
+
+
+def parse_call_latency(spec):
+    """
+    Parses "0.001" (the same latency for every call) or
+    "default=0.001,add_agent=0.01,agent_state_get=0.0005" into a call latency
+    dictionary, see FakeSimulator
+    """
+    if not spec:
+        return {}
+    if "=" not in spec:
+        return {"default": float(spec)}
+    latency = {}
+    for item in spec.split(","):
+        name, seconds = item.split("=")
+        latency[name.strip()] = float(seconds)
+    return latency
+
+
+def config_from_env():
+    """
+    The FakeSimulator keyword arguments set by the LGSVL__FAKE_SIMULATOR_*
+    environment variables
+    """
+    config = {
+        "call_latency": parse_call_latency(os.environ.get("LGSVL__FAKE_SIMULATOR_CALL_LATENCY")),
+        "scene_load_sec": float(os.environ.get("LGSVL__FAKE_SIMULATOR_SCENE_LOAD_SEC", 0)),
+        "spawn_count": int(os.environ.get("LGSVL__FAKE_SIMULATOR_SPAWN_COUNT", DEFAULT_SPAWN_COUNT)),
+        "random_agent_count": int(os.environ.get("LGSVL__FAKE_SIMULATOR_RANDOM_AGENTS",
+                                                 DEFAULT_RANDOM_AGENT_COUNT)),
+    }
+    realtime_factor = os.environ.get("LGSVL__FAKE_SIMULATOR_REALTIME_FACTOR")
+    if realtime_factor:
+        config["realtime_factor"] = float(realtime_factor)
+    return config
+
+
+def config_to_env(call_latency=None, scene_load_sec=0.0, realtime_factor=None,
+                  spawn_count=DEFAULT_SPAWN_COUNT, random_agent_count=DEFAULT_RANDOM_AGENT_COUNT):
+    """The inverse of config_from_env(), for passing a config to a subprocess"""
+    env = {
+        "LGSVL__FAKE_SIMULATOR_CALL_LATENCY": ",".join(
+            f"{name}={seconds}" for name, seconds in (call_latency or {}).items()),
+        "LGSVL__FAKE_SIMULATOR_SCENE_LOAD_SEC": str(scene_load_sec),
+        "LGSVL__FAKE_SIMULATOR_SPAWN_COUNT": str(spawn_count),
+        "LGSVL__FAKE_SIMULATOR_RANDOM_AGENTS": str(random_agent_count),
+    }
+    if realtime_factor:
+        env["LGSVL__FAKE_SIMULATOR_REALTIME_FACTOR"] = str(realtime_factor)
+    return env
+
+
+def copy_vector(vector):
+    return lgsvl.Vector(vector.x, vector.y, vector.z)
+
+
+def copy_agent_state(state):
+    # Much cheaper than copy.deepcopy(), which would dominate the fake's own cost
+    return lgsvl.AgentState(
+        transform=lgsvl.Transform(copy_vector(state.transform.position),
+                                  copy_vector(state.transform.rotation)),
+        velocity=copy_vector(state.velocity),
+        angular_velocity=copy_vector(state.angular_velocity))
+
+
+class FakeAgent():
+    def __init__(self, simulator, uid, name, agent_type, state):
+        self.simulator = simulator
+        self.uid = uid
+        self.name = name
+        self.agent_type = agent_type
+        self._state = copy_agent_state(state) if state is not None else lgsvl.AgentState()
+        self.waypoints = []
+        self.callbacks = {}
+        self.bridge_address = None
+        self.sensors = []
+
+    def __eq__(self, other):
+        return isinstance(other, FakeAgent) and self.uid == other.uid
+
+    def __hash__(self):
+        return hash(self.uid)
+
+    @property
+    def state(self):
+        # Like the real getter, every read is a round trip returning a new object
+        self.simulator.call("agent_state_get")
+        return copy_agent_state(self._state)
+
+    @state.setter
+    def state(self, state):
+        self.simulator.call("agent_state_set")
+        self._state = copy_agent_state(state)
+
+    @property
+    def transform(self):
+        return self.state.transform
+
+    @property
+    def bounding_box(self):
+        self.simulator.call("agent_bounding_box")
+        return lgsvl.BoundingBox(lgsvl.Vector(-1, 0, -2.5), lgsvl.Vector(1, 1.5, 2.5))
+
+    def on_collision(self, fn):
+        self.simulator.call("agent_on_collision")
+        self.callbacks["collision"] = fn
+
+    def follow(self, waypoints, loop=False, waypoints_path_type="Linear"):
+        self.simulator.call("agent_follow")
+        self.waypoints = list(waypoints)
+
+    def follow_closest_lane(self, follow, max_speed, isLaneChange=True):
+        self.simulator.call("agent_follow_closest_lane")
+
+    def on_waypoint_reached(self, fn):
+        self.simulator.call("agent_on_waypoint_reached")
+        self.callbacks["waypoint_reached"] = fn
+
+    def on_destination_reached(self, fn):
+        self.simulator.call("agent_on_destination_reached")
+        self.callbacks["destination_reached"] = fn
+
+    def get_sensors(self):
+        self.simulator.call("agent_get_sensors")
+        return self.sensors
+
+    def connect_bridge(self, address, port, connection_type=None):
+        self.simulator.call("agent_connect_bridge")
+        self.bridge_address = (address, port)
+
+    @property
+    def bridge_connected(self):
+        self.simulator.call("agent_bridge_connected")
+        return self.bridge_address is not None
+
+    def set_destination(self, transform):
+        self.simulator.call("agent_set_destination")
+        self.waypoints = [transform]
+
+    def step(self, seconds):
+        position = self._state.transform.position
+        velocity = self._state.velocity
+        position.x += velocity.x * seconds
+        position.y += velocity.y * seconds
+        position.z += velocity.z * seconds
+
+    def traverse_waypoints(self):
+        # The fake agents reach all their waypoints within the first step
+        waypoints, self.waypoints = self.waypoints, []
+        if not waypoints:
+            return False
+        if "waypoint_reached" in self.callbacks:
+            for index in range(len(waypoints)):
+                self.callbacks["waypoint_reached"](self, index)
+        if "destination_reached" in self.callbacks:
+            self.callbacks["destination_reached"](self)
+        return True
+
+
+class FakeEgoVehicle(FakeAgent, EgoVehicleBase):
+    def __init__(self, simulator, uid, name, agent_type, state):
+        FakeAgent.__init__(self, simulator, uid, name, agent_type, state)
+        self.sensors = [FakeLidarSensor(simulator, f"{uid}-lidar")]
+
+
+class FakeNpcVehicle(FakeAgent, NpcVehicleBase):
+    pass
+
+
+class FakePedestrian(FakeAgent, PedestrianBase):
+    pass
+
+
+class FakeLidarSensor(LidarSensorBase):
+    """Saves the scans as the simulator does, a binary PCD of random points"""
+    POINT_DTYPE = np.dtype([("x", "<f4"), ("y", "<f4"), ("z", "<f4"), ("intensity", "u1")])
+
+    def __init__(self, simulator, uid, name="Lidar", points=LIDAR_SCAN_POINTS):
+        self.simulator = simulator
+        self.uid = uid
+        self.name = name
+        self.enabled = True
+        self.points = points
+        self.rng = np.random.default_rng(0)
+
+    def save(self, path):
+        self.simulator.call("lidar_save")
+        points = np.empty(self.points, self.POINT_DTYPE)
+        for axis in ("x", "y", "z"):
+            points[axis] = self.rng.uniform(-50, 50, self.points)
+        points["intensity"] = self.rng.integers(0, 255, self.points)
+        with open(path, "wb") as f:
+            f.write(("VERSION 0.7\n"
+                     "FIELDS x y z intensity\n"
+                     "SIZE 4 4 4 1\n"
+                     "TYPE F F F U\n"
+                     "COUNT 1 1 1 1\n"
+                     f"WIDTH {self.points}\n"
+                     "HEIGHT 1\n"
+                     "VIEWPOINT 0 0 0 1 0 0 0\n"
+                     f"POINTS {self.points}\n"
+                     "DATA binary\n").encode("ascii"))
+            f.write(points.tobytes())
+        return True
+
+
+class FakeControllable():
+    def __init__(self, simulator, uid, type, transform=None, policy=""):
+        self.simulator = simulator
+        self.uid = uid
+        self.type = type
+        self.transform = transform if transform is not None else lgsvl.Transform()
+        self.default_control_policy = policy
+        self.control_policy = policy
+
+    def control(self, control_policy):
+        self.simulator.call("controllable_control")
+        self.control_policy = control_policy
+
+
+class FakeSimulator():
+    """
+    call_latency maps a call name (the method name, or agent_state_get /
+    agent_state_set and the like for the agent calls) to the seconds it takes,
+    the "default" entry applies to the calls not listed. Loading a scene
+    costs scene_load_sec on top of that. With a realtime_factor, run() takes
+    the simulated time divided by the factor, otherwise it returns right away.
+
+    The calls made are counted in 'calls' and their total latency is kept in
+    'latency_spent', so that the time spent in the fake can be told apart
+    from the time spent in a runner.
+    """
+    def __init__(self, address="localhost", port=8181, call_latency=None, scene_load_sec=0.0,
+                 realtime_factor=None, spawn_count=DEFAULT_SPAWN_COUNT,
+                 random_agent_count=DEFAULT_RANDOM_AGENT_COUNT, signal_count=0):
+        self.address = address
+        self.port = port
+        self.call_latency = dict(call_latency or {})
+        self.scene_load_sec = scene_load_sec
+        self.realtime_factor = realtime_factor
+        self.spawn_count = spawn_count
+        self.random_agent_count = random_agent_count
+        self.signal_count = signal_count
+        self.lock = threading.Lock()
+        self.calls = Counter()
+        self.latency_spent = 0.0
+        self.uids = itertools.count()
+        self.current_scene = None
+        self.current_time = 0.0
+        self.current_frame = 0
+        self.agents = {}
+        self.controllables = {}
+        self.callbacks = {}
+        self.nav_origin = None
+        self._weather = lgsvl.WeatherState(0, 0, 0, 0, 0)
+        self.date_time = datetime.now()
+        self.time_fixed = False
+        self.stopped = False
+
+    def call(self, name, extra_latency=0.0):
+        latency = self.call_latency.get(name, self.call_latency.get("default", 0.0)) + extra_latency
+        with self.lock:
+            self.calls[name] += 1
+            self.latency_spent += latency
+        if latency > 0:
+            time.sleep(latency)
+
+    def new_uid(self):
+        return f"fake-{next(self.uids)}"
+
+    def close(self):
+        self.call("close")
+
+    def load(self, scene, seed=None):
+        self.call("load", self.scene_load_sec)
+        self.clear()
+        self.current_scene = scene
+        for index in range(self.signal_count):
+            uid = f"signal-{index}"
+            self.controllables[uid] = FakeControllable(self, uid, "signal", policy="trigger=50;green=15;yellow=3;red=20;loop")
+
+    def reset(self):
+        self.call("reset")
+        self.clear()
+
+    def clear(self):
+        self.agents.clear()
+        self.controllables = {uid: controllable for uid, controllable in self.controllables.items()
+                              if controllable.type == "signal"}
+        self.callbacks.clear()
+        self.current_time = 0.0
+        self.current_frame = 0
+        self.stopped = False
+
+    def stop(self):
+        self.call("stop")
+        self.stopped = True
+
+    def run(self, time_limit=0.0, time_scale=None):
+        self.call("run")
+        self.stopped = False
+        if time_limit and self.realtime_factor:
+            time.sleep(time_limit / self.realtime_factor)
+        for agent in list(self.agents.values()):
+            agent.step(time_limit)
+        self.current_time += time_limit
+        self.current_frame += max(1, int(time_limit / FIXED_DELTA_TIME_SEC))
+
+        traversed = [agent.traverse_waypoints() for agent in list(self.agents.values())]
+        if any(traversed) and "agents_traversed_waypoints" in self.callbacks:
+            self.callbacks["agents_traversed_waypoints"]()
+
+    def add_agent(self, name, agent_type, state=None, color=None, uid=None):
+        self.call("add_agent")
+        if agent_type == lgsvl.AgentType.EGO:
+            agent_class = FakeEgoVehicle
+        elif agent_type == lgsvl.AgentType.PEDESTRIAN:
+            agent_class = FakePedestrian
+        else:
+            agent_class = FakeNpcVehicle
+        agent = agent_class(self, uid or self.new_uid(), name, agent_type, state)
+        self.agents[agent.uid] = agent
+        return agent
+
+    def remove_agent(self, agent):
+        self.call("remove_agent")
+        self.agents.pop(agent.uid, None)
+
+    def add_random_agents(self, agent_type):
+        self.call("add_random_agents")
+        for index in range(self.random_agent_count):
+            agent_class = FakePedestrian if agent_type == lgsvl.AgentType.PEDESTRIAN else FakeNpcVehicle
+            agent = agent_class(self, self.new_uid(), f"random-{index}", agent_type, None)
+            self.agents[agent.uid] = agent
+
+    def get_agents(self):
+        self.call("get_agents")
+        return list(self.agents.values())
+
+    def agents_traversed_waypoints(self, fn):
+        self.call("agents_traversed_waypoints")
+        self.callbacks["agents_traversed_waypoints"] = fn
+
+    def get_spawn(self):
+        self.call("get_spawn")
+        return [lgsvl.Transform(lgsvl.Vector(index * 10.0, 0, 0), lgsvl.Vector(0, 0, 0))
+                for index in range(self.spawn_count)]
+
+    def map_to_gps(self, transform):
+        self.call("map_to_gps")
+        # The map origin is at northing 0, easting 0, see Tier4LgSvlBridge.to_unity_position()
+        position = transform.position
+        return lgsvl.GpsData(0.0, 0.0, -position.x, position.z, position.y, transform.rotation.y)
+
+    def set_nav_origin(self, transform, offset):
+        self.call("set_nav_origin")
+        self.nav_origin = (transform, offset)
+
+    def controllable_add(self, name, object_state=None, uid=None):
+        self.call("controllable_add")
+        transform = object_state.transform if object_state is not None else None
+        controllable = FakeControllable(self, uid or self.new_uid(), name, transform)
+        self.controllables[controllable.uid] = controllable
+        return controllable
+
+    def get_controllable_by_uid(self, uid):
+        self.call("get_controllable_by_uid")
+        if uid not in self.controllables:
+            raise ValueError(f"No controllable with uid '{uid}'")
+        return self.controllables[uid]
+
+    def get_controllables(self, control_type=None):
+        self.call("get_controllables")
+        return [controllable for controllable in self.controllables.values()
+                if control_type is None or controllable.type == control_type]
+
+    @property
+    def weather(self):
+        self.call("weather_get")
+        return self._weather
+
+    @weather.setter
+    def weather(self, weather):
+        self.call("weather_set")
+        self._weather = weather
+
+    def set_date_time(self, date_time, fixed=True):
+        self.call("set_date_time")
+        self.date_time = date_time
+        self.time_fixed = fixed
+
+    @property
+    def current_datetime(self):
+        self.call("current_datetime")
+        return self.date_time
+
+
+class FakeSimulatorInstallation():
+    """What install_fake_simulator() has set up, see uninstall()"""
+    def __init__(self, config):
+        self.config = config
+        self.instances = []
+        # The runners check that something listens on the simulator port before
+        # connecting; the kernel accepts these connections without an accept()
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.listen(64)
+        self.host, self.port = self.listener.getsockname()
+        self.saved_env = {name: os.environ.get(name)
+                          for name in ("LGSVL__SIMULATOR_HOST", "LGSVL__SIMULATOR_PORT")}
+        self.original_simulator = lgsvl.Simulator
+        os.environ["LGSVL__SIMULATOR_HOST"] = self.host
+        os.environ["LGSVL__SIMULATOR_PORT"] = str(self.port)
+        lgsvl.Simulator = self.create_simulator
+
+    def create_simulator(self, address="localhost", port=8181):
+        simulator = FakeSimulator(address, port, **self.config)
+        self.instances.append(simulator)
+        return simulator
+
+    def uninstall(self):
+        lgsvl.Simulator = self.original_simulator
+        for name, value in self.saved_env.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+        self.listener.close()
+
+
+@contextmanager
+def install_fake_simulator(**config):
+    installation = FakeSimulatorInstallation(config)
+    try:
+        yield installation
+    finally:
+        installation.uninstall()
@@ -0,0 +1,359 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2021 LG Electronics, Inc.
+#
+# This software contains code licensed as described in LICENSE.
+#
+
+"""
+Startup time, spawn cost and per-frame overhead of the scenario runners,
+measured against the fake simulator (fake_simulator.py), see README.md.
+
+Every runner package is named 'scenario_runner', so each runner is
+benchmarked in a subprocess of its own, which prints its results as a JSON
+line on the standard output.
+"""
+
+import argparse
+import importlib
+import json
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from fake_simulator import config_from_env, config_to_env, install_fake_simulator, parse_call_latency
+
+
+FORMAT = "[%(levelname)6s] [%(name)s] %(message)s"
+logging.basicConfig(level=logging.INFO, format=FORMAT)
+log = logging.getLogger("runner_benchmarks")
+
+REPORT_VERSION = 1
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPOSITORY_DIR = os.path.dirname(BENCHMARKS_DIR)
+
+RUNNER_DIRS = {
+    "autoware-auto-odd": "autoware-auto-odd-runner",
+    "vse": "vse-runner",
+    "random-traffic": "random-traffic-runner",
+    "python-api": "python-api-runner",
+}
+
+# Added to PYTHONPATH on top of the runner directory, see the 'proto' workaround
+# in tier4_lgsvl_bridge.py
+RUNNER_EXTRA_PATHS = {
+    "autoware-auto-odd": ["scenario_runner/proto"],
+}
+
+STEP_TIME_SEC = 0.05
+
+
+def summarize(samples):
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+    return {
+        "count": len(samples),
+        "mean": statistics.mean(samples),
+        "p50": ordered[int(0.50 * (len(ordered) - 1))],
+        "p95": ordered[int(0.95 * (len(ordered) - 1))],
+        "max": ordered[-1],
+    }
+
+
+def timed(function, *args):
+    started = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - started, result
+
+
+def benchmark_autoware_auto_odd(fake, agent_count, frame_count):
+    # The bridge handlers are called directly, without the ZMQ sockets,
+    # see bridge_throughput.py for the benchmark over ZMQ
+    import tier4_client
+    from scenario_runner.tier4_lgsvl_bridge import Tier4LgSvlBridge
+
+    os.environ.setdefault("LGSVL__MAP", "BorregasAve")
+    os.environ.setdefault("LGSVL__VEHICLE_0", "Lexus2016RXHybrid (Autoware.Auto)")
+    logging.getLogger("scenario_runner.tier4_lgsvl_bridge").setLevel(logging.WARNING)
+
+    def check(port, request):
+        response = bridge.handlers[port].response
+        response_bytes = bridge.process_request(port, request.SerializeToString())
+        response.ParseFromString(response_bytes)
+        if not response.result.success:
+            raise RuntimeError(f"Port {port}: {response.result.description}")
+
+    bridge = Tier4LgSvlBridge()
+    bridge.fill_handlers_lookup_table()
+    startup_sec, _ = timed(check, tier4_client.PORTS["initialize"],
+                           tier4_client.initialize_request(STEP_TIME_SEC))
+
+    names = tier4_client.entity_names(agent_count)
+    spawn_samples = [timed(check, tier4_client.spawn_port(name), tier4_client.spawn_request(name))[0]
+                     for name in names]
+
+    entity_status_request = tier4_client.entity_status_request(names).SerializeToString()
+    frame_samples = []
+    calls_before = sum(fake.instances[0].calls.values())
+    for frame in range(frame_count):
+        started = time.perf_counter()
+        # The UpdateEntityStatus response is left unparsed, parsing it in Python
+        # would cost more than answering it
+        bridge.process_request(tier4_client.PORTS["update_entity_status"], entity_status_request)
+        check(tier4_client.PORTS["update_frame"], tier4_client.update_frame_request(frame, STEP_TIME_SEC))
+        frame_samples.append(time.perf_counter() - started)
+    calls = sum(fake.instances[0].calls.values()) - calls_before
+
+    return {
+        "startup_sec": startup_sec,
+        "spawn_sec": summarize(spawn_samples),
+        "frame_sec": summarize(frame_samples),
+        "simulator_calls_per_frame": calls / frame_count if frame_count else 0.0,
+    }
+
+
+def vse_scenario(agent_count):
+    def vector(x=0.0, y=0.0, z=0.0):
+        return {"x": x, "y": y, "z": z}
+
+    def waypoints(x):
+        return [{"position": vector(x, 0, distance), "speed": 5, "angle": vector()}
+                for distance in (10.0, 20.0)]
+
+    agents = [{
+        "uid": "ego-0",
+        "variant": "Lincoln2017MKZ",
+        "type": 1,
+        "transform": {"position": vector(), "rotation": vector()},
+        "waypoints": waypoints(0.0),
+        "waypointsLoop": False,
+        "waypointsPathType": "Linear",
+    }]
+    for index in range(1, agent_count):
+        agents.append({
+            "uid": f"npc-{index}",
+            "variant": "Sedan",
+            "type": 2,
+            "transform": {"position": vector(index * 5.0), "rotation": vector()},
+            "behaviour": {"name": "NPCWaypointBehaviour"},
+            "waypoints": waypoints(index * 5.0),
+        })
+    return {"map": {"id": "fake-map", "name": "BorregasAve"}, "agents": agents}
+
+
+def benchmark_vse(fake, agent_count, frame_count):
+    from scenario_runner.run_vse import VSERunner
+
+    with tempfile.NamedTemporaryFile("wt", suffix=".json", delete=False) as f:
+        json.dump(vse_scenario(agent_count), f)
+    try:
+        started = time.perf_counter()
+        runner = VSERunner(f.name)
+        runner.setup_sim()
+        runner.load_scene()
+        startup_sec = time.perf_counter() - started
+
+        started = time.perf_counter()
+        runner.load_agents()
+        runner.spawn_egos()
+        runner.add_npc()
+        runner.add_pedestrian()
+        spawn_sec = (time.perf_counter() - started) / agent_count
+
+        runner.reset()
+        scenario_sec, _ = timed(runner.run)
+    finally:
+        os.unlink(f.name)
+
+    return {
+        "startup_sec": startup_sec,
+        "spawn_sec": {"mean": spawn_sec, "count": agent_count},
+        "scenario_sec": scenario_sec,
+    }
+
+
+def benchmark_random_traffic(fake, agent_count, frame_count):
+    for name, value in {
+        "LGSVL__MAP": "BorregasAve",
+        "LGSVL__VEHICLE_0": "Lincoln2017MKZ",
+        "LGSVL__RANDOM_SEED": "0",
+        "LGSVL__ENVIRONMENT_RAIN": "0", "LGSVL__ENVIRONMENT_FOG": "0",
+        "LGSVL__ENVIRONMENT_WETNESS": "0", "LGSVL__ENVIRONMENT_CLOUDINESS": "0",
+        "LGSVL__ENVIRONMENT_DAMAGE": "0",
+        "LGSVL__TIME_OF_DAY": "06/01/2021 12:00:00",
+        "LGSVL__SPAWN_TRAFFIC": "true", "LGSVL__SPAWN_PEDESTRIANS": "true",
+        "LGSVL__SPAWN_BICYCLES": "false",
+    }.items():
+        os.environ.setdefault(name, value)
+
+    import_sec, module = timed(importlib.import_module, "scenario_runner.run_random_traffic")
+    scenario_sec, _ = timed(module.run_random_traffic)
+
+    return {
+        "startup_sec": import_sec,
+        "scenario_sec": scenario_sec,
+    }
+
+
+PYTHON_API_SCRIPT = """
+import json, os, sys, time
+started = time.time()
+import lgsvl
+
+sim = lgsvl.Simulator(os.environ["LGSVL__SIMULATOR_HOST"], int(os.environ["LGSVL__SIMULATOR_PORT"]))
+sim.load("BorregasAve")
+spawn = []
+agents = []
+for index in range({agent_count}):
+    state = lgsvl.AgentState()
+    state.transform.position = lgsvl.Vector(index * 5.0, 0, 0)
+    spawning = time.perf_counter()
+    agents.append(sim.add_agent("Sedan", lgsvl.AgentType.NPC, state))
+    spawn.append(time.perf_counter() - spawning)
+frame = []
+for _ in range({frame_count}):
+    stepping = time.perf_counter()
+    for agent in agents:
+        state = agent.state
+        state.velocity = lgsvl.Vector(0, 0, 10.0)
+        agent.state = state
+    sim.run({step_time})
+    frame.append(time.perf_counter() - stepping)
+print(json.dumps({{"started": started, "spawn": spawn, "frame": frame}}))
+"""
+
+
+def benchmark_python_api(fake, agent_count, frame_count):
+    # The runner starts the scenario script in a subprocess, which gets the
+    # fake simulator through sitecustomize.py
+    with tempfile.NamedTemporaryFile("wt", suffix=".py", delete=False) as f:
+        f.write(PYTHON_API_SCRIPT.format(agent_count=agent_count, frame_count=frame_count,
+                                         step_time=STEP_TIME_SEC))
+    try:
+        env = dict(os.environ, LGSVL__FAKE_SIMULATOR="1")
+        launched = time.time()
+        started = time.perf_counter()
+        output = subprocess.run([sys.executable, "-m", "scenario_runner", f.name],
+                                env=env, check=True, stdout=subprocess.PIPE, text=True).stdout
+        scenario_sec = time.perf_counter() - started
+    finally:
+        os.unlink(f.name)
+
+    script_results = json.loads(output.strip().splitlines()[-1])
+    return {
+        "startup_sec": script_results["started"] - launched,
+        "spawn_sec": summarize(script_results["spawn"]),
+        "frame_sec": summarize(script_results["frame"]),
+        "scenario_sec": scenario_sec,
+    }
+
+
+BENCHMARKS = {
+    "autoware-auto-odd": benchmark_autoware_auto_odd,
+    "vse": benchmark_vse,
+    "random-traffic": benchmark_random_traffic,
+    "python-api": benchmark_python_api,
+}
+
+
+def run_benchmark(runner, agent_count, frame_count):
+    with install_fake_simulator(**config_from_env()) as fake:
+        results = BENCHMARKS[runner](fake, agent_count, frame_count)
+        # The python-api scenario runs in its own process with a fake of its own
+        if fake.instances:
+            results["simulator_calls"] = dict(fake.instances[0].calls)
+            results["simulator_latency_sec"] = fake.instances[0].latency_spent
+    return results
+
+
+def run_benchmark_subprocess(runner, args):
+    runner_dir = os.path.join(REPOSITORY_DIR, RUNNER_DIRS[runner])
+    python_path = [runner_dir, BENCHMARKS_DIR] \
+        + [os.path.join(runner_dir, path) for path in RUNNER_EXTRA_PATHS.get(runner, [])]
+    if os.environ.get("PYTHONPATH"):
+        python_path.append(os.environ["PYTHONPATH"])
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(python_path))
+    env.update(config_to_env(parse_call_latency(args.call_latency), args.scene_load_sec,
+                             random_agent_count=args.agents))
+
+    process = subprocess.run([sys.executable, os.path.abspath(__file__), "--benchmark", runner,
+                              "--agents", str(args.agents), "--frames", str(args.frames)],
+                             cwd=runner_dir, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                             text=True)
+    if process.returncode != 0:
+        log.error(f"The {runner} runner benchmark failed:\n{process.stderr}")
+        return {"error": process.stderr.strip().splitlines()[-1] if process.stderr.strip() else
+                f"exit code {process.returncode}"}
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(os.path.basename(sys.argv[0]),
+                                     description='Benchmark the scenario runners against a fake simulator')
+    parser.add_argument('--runner', action='append', choices=list(RUNNER_DIRS),
+                        help='Runner to benchmark, may be repeated (default: all)')
+    parser.add_argument('--agents', type=int, default=50,
+                        help='Number of agents to spawn (default: %(default)s)')
+    parser.add_argument('--frames', type=int, default=200,
+                        help='Number of frames to step (default: %(default)s)')
+    parser.add_argument('--call-latency', type=str, default='',
+                        help='Simulator call latency in seconds, either one for all the calls or '
+                        '"default=0.001,add_agent=0.01,..." (default: none)')
+    parser.add_argument('--scene-load-sec', type=float, default=0.0,
+                        help='Simulator scene load duration (default: %(default)s)')
+    parser.add_argument('--json-report', metavar='FILE', type=str,
+                        help='Write the report to a JSON file')
+    parser.add_argument('--benchmark', type=str, choices=list(BENCHMARKS), help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    if args.benchmark:
+        print(json.dumps(run_benchmark(args.benchmark, args.agents, args.frames)))
+        return 0
+
+    report = {
+        "version": REPORT_VERSION,
+        "timestamp": time.time(),
+        "config": {
+            "agents": args.agents,
+            "frames": args.frames,
+            "call_latency": parse_call_latency(args.call_latency),
+            "scene_load_sec": args.scene_load_sec,
+        },
+        "results": {},
+    }
+    failed = False
+    for runner in args.runner or list(RUNNER_DIRS):
+        log.info(f"Benchmarking the {runner} runner ...")
+        results = run_benchmark_subprocess(runner, args)
+        report["results"][runner] = results
+        if "error" in results:
+            failed = True
+            continue
+        line = f"{runner}: startup {results['startup_sec'] * 1000:.1f} ms"
+        if "spawn_sec" in results:
+            line += f", spawn {results['spawn_sec']['mean'] * 1000:.3f} ms/agent"
+        if "frame_sec" in results:
+            line += f", frame p50 {results['frame_sec']['p50'] * 1000:.3f} ms" \
+                f" p95 {results['frame_sec']['p95'] * 1000:.3f} ms"
+        if "scenario_sec" in results:
+            line += f", scenario {results['scenario_sec'] * 1000:.1f} ms"
+        log.info(line)
+
+    if args.json_report:
+        with open(args.json_report, "wt") as f:
+            json.dump(report, f, indent=2)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,20 @@
+#
+# Copyright (c) 2021 LG Electronics, Inc.
+#
+# This software contains code licensed as described in LICENSE.
+#
+
+"""
+Installs the fake simulator in any Python process started with this
+directory in PYTHONPATH and LGSVL__FAKE_SIMULATOR=1, e.g. the scenario script
+subprocess of the python-api runner. The fake is configured with the
+LGSVL__FAKE_SIMULATOR_* environment variables, see fake_simulator.py.
+"""
+
+import os
+
+if os.environ.get("LGSVL__FAKE_SIMULATOR") == "1":
+    from fake_simulator import FakeSimulatorInstallation, config_from_env
+
+    # Never uninstalled, the fake lives as long as the process
+    FAKE_SIMULATOR = FakeSimulatorInstallation(config_from_env())
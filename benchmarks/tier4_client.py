@@ -0,0 +1,160 @@
+#
+# Copyright (c) 2021 LG Electronics, Inc.
+#
+# This software contains code licensed as described in LICENSE.
+#
+
+"""
+Requests of the TierIV scenario runner and a synthetic client sending them to
+the Tier4LgSvlBridge ZMQ ports, the way the TierIV simulation interface does:
+Initialize, the entity spawns, then UpdateEntityStatus and UpdateFrame for
+every frame.
+
+Needs the autoware-auto-odd-runner package and its 'proto' directory in
+sys.path.
+"""
+
+import time
+
+import zmq
+
+import simulation_api_schema_pb2 as api
+from scenario_runner.bridge_metrics import LatencyHistogram
+from scenario_runner.tier4_lgsvl_bridge import DEFAULT_PORT_BASE, TIER4_API_NAMES, TIER4_API_PORTS, api_endpoint
+
+
+PORTS = {name: port for port, name in TIER4_API_NAMES.items()}
+
+# Every PEDESTRIAN_EVERY-th non-ego entity is spawned as a pedestrian
+PEDESTRIAN_EVERY = 5
+
+# The synthetic traffic lights cycle through green, yellow and red, this many
+# seconds each
+TRAFFIC_LIGHT_PHASE_SEC = 2.0
+TRAFFIC_LIGHT_CYCLE = [
+    api.TrafficLightState.LampState.GREEN,
+    api.TrafficLightState.LampState.YELLOW,
+    api.TrafficLightState.LampState.RED,
+]
+
+
+def entity_names(entity_count):
+    """The ego and entity_count - 1 NPCs"""
+    return ["ego"] + [f"entity-{index}" for index in range(1, entity_count)]
+
+
+def is_pedestrian(name):
+    return name != "ego" and int(name.rsplit("-", 1)[1]) % PEDESTRIAN_EVERY == 0
+
+
+def initialize_request(step_time, realtime_factor=0.0):
+    """With no realtime factor the bridge runs the frames as fast as it can"""
+    return api.InitializeRequest(realtime_factor=realtime_factor, step_time=step_time)
+
+
+def spawn_request(name):
+    """SpawnPedestrianEntityRequest or SpawnVehicleEntityRequest, see is_pedestrian()"""
+    request = api.SpawnPedestrianEntityRequest() if is_pedestrian(name) else api.SpawnVehicleEntityRequest()
+    request.parameters.name = name
+    return request
+
+
+def spawn_port(name):
+    return PORTS["spawn_pedestrian_entity" if is_pedestrian(name) else "spawn_vehicle_entity"]
+
+
+def entity_status_request(names, frame=0, step_time=0.05):
+    request = api.UpdateEntityStatusRequest()
+    for index, name in enumerate(names):
+        status = request.status.add()
+        status.name = name
+        status.time = frame * step_time
+        status.pose.position.x = index * 5.0 + frame * step_time * 10.0
+        status.pose.position.y = index * 2.0
+        status.pose.orientation.w = 1.0
+        status.action_status.twist.linear.x = 10.0
+    return request
+
+
+def traffic_lights_request(traffic_light_ids, frame=0, step_time=0.05):
+    request = api.UpdateTrafficLightsRequest()
+    for index, traffic_light_id in enumerate(traffic_light_ids):
+        # The traffic lights are out of phase with each other
+        phase = int(frame * step_time / TRAFFIC_LIGHT_PHASE_SEC) + index
+        state = request.states.add(id=traffic_light_id)
+        state.lamp_states.add(type=TRAFFIC_LIGHT_CYCLE[phase % len(TRAFFIC_LIGHT_CYCLE)], confidence=1.0)
+    return request
+
+
+def update_frame_request(frame, step_time):
+    request = api.UpdateFrameRequest(current_time=frame * step_time)
+    request.current_ros_time.sec = int(frame * step_time)
+    return request
+
+
+def update_sensor_frame_request(frame, step_time):
+    request = api.UpdateSensorFrameRequest(current_time=frame * step_time)
+    request.current_ros_time.sec = int(frame * step_time)
+    return request
+
+
+class SyntheticTier4Client():
+    """
+    One ZMQ REQ socket per bridge port, the round trip latencies of which are
+    recorded in 'latencies'. The ports are the TIER4_API_PORTS ones, connected
+    to at the same offsets from 'port_base', at 'api_address' (a bridge
+    LGSVL__BRIDGE_API_ADDRESS template) if given, or on 'host' over TCP.
+    """
+    def __init__(self, host="127.0.0.1", port_base=DEFAULT_PORT_BASE, api_address=None):
+        api_address = api_address or f"tcp://{host}:{{port}}"
+        # An inproc bridge is bound in the process-wide context
+        self.shared_context = api_address.startswith("inproc://")
+        self.context = zmq.Context.instance() if self.shared_context else zmq.Context()
+        self.sockets = {}
+        for port in TIER4_API_PORTS:
+            api_socket = self.context.socket(zmq.REQ)
+            api_socket.connect(api_endpoint(api_address, port_base + port - DEFAULT_PORT_BASE))
+            self.sockets[port] = api_socket
+        self.responses = {
+            PORTS["initialize"]: api.InitializeResponse(),
+            PORTS["update_frame"]: api.UpdateFrameResponse(),
+            PORTS["spawn_vehicle_entity"]: api.SpawnVehicleEntityResponse(),
+            PORTS["spawn_pedestrian_entity"]: api.SpawnPedestrianEntityResponse(),
+            PORTS["despawn_entity"]: api.DespawnEntityResponse(),
+        }
+        self.reset_latencies()
+
+    def reset_latencies(self):
+        self.latencies = {port: LatencyHistogram() for port in TIER4_API_PORTS}
+
+    def call(self, port, request_bytes):
+        api_socket = self.sockets[port]
+        sending = time.perf_counter()
+        api_socket.send(request_bytes)
+        response_bytes = api_socket.recv()
+        self.latencies[port].record(time.perf_counter() - sending)
+        return response_bytes
+
+    def call_checked(self, port, request):
+        """
+        Sends a request and raises if the response says it failed; only for
+        the ports with a response in 'responses', the rest are not parsed
+        """
+        response = self.responses[port]
+        response.ParseFromString(self.call(port, request.SerializeToString()))
+        if not response.result.success:
+            raise RuntimeError(f"{TIER4_API_NAMES[port]} failed: {response.result.description}")
+        return response
+
+    def latency_summary(self):
+        return {
+            str(port): dict(histogram.summary(), api=TIER4_API_NAMES[port])
+            for port, histogram in self.latencies.items()
+            if histogram.count
+        }
+
+    def close(self):
+        for api_socket in self.sockets.values():
+            api_socket.close(linger=0)
+        if not self.shared_context:
+            self.context.term()
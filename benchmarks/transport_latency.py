@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2021 LG Electronics, Inc.
+#
+# This software contains code licensed as described in LICENSE.
+#
+
+"""
+Round trip latency of the TierIV bridge API over the ZMQ transports the
+bridge can be bound at (see LGSVL__BRIDGE_API_ADDRESS): TCP loopback, IPC
+and inproc.
+
+For every transport, the frame-rate requests (UpdateEntityStatus of all the
+entities and UpdateFrame) are sent to a bridge running in this process
+against the fake simulator with no call latency, and the same request bytes
+to a bare REP socket echoing them back, which is the round trip of the
+transport alone. The p50/p95/p99 latencies are logged and written as a
+versioned JSON report.
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+RUNNER_DIR = os.path.join(os.path.dirname(BENCHMARKS_DIR), "autoware-auto-odd-runner")
+
+# autopep8: off
+sys.path[:0] = [RUNNER_DIR, os.path.join(RUNNER_DIR, "scenario_runner", "proto")]
+
+import zmq  # noqa: E402
+
+from fake_simulator import install_fake_simulator  # noqa: E402
+from scenario_runner.bridge_metrics import LatencyHistogram  # noqa: E402
+from scenario_runner.tier4_lgsvl_bridge import API_SOCKET_OPTIONS, Tier4LgSvlBridgeServerThread, api_endpoint  # noqa: E402
+import tier4_client  # noqa: E402
+from tier4_client import PORTS, SyntheticTier4Client  # noqa: E402
+# autopep8: on
+
+
+FORMAT = "[%(levelname)6s] [%(name)s] %(message)s"
+logging.basicConfig(level=logging.INFO, format=FORMAT)
+log = logging.getLogger("transport_latency")
+
+REPORT_VERSION = 1
+
+TRANSPORTS = ["tcp", "ipc", "inproc"]
+
+STEP_TIME_SEC = 0.05
+
+BRIDGE_STARTUP_TIMEOUT_SEC = 30
+
+# Every transport gets a bridge of its own, on a port block of its own
+PORT_BASE = 7555
+PORT_STRIDE = 100
+
+MEASURED_APIS = ["update_entity_status", "update_frame"]
+
+
+def transport_addresses(transport, ipc_dir):
+    """The (bind, connect) LGSVL__BRIDGE_API_ADDRESS templates of a transport"""
+    if transport == "tcp":
+        return "tcp://*:{port}", "tcp://127.0.0.1:{port}"
+    if transport == "ipc":
+        address = f"ipc://{ipc_dir}/tier4-bridge-{{port}}"
+        return address, address
+    address = "inproc://tier4-bridge-{port}"
+    return address, address
+
+
+def start_bridge(api_address, port_base):
+    started_up = threading.Event()
+    thread = Tier4LgSvlBridgeServerThread(started_up, api_address=api_address, port_base=port_base,
+                                          sensor_pub_address=f"inproc://tier4-bridge-sensors-{port_base}",
+                                          name=f"tier4-bridge-{port_base}")
+    thread.daemon = True
+    thread.start()
+    started_up.wait(BRIDGE_STARTUP_TIMEOUT_SEC)
+    if not started_up.is_set() or thread.startup_error is not None:
+        raise RuntimeError(f"The bridge at {api_address} failed to start up: {thread.startup_error!r}")
+
+
+def measure_bridge(client, entity_count, frame_count, warmup_frames):
+    client.call_checked(PORTS["initialize"], tier4_client.initialize_request(STEP_TIME_SEC))
+    names = tier4_client.entity_names(entity_count)
+    for name in names:
+        client.call_checked(tier4_client.spawn_port(name), tier4_client.spawn_request(name))
+    requests = [
+        (tier4_client.entity_status_request(names, frame, STEP_TIME_SEC).SerializeToString(),
+         tier4_client.update_frame_request(frame, STEP_TIME_SEC))
+        for frame in range(warmup_frames + frame_count)
+    ]
+    for frame, (entity_status, update_frame) in enumerate(requests):
+        if frame == warmup_frames:
+            client.reset_latencies()
+        client.call(PORTS["update_entity_status"], entity_status)
+        client.call_checked(PORTS["update_frame"], update_frame)
+    return {api: client.latencies[PORTS[api]].summary() for api in MEASURED_APIS}
+
+
+def measure_echo(bind_address, connect_address, message, count, warmup_count):
+    """The round trip of 'message' to a REP socket sending it back, with the bridge's socket options"""
+    context = zmq.Context.instance() if bind_address.startswith("inproc://") else zmq.Context()
+    echo = context.socket(zmq.REP)
+    for option, value in API_SOCKET_OPTIONS.items():
+        echo.setsockopt(option, value)
+    echo.bind(bind_address)
+
+    def serve():
+        for _ in range(warmup_count + count):
+            echo.send(echo.recv(copy=False), copy=False)
+
+    server = threading.Thread(target=serve, daemon=True)
+    server.start()
+    client = context.socket(zmq.REQ)
+    client.connect(connect_address)
+    histogram = LatencyHistogram()
+    for index in range(warmup_count + count):
+        sending = time.perf_counter()
+        client.send(message)
+        client.recv()
+        if index >= warmup_count:
+            histogram.record(time.perf_counter() - sending)
+    server.join()
+    client.close(linger=0)
+    echo.close()
+    if context is not zmq.Context.instance():
+        context.term()
+    return histogram.summary()
+
+
+def run(args):
+    results = {}
+    names = tier4_client.entity_names(args.entities)
+    echo_message = tier4_client.entity_status_request(names, 0, STEP_TIME_SEC).SerializeToString()
+    with install_fake_simulator(), tempfile.TemporaryDirectory(prefix="tier4-bridge-ipc-") as ipc_dir:
+        os.environ.setdefault("LGSVL__MAP", "BorregasAve")
+        os.environ.setdefault("LGSVL__VEHICLE_0", "Lexus2016RXHybrid (Autoware.Auto)")
+        for index, transport in enumerate(args.transports):
+            bind_address, connect_address = transport_addresses(transport, ipc_dir)
+            port_base = PORT_BASE + index * PORT_STRIDE
+            start_bridge(bind_address, port_base)
+            logging.getLogger("scenario_runner.tier4_lgsvl_bridge").setLevel(logging.WARNING)
+            client = SyntheticTier4Client(port_base=port_base, api_address=connect_address)
+            try:
+                result = measure_bridge(client, args.entities, args.frames, args.warmup_frames)
+            finally:
+                client.close()
+            # The port just below the bridge's block is free
+            echo_port = port_base - 1
+            result["echo"] = measure_echo(api_endpoint(bind_address, echo_port),
+                                          api_endpoint(connect_address, echo_port),
+                                          echo_message, args.frames, args.warmup_frames)
+            results[transport] = result
+            log.info(f"{transport}: " + ", ".join(
+                f"{name} p50 {latency['p50'] * 1e6:.0f} us, p99 {latency['p99'] * 1e6:.0f} us"
+                for name, latency in result.items()))
+
+    return {
+        "version": REPORT_VERSION,
+        "timestamp": time.time(),
+        "config": {
+            "entities": args.entities,
+            "frames": args.frames,
+            "warmup_frames": args.warmup_frames,
+            "echo_message_bytes": len(echo_message),
+            "python": platform.python_version(),
+            "pyzmq": zmq.__version__,
+            "libzmq": zmq.zmq_version(),
+            "machine": platform.machine(),
+        },
+        "results": results,
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(os.path.basename(sys.argv[0]),
+                                     description='Benchmark the TierIV bridge round trip latency per ZMQ transport')
+    parser.add_argument('--transports', choices=TRANSPORTS, nargs='+', default=TRANSPORTS,
+                        help='Transports to benchmark (default: %(default)s)')
+    parser.add_argument('--entities', type=int, default=10,
+                        help='Entities in every UpdateEntityStatus request (default: %(default)s)')
+    parser.add_argument('--frames', type=int, default=2000,
+                        help='Measured frames per transport (default: %(default)s)')
+    parser.add_argument('--warmup-frames', type=int, default=200,
+                        help='Frames sent before measuring (default: %(default)s)')
+    parser.add_argument('--json-report', metavar='FILE', type=str,
+                        help='Write the report to a JSON file')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    report = run(args)
+    if args.json_report:
+        with open(args.json_report, "wt") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())